@@ -6,6 +6,7 @@ Sky Editor 启动脚本
 
 import sys
 import os
+import multiprocessing
 
 # 添加当前目录到Python路径
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -143,4 +144,6 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    # 打包环境中使用进程池需要
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
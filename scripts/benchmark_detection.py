@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+星点检测性能测试
+比较原来的逐轮廓 cv2.moments 检测与外接框内向量化测量的检测，
+默认在 24MP (4000×6000) 的8位合成帧上测试 1500 和 20000 个星点
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.modules.stacking.processor import AstroStacker
+
+
+def make_frame(stars: int, height: int, width: int) -> np.ndarray:
+    """生成带噪声背景和亚像素高斯星点的RGB帧"""
+    rng = np.random.default_rng(0)
+    canvas = rng.normal(20, 4, size=(height, width)).astype(np.float32)
+    offsets = np.arange(-4, 5)
+    ys = rng.uniform(5, height - 5, stars)
+    xs = rng.uniform(5, width - 5, stars)
+    amplitude = rng.uniform(60, 230, stars).astype(np.float32)
+    rows = ys.astype(np.int64)[:, None] + offsets
+    cols = xs.astype(np.int64)[:, None] + offsets
+    profile = (amplitude[:, None, None] *
+               np.exp(-(((rows - ys[:, None]) ** 2)[:, :, None] + ((cols - xs[:, None]) ** 2)[:, None, :])
+                      / (2 * 1.5 ** 2)))
+    np.add.at(canvas, (rows[:, :, None], cols[:, None, :]), profile.astype(np.float32))
+    gray = np.clip(canvas, 0, 255).astype(np.uint8)
+    return np.dstack([gray, gray, gray])
+
+
+def baseline_detect(image: np.ndarray, params: dict, max_features: int) -> list:
+    """原来的检测：整幅图像找轮廓，逐个轮廓计算面积和矩，再按质心处的亮度排序"""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    blurred = cv2.GaussianBlur(gray, (0, 0), params['gaussian_blur'])
+    _, thresh = cv2.threshold(blurred, params['threshold'], 255, cv2.THRESH_BINARY)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    star_points = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if params['min_area'] <= area <= params['max_area']:
+            M = cv2.moments(contour)
+            if M["m00"] != 0:
+                star_points.append((M["m10"] / M["m00"], M["m01"] / M["m00"]))
+
+    if len(star_points) > max_features:
+        star_brightness = []
+        for x, y in star_points:
+            x, y = int(x), int(y)
+            if 0 <= x < gray.shape[1] and 0 <= y < gray.shape[0]:
+                star_brightness.append((float(gray[y, x]), (x, y)))
+        star_brightness.sort(reverse=True)
+        star_points = [point for _, point in star_brightness[:max_features]]
+    return star_points
+
+
+def best_time(function, repeat: int) -> float:
+    """多次运行取最短耗时（秒）"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="星点检测性能测试")
+    parser.add_argument('--stars', type=int, nargs='+', default=[1500, 20000], help="星点数")
+    parser.add_argument('--size', type=int, nargs=2, default=[4000, 6000], metavar=('H', 'W'), help="帧尺寸")
+    parser.add_argument('--threads', type=int, default=1, help="OpenCV线程数，0表示OpenCV默认")
+    parser.add_argument('--repeat', type=int, default=5, help="重复次数")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    if args.threads:
+        cv2.setNumThreads(args.threads)
+    stacker = AstroStacker()
+    params = stacker.star_detection_params
+    max_features = stacker.alignment_params['max_features']
+
+    height, width = args.size
+    print(f"帧尺寸 {height}×{width}×3，OpenCV线程数 {cv2.getNumThreads()}")
+    print(f"{'星点':>7} {'检测到':>7} {'原方法(ms)':>11} {'外接框测量(ms)':>15} {'加速':>7}")
+
+    for stars in args.stars:
+        image = make_frame(stars, height, width)
+        baseline = best_time(lambda: baseline_detect(image, params, max_features), args.repeat)
+        measured = best_time(lambda: stacker.detect_star_catalog(image), args.repeat)
+        found = stacker.detect_star_catalog(image)['count']
+        print(f"{stars:>7} {found:>7} {baseline * 1000:>11.1f} {measured * 1000:>15.1f} "
+              f"{baseline / measured:>6.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
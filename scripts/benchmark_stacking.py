@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+中值堆叠性能测试
+比较原来的 float32 副本 + np.median 与按行带部分选择的整数中值，
+默认测试 20/50/200 帧的 uint8 和 uint16 帧立方体
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.modules.stacking.selection import median_stack
+
+
+def make_cube(frames: int, height: int, width: int, dtype) -> np.ndarray:
+    """生成带噪声的帧立方体"""
+    rng = np.random.default_rng(0)
+    limit = np.iinfo(dtype).max
+    cube = rng.normal(limit * 0.2, limit * 0.02, size=(frames, height, width, 3))
+    return np.clip(cube, 0, limit).astype(dtype)
+
+
+def best_time(function, repeat: int) -> float:
+    """多次运行取最短耗时（秒）"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="中值堆叠性能测试")
+    parser.add_argument('--frames', type=int, nargs='+', default=[20, 50, 200], help="帧数")
+    parser.add_argument('--size', type=int, nargs=2, default=[400, 600], metavar=('H', 'W'),
+                        help="帧尺寸，原方法另需两份float32帧立方体（副本和 np.median 的内部副本）")
+    parser.add_argument('--workers', type=int, default=0, help="线程数，0表示CPU核数")
+    parser.add_argument('--budget', type=float, default=256, help="中值选择的内存预算 (MB)")
+    parser.add_argument('--repeat', type=int, default=3, help="重复次数")
+    args = parser.parse_args()
+
+    height, width = args.size
+    print(f"帧尺寸 {height}×{width}×3，线程数 {args.workers or os.cpu_count()}")
+    print(f"{'帧数':>6} {'类型':>8} {'原方法(s)':>10} {'部分选择(s)':>12} {'加速':>7}")
+
+    for frames in args.frames:
+        for dtype in (np.uint8, np.uint16):
+            cube = make_cube(frames, height, width, dtype)
+
+            # 原来的路径：整个立方体转换为float32后 np.median
+            baseline = best_time(lambda: np.median(cube.astype(np.float32), axis=0), args.repeat)
+            selected = best_time(lambda: median_stack(cube, args.workers, args.budget), args.repeat)
+
+            if not np.array_equal(median_stack(cube, args.workers, args.budget),
+                                  np.median(cube, axis=0)):
+                print(f"结果不一致: {frames}帧 {np.dtype(dtype).name}")
+                return 1
+            print(f"{frames:>6} {np.dtype(dtype).name:>8} {baseline:>10.3f} {selected:>12.3f} "
+                  f"{baseline / selected:>6.1f}x")
+            del cube
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
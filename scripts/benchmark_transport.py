@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程间帧传输性能测试
+工作进程生成帧后交给主进程累加，比较三种传输方式：
+pickle（返回数组）、共享内存帧槽（生成后复制入槽，对应RAW解码）、
+共享内存帧槽（直接写入槽，对应带 dst 的 warpAffine）
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.modules.stacking.transport import FrameRing, attach_ring, start_resource_tracker, write_slot
+
+
+def make_frame(index: int, shape, dtype) -> np.ndarray:
+    """工作进程：生成一帧并随返回值pickle传回"""
+    return np.full(shape, index, dtype=dtype)
+
+
+def copy_to_slot(index: int, spec, slot: int):
+    """工作进程：生成一帧后复制到帧槽"""
+    _, _, shape, dtype = spec
+    return write_slot(spec, slot, np.full(shape, index, dtype=dtype))
+
+
+def fill_slot(index: int, spec, slot: int):
+    """工作进程：直接在帧槽中生成一帧"""
+    attach_ring(spec).view(slot).fill(index)
+
+
+def run_pickled(pool, frames: int, shape, dtype, depth: int) -> np.ndarray:
+    total = np.zeros(shape, dtype=np.float32)
+    pending = deque()
+    for index in range(frames):
+        pending.append(pool.submit(make_frame, index, shape, dtype))
+        if len(pending) >= depth:
+            np.add(total, pending.popleft().result(), out=total)
+    while pending:
+        np.add(total, pending.popleft().result(), out=total)
+    return total
+
+
+def run_shared(pool, worker, frames: int, shape, dtype, depth: int) -> np.ndarray:
+    total = np.zeros(shape, dtype=np.float32)
+    with FrameRing(depth, shape, dtype) as ring:
+        def collect(future, slot):
+            future.result()
+            np.add(total, ring.view(slot), out=total)
+            ring.release(slot)
+
+        pending = deque()
+        for index in range(frames):
+            slot = ring.acquire()
+            pending.append((pool.submit(worker, index, ring.spec, slot), slot))
+            if len(pending) >= depth:
+                collect(*pending.popleft())
+        while pending:
+            collect(*pending.popleft())
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="进程间帧传输性能测试")
+    parser.add_argument('--frames', type=int, default=24, help="帧数")
+    parser.add_argument('--size', type=int, nargs=2, default=[2000, 3000], metavar=('H', 'W'), help="帧尺寸")
+    parser.add_argument('--dtype', choices=['uint8', 'uint16', 'float32'], default='uint16', help="数据类型")
+    parser.add_argument('--workers', type=int, default=2, help="工作进程数")
+    parser.add_argument('--repeat', type=int, default=3, help="重复次数")
+    args = parser.parse_args()
+
+    shape = (args.size[0], args.size[1], 3)
+    dtype = np.dtype(args.dtype)
+    depth = args.workers * 2
+    frame_mb = np.prod(shape) * dtype.itemsize / 1024 ** 2
+    print(f"帧尺寸 {shape[0]}×{shape[1]}×3 {dtype.name} ({frame_mb:.0f} MB)，"
+          f"{args.frames} 帧，{args.workers} 个工作进程")
+
+    start_resource_tracker()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # 预热：启动工作进程
+        list(pool.map(abs, range(args.workers)))
+
+        runs = {
+            'pickle': lambda: run_pickled(pool, args.frames, shape, dtype, depth),
+            '共享内存(复制入槽)': lambda: run_shared(pool, copy_to_slot, args.frames, shape, dtype, depth),
+            '共享内存(直接写入)': lambda: run_shared(pool, fill_slot, args.frames, shape, dtype, depth),
+        }
+        expected = run_pickled(pool, args.frames, shape, dtype, depth)
+
+        print(f"{'传输方式':<12} {'耗时(s)':>9} {'吞吐(MB/s)':>11} {'加速':>7}")
+        baseline = None
+        for name, run in runs.items():
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                total = run()
+                times.append(time.perf_counter() - start)
+            if not np.array_equal(total, expected):
+                print(f"结果不一致: {name}")
+                return 1
+            best = min(times)
+            baseline = baseline or best
+            print(f"{name:<12} {best:>9.3f} {args.frames * frame_mb / best:>11.0f} {baseline / best:>6.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
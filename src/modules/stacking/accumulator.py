@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式堆叠累加器
+逐帧折叠对齐后的图像，峰值内存只取决于单帧大小而与帧数无关
+"""
+
+import numpy as np
+from typing import Optional, Dict, Any
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 支持流式堆叠的方法
+STREAMING_METHODS = ('average', 'maximum', 'sigma_clip')
+
+
+class StreamingAccumulator:
+    """流式累加器基类"""
+
+    # 需要遍历全部帧的次数
+    passes = 1
+    # state() 保存的属性（数组或数值），用于写入检查点后继续累加
+    state_attributes = ()
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = dtype
+        self.count = 0  # 当前遍中已累加的帧数
+        self.current_pass = 0
+
+    def add(self, frame: np.ndarray, weight: float = 1.0):
+        """累加一帧图像，weight 为帧的质量权重（只有平均累加器使用）"""
+        raise NotImplementedError
+
+    def needs_another_pass(self) -> bool:
+        """是否还需要再遍历一次所有帧"""
+        return self.current_pass + 1 < self.passes
+
+    def next_pass(self):
+        """进入下一遍遍历"""
+        self.current_pass += 1
+
+    def result(self) -> Optional[np.ndarray]:
+        """返回堆叠结果（浮点数组）"""
+        raise NotImplementedError
+
+    def state(self) -> Dict[str, Any]:
+        """当前的累加状态（遍数、帧数和部分和等），数组不复制"""
+        state = {'current_pass': self.current_pass, 'count': self.count}
+        state.update((name, getattr(self, name)) for name in self.state_attributes)
+        return state
+
+    def load_state(self, state: Dict[str, Any]):
+        """恢复 state() 保存的累加状态"""
+        self.current_pass = int(state['current_pass'])
+        self.count = int(state['count'])
+        for name in self.state_attributes:
+            value = state.get(name)
+            if isinstance(value, np.ndarray) and value.dtype.kind == 'f':
+                value = value.astype(self.dtype, copy=False)
+            setattr(self, name, value)
+
+
+class MeanAccumulator(StreamingAccumulator):
+    """平均值累加器（加权和/权重和，权重都为1时即 sum/count）"""
+
+    state_attributes = ('sum', 'weight')
+
+    def __init__(self, dtype=np.float32):
+        super().__init__(dtype)
+        self.sum = None
+        self.weight = 0.0  # 已累加帧的权重之和
+
+    def add(self, frame: np.ndarray, weight: float = 1.0):
+        if self.sum is None:
+            self.sum = np.zeros(frame.shape, dtype=self.dtype)
+        if weight == 1.0:
+            np.add(self.sum, frame, out=self.sum)
+        else:
+            self.sum += np.multiply(frame, weight, dtype=self.dtype)
+        self.weight += weight
+        self.count += 1
+
+    def result(self) -> Optional[np.ndarray]:
+        if self.sum is None or self.weight <= 0:
+            return None
+        return self.sum / self.weight
+
+
+class MaxAccumulator(StreamingAccumulator):
+    """最大值累加器"""
+
+    state_attributes = ('max',)
+
+    def __init__(self, dtype=np.float32):
+        super().__init__(dtype)
+        self.max = None
+
+    def add(self, frame: np.ndarray, weight: float = 1.0):
+        if self.max is None:
+            self.max = frame.astype(self.dtype)
+        else:
+            np.maximum(self.max, frame, out=self.max)
+        self.count += 1
+
+    def result(self) -> Optional[np.ndarray]:
+        return self.max
+
+
+class SigmaClipAccumulator(StreamingAccumulator):
+    """
+    迭代Sigma裁剪累加器，结果与内存模式的迭代Kappa-Sigma裁剪（rejection.kappa_sigma）一致
+
+    每一遍累加保留样本的和与平方和（float64，整数帧的统计量与内存模式一样精确），
+    得到下一次裁剪所用的均值和标准差；第一遍保留全部样本，之后每一遍只保留落在此前每次
+    [mean - low*std, mean + high*std] 范围内的样本（已拒绝的样本不再恢复）。
+    此前各次范围的交集仍是一个区间，只保存交集的上下界和最近一次裁剪的均值、标准差，
+    状态大小与迭代次数无关。
+    最多裁剪 iterations 次，某一遍没有新拒绝的样本时提前结束；
+    某个像素拒绝的样本数超过 rejection_ratio 时，该像素保持上一次迭代的结果
+    """
+
+    state_attributes = ('sum', 'squares', 'valid', 'lower', 'upper', 'center', 'spread', 'frozen',
+                        'frames', 'changed')
+
+    def __init__(self, sigma_low: float = 2.0, sigma_high: float = 2.0, iterations: int = 3,
+                 rejection_ratio: float = 1.0, dtype=np.float32):
+        super().__init__(dtype)
+        self.sigma_low = sigma_low
+        self.sigma_high = sigma_high
+        self.rejection_ratio = rejection_ratio
+        self.passes = max(1, iterations) + 1
+        self.sum = None  # 本遍保留样本的和
+        self.squares = None  # 本遍保留样本的平方和
+        self.valid = None  # 本遍各像素保留的样本数（第一遍为None，即全部帧）
+        self.lower = None  # 最近一次之前各次裁剪范围交集的下界
+        self.upper = None  # 最近一次之前各次裁剪范围交集的上界
+        self.center = None  # 最近一次裁剪的均值
+        self.spread = None  # 最近一次裁剪的标准差
+        self.frozen = None  # 拒绝数超过限制、不再裁剪的像素（限制拒绝数时才有）
+        self.frames = 0  # 帧数
+        self.changed = False  # 本遍是否有新拒绝的样本
+
+    def add(self, frame: np.ndarray, weight: float = 1.0):
+        if self.sum is None:
+            self.sum = np.zeros(frame.shape, dtype=np.float64)
+            self.squares = np.zeros(frame.shape, dtype=np.float64)
+
+        self.count += 1
+        if self.current_pass == 0:
+            self.sum += frame
+            self.squares += np.square(frame, dtype=np.float64)
+            return
+
+        mask = (frame >= self.lower) & (frame <= self.upper)
+        clipped = mask & ~self._within(frame)
+        if not self.changed:
+            self.changed = bool(clipped.any())
+        mask &= ~clipped
+        self.valid += mask
+        np.add(self.sum, frame, out=self.sum, where=mask)
+        np.add(self.squares, np.square(frame, dtype=np.float64), out=self.squares, where=mask)
+
+    def _within(self, frame: np.ndarray) -> np.ndarray:
+        """样本是否落在最近一次裁剪的范围内（偏差的计算方式与 kappa_sigma 相同），不再裁剪的像素总在范围内"""
+        deviation = np.subtract(frame, self.center, dtype=np.float32)
+        within = (deviation >= -self.sigma_low * self.spread) & (deviation <= self.sigma_high * self.spread)
+        if self.frozen is not None:
+            within |= self.frozen
+        return within
+
+    def needs_another_pass(self) -> bool:
+        # 某一遍没有新拒绝的样本时，之后的裁剪都不会再改变结果
+        return super().needs_another_pass() and (self.current_pass == 0 or self.changed)
+
+    def _cap(self) -> int:
+        """每个像素最多可以拒绝的帧数，至少允许拒绝一帧（与 rejection.max_rejected 相同）"""
+        return max(1, int(np.ceil(self.rejection_ratio * self.frames)))
+
+    def _exceeded(self) -> Optional[np.ndarray]:
+        """本遍拒绝数新超过限制的像素，不限制拒绝数时为None"""
+        if self.valid is None or self.frozen is None:
+            return None
+        return (self.frames - self.valid.astype(np.int64) > self._cap()) & ~self.frozen
+
+    def _statistics(self):
+        """本遍保留样本的均值和标准差"""
+        count = self.count if self.valid is None else np.maximum(self.valid, 1)
+        mean = self.sum / count
+        variance = np.maximum(self.squares / count - mean * mean, 0)
+        return mean.astype(np.float32), np.sqrt(variance).astype(np.float32)
+
+    def next_pass(self):
+        super().next_pass()
+        if self.sum is None:
+            return
+
+        if self.current_pass == 1:
+            self.frames = self.count
+            self.lower = np.full(self.sum.shape, -np.inf, dtype=np.float32)
+            self.upper = np.full(self.sum.shape, np.inf, dtype=np.float32)
+            if self._cap() < self.frames:
+                self.frozen = np.zeros(self.sum.shape, dtype=bool)
+        else:
+            # 拒绝过多的像素恢复最近一次裁剪前的样本，之后不再裁剪；其余像素把最近一次裁剪并入交集
+            exceeded = self._exceeded()
+            if exceeded is not None:
+                self.frozen |= exceeded
+            fold = ~self.frozen if self.frozen is not None else True
+            np.maximum(self.lower, self.center - self.sigma_low * self.spread, out=self.lower, where=fold)
+            np.minimum(self.upper, self.center + self.sigma_high * self.spread, out=self.upper, where=fold)
+
+        self.center, self.spread = self._statistics()
+
+        self.sum.fill(0)
+        self.squares.fill(0)
+        self.valid = np.zeros(self.sum.shape, dtype=np.uint32)
+        self.changed = False
+        self.count = 0
+
+    def result(self) -> Optional[np.ndarray]:
+        if self.sum is None or self.valid is None:
+            return None
+        # 没有样本保留的像素为0，与内存模式一致
+        result = (self.sum / np.maximum(self.valid, 1)).astype(self.dtype)
+        exceeded = self._exceeded()
+        if exceeded is not None and exceeded.any():
+            # 最后一遍才超过限制的像素取上一次迭代的均值
+            result[exceeded] = self.center[exceeded]
+        return result
+
+
+class RunningSigmaClipAccumulator(StreamingAccumulator):
+    """
+    单遍Sigma裁剪累加器（实时堆叠用）
+
+    新帧的每个像素用此前所有帧的Welford均值和方差判断是否裁剪，再更新统计量，
+    任何时候都可以取得当前结果；帧数少于 min_frames 时统计量不可靠，不做裁剪
+    """
+
+    def __init__(self, sigma_low: float = 2.0, sigma_high: float = 2.0, min_frames: int = 3,
+                 dtype=np.float32):
+        super().__init__(dtype)
+        self.sigma_low = sigma_low
+        self.sigma_high = sigma_high
+        self.min_frames = min_frames
+        self.mean = None
+        self.m2 = None
+        self.delta = None  # 复用的临时缓冲区
+        self.sum = None
+        self.valid = None
+
+    def add(self, frame: np.ndarray, weight: float = 1.0):
+        if self.mean is None:
+            self.mean = np.zeros(frame.shape, dtype=self.dtype)
+            self.m2 = np.zeros(frame.shape, dtype=self.dtype)
+            self.delta = np.empty(frame.shape, dtype=self.dtype)
+            self.sum = np.zeros(frame.shape, dtype=self.dtype)
+            self.valid = np.zeros(frame.shape, dtype=np.uint32)
+
+        if self.count >= self.min_frames:
+            std = np.sqrt(self.m2 / self.count)
+            mask = (frame >= self.mean - self.sigma_low * std) & (frame <= self.mean + self.sigma_high * std)
+            np.add(self.sum, frame, out=self.sum, where=mask)
+            self.valid += mask
+        else:
+            np.add(self.sum, frame, out=self.sum)
+            self.valid += 1
+
+        # 被裁剪的像素同样计入统计量，否则持续变化的背景（如天光渐亮）会被一直拒绝
+        self.count += 1
+        np.subtract(frame, self.mean, out=self.delta)
+        self.mean += self.delta / self.count
+        self.m2 += self.delta * (frame - self.mean)
+
+    def result(self) -> Optional[np.ndarray]:
+        if self.sum is None:
+            return None
+        valid = np.where(self.valid == 0, 1, self.valid)
+        return self.sum / valid
+
+
+def create_accumulator(method: str, stacking_params: Dict[str, Any],
+                       dtype=np.float32) -> StreamingAccumulator:
+    """根据堆叠方法创建对应的流式累加器"""
+    if method == 'maximum':
+        return MaxAccumulator(dtype)
+    if method == 'sigma_clip':
+        return SigmaClipAccumulator(
+            sigma_low=stacking_params.get('sigma_low', 2.0),
+            sigma_high=stacking_params.get('sigma_high', 2.0),
+            iterations=stacking_params.get('clip_iterations', 3),
+            rejection_ratio=stacking_params.get('rejection_ratio', 1.0),
+            dtype=dtype
+        )
+    if method != 'average':
+        logger.warning(f"堆叠方法 {method} 不支持流式处理，使用平均堆叠")
+    return MeanAccumulator(dtype)
+
+
+def create_live_accumulator(method: str, stacking_params: Dict[str, Any],
+                            dtype=np.float32) -> StreamingAccumulator:
+    """创建实时堆叠用的单遍累加器，每加入一帧后都可以取得当前结果"""
+    if method in ('sigma_clip', 'winsorized_sigma'):
+        return RunningSigmaClipAccumulator(
+            sigma_low=stacking_params.get('sigma_low', 2.0),
+            sigma_high=stacking_params.get('sigma_high', 2.0),
+            dtype=dtype
+        )
+    return create_accumulator(method, stacking_params, dtype)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+星组（三角形不变量）索引
+用星点三角形的边长比作为与平移、旋转、缩放无关的特征，
+在帧间存在大幅位移或视场旋转时仍能找到可靠的星点对应关系
+"""
+
+import numpy as np
+from typing import Tuple
+import logging
+
+from .matching import KDTREE_SUPPORT, two_nearest_neighbors
+
+if KDTREE_SUPPORT:
+    from scipy.spatial import cKDTree
+
+logger = logging.getLogger(__name__)
+
+
+def _nearest_neighbor_indices(points: np.ndarray, k: int) -> np.ndarray:
+    """返回每个点的k个最近邻索引（不含自身）"""
+    if KDTREE_SUPPORT:
+        _, idx = cKDTree(points).query(points, k=k + 1)
+        return idx[:, 1:]
+
+    squared = (points ** 2).sum(axis=1)
+    d = squared[:, None] + squared[None, :] - 2.0 * points @ points.T
+    np.fill_diagonal(d, np.inf)
+    idx = np.argpartition(d, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(d, idx, axis=1), axis=1)
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def build_triangles(points: np.ndarray, num_neighbors: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    由每个星点及其近邻构造三角形
+
+    Returns:
+        (invariants, vertices)
+        invariants: (T, 2) 边长比 (a/c, b/c)，a <= b <= c
+        vertices: (T, 3) 三角形顶点索引，依次为最短、中等、最长边所对的顶点
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(points)
+    if n < 3:
+        return np.empty((0, 2)), np.empty((0, 3), dtype=np.int64)
+
+    k = min(num_neighbors, n - 1)
+    neighbors = _nearest_neighbor_indices(points, k)
+
+    # 每个星点与其任意两个近邻组成三角形
+    pair_i, pair_j = np.triu_indices(k, 1)
+    triangles = np.column_stack([
+        np.repeat(np.arange(n), len(pair_i)),
+        neighbors[:, pair_i].ravel(),
+        neighbors[:, pair_j].ravel(),
+    ])
+    triangles = np.unique(np.sort(triangles, axis=1), axis=0)
+
+    # 顶点v所对的边长
+    p = points[triangles]
+    opposite = np.column_stack([
+        np.linalg.norm(p[:, 1] - p[:, 2], axis=1),
+        np.linalg.norm(p[:, 0] - p[:, 2], axis=1),
+        np.linalg.norm(p[:, 0] - p[:, 1], axis=1),
+    ])
+
+    # 按对边长度排序顶点，使对应三角形的顶点顺序一致
+    order = np.argsort(opposite, axis=1)
+    sides = np.take_along_axis(opposite, order, axis=1)
+    vertices = np.take_along_axis(triangles, order, axis=1)
+
+    valid = sides[:, 2] > 0
+    invariants = sides[valid, :2] / sides[valid, 2:3]
+    return invariants, vertices[valid]
+
+
+class AsterismIndex:
+    """参考星点的三角形不变量索引"""
+
+    def __init__(self, ref_points, num_neighbors: int = 5, tolerance: float = 0.01):
+        self.ref_points = np.asarray(ref_points, dtype=np.float64).reshape(-1, 2)
+        self.num_neighbors = num_neighbors
+        self.tolerance = tolerance
+        self.invariants, self.vertices = build_triangles(self.ref_points, num_neighbors)
+        logger.info(f"构建星组索引: {len(self.ref_points)} 个星点, {len(self.invariants)} 个三角形")
+
+    def match(self, cur_points, min_votes: int = 2) -> np.ndarray:
+        """
+        通过三角形不变量查找星点对应关系
+
+        Returns:
+            匹配索引对 (K, 2)，每行为 (参考星点索引, 当前星点索引)
+        """
+        cur_points = np.asarray(cur_points, dtype=np.float64).reshape(-1, 2)
+        cur_invariants, cur_vertices = build_triangles(cur_points, self.num_neighbors)
+        if len(cur_invariants) == 0 or len(self.invariants) == 0:
+            return np.empty((0, 2), dtype=np.int64)
+
+        dist, idx = two_nearest_neighbors(self.invariants, cur_invariants, self.tolerance)
+        found = np.isfinite(dist[:, 0])
+        if not np.any(found):
+            return np.empty((0, 2), dtype=np.int64)
+
+        # 每对相似三角形为其三组对应顶点投票
+        ref_votes = self.vertices[idx[found, 0]].ravel()
+        cur_votes = cur_vertices[found].ravel()
+        codes = ref_votes * len(cur_points) + cur_votes
+        codes, counts = np.unique(codes, return_counts=True)
+
+        keep = counts >= min_votes
+        codes, counts = codes[keep], counts[keep]
+
+        # 按票数从高到低，保证每个星点只出现在一个匹配中
+        order = np.argsort(-counts, kind='stable')
+        ref_idx = codes[order] // len(cur_points)
+        cur_idx = codes[order] % len(cur_points)
+
+        _, first_ref = np.unique(ref_idx, return_index=True)
+        first_ref = np.sort(first_ref)
+        ref_idx, cur_idx = ref_idx[first_ref], cur_idx[first_ref]
+        _, first_cur = np.unique(cur_idx, return_index=True)
+        first_cur = np.sort(first_cur)
+
+        return np.column_stack([ref_idx[first_cur], cur_idx[first_cur]]).astype(np.int64)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+堆叠缓存
+在图像所在目录保存一个SQLite文件，记录每帧的星点列表、质量指标和对齐变换矩阵，
+以文件内容指纹和检测/对齐参数为键，重复堆叠时可以跳过星点检测和配准
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 计算文件指纹时读取的首尾字节数
+_FINGERPRINT_BYTES = 64 * 1024
+
+
+def file_fingerprint(path: str) -> str:
+    """根据文件大小、修改时间和首尾内容计算文件指纹"""
+    stat = os.stat(path)
+    digest = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(_FINGERPRINT_BYTES))
+        if stat.st_size > _FINGERPRINT_BYTES:
+            f.seek(max(stat.st_size - _FINGERPRINT_BYTES, _FINGERPRINT_BYTES))
+            digest.update(f.read(_FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+
+def params_key(params: Dict[str, Any]) -> str:
+    """将参数字典转换为稳定的缓存键"""
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class StackingCache:
+    """基于SQLite的堆叠缓存，可在多个线程和进程间共享"""
+
+    FILENAME = '.sky_editor_cache.sqlite'
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._fingerprints = {}  # {路径: (大小, 修改时间, 指纹)}
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS stars ("
+                "frame TEXT NOT NULL, params TEXT NOT NULL, data BLOB NOT NULL, "
+                "PRIMARY KEY (frame, params))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS quality ("
+                "frame TEXT NOT NULL, params TEXT NOT NULL, data TEXT NOT NULL, "
+                "PRIMARY KEY (frame, params))"
+            )
+            # matrix为NULL表示该帧对齐失败
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS transforms ("
+                "reference TEXT NOT NULL, frame TEXT NOT NULL, params TEXT NOT NULL, matrix BLOB, "
+                "PRIMARY KEY (reference, frame, params))"
+            )
+
+    @classmethod
+    def location(cls, image_paths: List[str], directory: Optional[str] = None) -> Optional[str]:
+        """缓存文件路径：指定目录或第一张图像所在目录"""
+        if directory:
+            return str(Path(directory) / cls.FILENAME)
+        if not image_paths or not Path(image_paths[0]).is_file():
+            return None
+        return str(Path(image_paths[0]).resolve().parent / cls.FILENAME)
+
+    @classmethod
+    def open(cls, path: Optional[str]) -> Optional['StackingCache']:
+        """打开缓存，无法写入时返回None"""
+        if path is None:
+            return None
+        try:
+            return cls(path)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"无法打开堆叠缓存 {path}: {e}")
+            return None
+
+    def frame_key(self, path: str) -> Optional[str]:
+        """返回图像文件的指纹，文件不存在时返回None"""
+        try:
+            stat = os.stat(path)
+            cached = self._fingerprints.get(path)
+            if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+                return cached[2]
+            fingerprint = file_fingerprint(path)
+            self._fingerprints[path] = (stat.st_size, stat.st_mtime_ns, fingerprint)
+            return fingerprint
+        except OSError:
+            return None
+
+    def get_stars(self, path: str, params: Dict[str, Any]) -> Optional[List[Tuple[float, float]]]:
+        """读取缓存的星点列表，未命中时返回None"""
+        frame = self.frame_key(path)
+        if frame is None:
+            return None
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT data FROM stars WHERE frame = ? AND params = ?", (frame, params_key(params))
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取星点缓存失败: {e}")
+            return None
+        if row is None:
+            return None
+        points = np.frombuffer(row[0], dtype=np.float64).reshape(-1, 2)
+        return [tuple(p) for p in points.tolist()]
+
+    def put_stars(self, path: str, params: Dict[str, Any], stars: List[Tuple[float, float]]):
+        """保存星点列表"""
+        frame = self.frame_key(path)
+        if frame is None:
+            return
+        data = np.asarray(stars, dtype=np.float64).reshape(-1, 2).tobytes()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO stars (frame, params, data) VALUES (?, ?, ?)",
+                    (frame, params_key(params), data)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"保存星点缓存失败: {e}")
+
+    def get_quality(self, path: str, params: Dict[str, Any]) -> Optional[Dict[str, float]]:
+        """读取缓存的帧质量指标，未命中时返回None"""
+        frame = self.frame_key(path)
+        if frame is None:
+            return None
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT data FROM quality WHERE frame = ? AND params = ?", (frame, params_key(params))
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取质量缓存失败: {e}")
+            return None
+        return None if row is None else json.loads(row[0])
+
+    def put_quality(self, path: str, params: Dict[str, Any], quality: Dict[str, float]):
+        """保存帧质量指标"""
+        frame = self.frame_key(path)
+        if frame is None:
+            return
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO quality (frame, params, data) VALUES (?, ?, ?)",
+                    (frame, params_key(params), json.dumps(quality))
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"保存质量缓存失败: {e}")
+
+    def get_transform(self, reference_path: str, path: str,
+                      params: Dict[str, Any]) -> Tuple[bool, Optional[np.ndarray]]:
+        """读取缓存的变换矩阵，返回 (是否命中, 变换矩阵)，矩阵为None表示该帧对齐失败"""
+        reference, frame = self.frame_key(reference_path), self.frame_key(path)
+        if reference is None or frame is None:
+            return False, None
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT matrix FROM transforms WHERE reference = ? AND frame = ? AND params = ?",
+                    (reference, frame, params_key(params))
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取变换缓存失败: {e}")
+            return False, None
+        if row is None:
+            return False, None
+        if row[0] is None:
+            return True, None
+        return True, np.frombuffer(row[0], dtype=np.float64).reshape(2, 3).copy()
+
+    def put_transform(self, reference_path: str, path: str, params: Dict[str, Any],
+                      matrix: Optional[np.ndarray]):
+        """保存变换矩阵，None表示该帧对齐失败"""
+        reference, frame = self.frame_key(reference_path), self.frame_key(path)
+        if reference is None or frame is None:
+            return
+        data = None if matrix is None else np.asarray(matrix, dtype=np.float64).tobytes()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO transforms (reference, frame, params, matrix) VALUES (?, ?, ?, ?)",
+                    (reference, frame, params_key(params), data)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"保存变换缓存失败: {e}")
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+暗场/平场/偏置场校准
+主校准帧由各自的帧组合成并缓存到磁盘，加载亮场时逐帧校准，不再单独写出校准后的中间文件
+"""
+
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import logging
+
+import cv2
+import numpy as np
+
+from .cache import file_fingerprint, params_key
+
+logger = logging.getLogger(__name__)
+
+# 校准帧类型
+CALIBRATION_KINDS = ('bias', 'dark', 'flat', 'flat_dark')
+# 平场归一化后低于该值的像素视为无效（如遮挡的角落），不做平场校正
+_MIN_FLAT = 0.05
+
+
+class CalibrationMasters:
+    """
+    主校准帧
+
+    校准公式为 (亮场 - 暗场) × 平场增益；没有暗场时减偏置场。
+    平场归一化前先扣除平场暗场（与平场曝光时间相同的暗场），没有时依次用偏置场、暗场代替，
+    否则平场中的偏置和暗电流会混入增益。
+    暗场按亮场的数据类型取整保存，减法和乘法都用OpenCV的饱和运算在原数据类型上完成，
+    不产生整帧的浮点副本
+    """
+
+    def __init__(self, bias: Optional[np.ndarray] = None, dark: Optional[np.ndarray] = None,
+                 flat: Optional[np.ndarray] = None, flat_dark: Optional[np.ndarray] = None,
+                 dtype=np.uint8):
+        self.dtype = np.dtype(dtype)
+        limit = np.iinfo(self.dtype).max
+
+        # 暗场通常与亮场曝光时间相同，已经包含偏置
+        offset = dark if dark is not None else bias
+        self.offset = None
+        if offset is not None:
+            self.offset = np.clip(np.rint(offset), 0, limit).astype(self.dtype)
+
+        self.gain = None
+        if flat is not None:
+            flat = flat.astype(np.float32)
+            flat_offset = next((master for master in (flat_dark, bias, dark) if master is not None), None)
+            if flat_offset is not None:
+                flat = flat - flat_offset
+            # 按通道归一化，平场增益 = 均值 / 平场
+            channel_mean = flat.reshape(-1, flat.shape[-1] if flat.ndim == 3 else 1).mean(axis=0)
+            normalized = flat / np.maximum(channel_mean, 1e-6)
+            self.gain = np.where(normalized > _MIN_FLAT, 1.0 / np.maximum(normalized, _MIN_FLAT),
+                                 1.0).astype(np.float32)
+
+    @property
+    def empty(self) -> bool:
+        """是否没有任何可用的校准"""
+        return self.offset is None and self.gain is None
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """校准一帧亮场，返回与输入相同数据类型的新数组"""
+        if frame.dtype != self.dtype:
+            raise ValueError(f"亮场数据类型 {frame.dtype} 与校准帧 {self.dtype} 不一致")
+        for master in (self.offset, self.gain):
+            if master is not None and master.shape != frame.shape:
+                raise ValueError(f"校准帧尺寸 {master.shape} 与亮场 {frame.shape} 不一致")
+
+        if self.offset is not None:
+            frame = cv2.subtract(frame, self.offset)
+        if self.gain is not None:
+            depth = cv2.CV_16U if self.dtype == np.uint16 else cv2.CV_8U
+            frame = cv2.multiply(frame, self.gain, dtype=depth)
+        return frame
+
+
+def master_key(kind: str, paths: List[str], params: Dict[str, Any]) -> str:
+    """由输入帧的文件指纹和合成参数计算主校准帧的缓存键"""
+    fingerprints = [file_fingerprint(path) for path in paths]
+    return params_key({'kind': kind, 'frames': fingerprints, **params})
+
+
+def master_path(directory: str, kind: str, key: str) -> str:
+    """主校准帧缓存文件路径"""
+    return str(Path(directory) / f".sky_editor_master_{kind}_{key[:16]}.npy")
+
+
+def load_master(path: str) -> Optional[np.ndarray]:
+    """读取缓存的主校准帧，不存在或损坏时返回None"""
+    if not os.path.isfile(path):
+        return None
+    try:
+        return np.load(path, allow_pickle=False)
+    except (OSError, ValueError) as e:
+        logger.warning(f"读取主校准帧缓存失败 {path}: {e}")
+        return None
+
+
+def save_master(path: str, master: np.ndarray):
+    """保存主校准帧，先写临时文件再替换，避免并发读取到不完整的文件"""
+    temporary = f"{path}.{os.getpid()}.tmp.npy"
+    try:
+        np.save(temporary, master.astype(np.float32), allow_pickle=False)
+        os.replace(temporary, path)
+    except OSError as e:
+        logger.warning(f"保存主校准帧缓存失败 {path}: {e}")
+        if os.path.exists(temporary):
+            os.remove(temporary)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+堆叠任务检查点
+堆叠时每累加/配准若干帧以及每一遍结束时把任务状态写入一个 .npz 文件：帧列表（含文件大小和修改时间）、每帧状态、
+参考星点和各帧星点、变换矩阵、帧质量、堆叠参数，流式累加时还有累加器的部分和/计数。
+中断（取消、出错或程序崩溃）后可以从检查点继续：流式累加只处理尚未累加的帧，
+其他引擎中已配准的帧不再检测星点和匹配，只重新变换和归约
+
+每个任务（帧列表和堆叠参数）有各自的检查点文件，文件名由两者的摘要组成，
+同一组图像用不同参数堆叠时互不覆盖
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 3
+
+# 帧状态（对当前这一遍而言）
+PENDING = 'pending'  # 尚未累加
+INTEGRATED = 'integrated'  # 已累加
+ALIGNED = 'aligned'  # 已配准，尚未归约（内存、分块等不能逐帧累加的引擎）
+FAILED = 'failed'  # 对齐失败
+REJECTED = 'rejected'  # 按质量排除
+
+# 累加器状态中的数组在文件中的键前缀
+_STATE_PREFIX = 'state_'
+
+
+def frame_record(path: str, shape=None, dtype=None) -> Dict[str, Any]:
+    """检查点中一帧的记录：路径、文件大小和修改时间，已解码时还有尺寸和数据类型"""
+    stat = Path(path).stat()
+    record = {'path': str(path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if shape is not None:
+        record.update(shape=list(shape), dtype=np.dtype(dtype).str)
+    return record
+
+
+def _json_value(value: Any) -> Any:
+    """JSON无法直接表示的值：numpy标量转换为Python数值，其余（如Path）转换为字符串"""
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def _digest(value: Any) -> str:
+    """JSON形式的稳定摘要"""
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=_json_value).encode()).hexdigest()
+
+
+class StackingCheckpoint:
+    """
+    一个堆叠任务的检查点
+
+    帧状态和变换矩阵以文件路径为键；accumulator 为正在累加的累加器，写入时保存其当前状态，
+    读取的检查点中累加器状态在 state 中。record() 只在累加线程中调用，与写入互不冲突
+    """
+
+    DIRECTORY = 'sky_editor_checkpoints'  # 未指定目录时在系统临时目录中使用的子目录
+
+    def __init__(self, path: str, frames: List[Dict[str, Any]], params: Dict[str, Dict[str, Any]],
+                 frame_interval: int = 100):
+        self.path = str(path)
+        self.frames = frames
+        self.params = params
+        self.frame_interval = frame_interval
+        self.status = {}  # {路径: 状态}
+        self.transforms = {}  # {路径: 变换矩阵}
+        self.frame_quality = {}  # {路径: 质量指标}
+        self.frame_stars = {}  # {路径: 星点列表}
+        self.reference_stars = None
+        self.accumulator = None
+        self.state = None  # 读取的累加器状态 {名称: 数组或数值}
+        self.pending_records = 0  # 上次写入之后累加/配准的帧数
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _directory(cls, directory: Optional[str] = None) -> Path:
+        """检查点目录：指定目录或系统临时目录下的子目录"""
+        return Path(directory) if directory else Path(tempfile.gettempdir()) / cls.DIRECTORY
+
+    @classmethod
+    def _paths_digest(cls, image_paths: List[str]) -> str:
+        return _digest([str(Path(path).resolve()) for path in image_paths])[:16]
+
+    @classmethod
+    def location(cls, image_paths: List[str], params: Dict[str, Dict[str, Any]],
+                 directory: Optional[str] = None) -> Optional[str]:
+        """任务的检查点文件路径（文件名由帧列表和堆叠参数的摘要组成），图像不是文件时为None"""
+        if not image_paths or not Path(image_paths[0]).is_file():
+            return None
+        name = f"checkpoint-{cls._paths_digest(image_paths)}-{_digest(params)[:12]}.npz"
+        return str(cls._directory(directory) / name)
+
+    @classmethod
+    def candidates(cls, image_paths: List[str], directory: Optional[str] = None) -> List[str]:
+        """同一组图像（任意堆叠参数）的检查点文件，最近写入的在前"""
+        if not image_paths:
+            return []
+        pattern = f"checkpoint-{cls._paths_digest(image_paths)}-*.npz"
+        try:
+            files = list(cls._directory(directory).glob(pattern))
+            files.sort(key=lambda path: path.stat().st_mtime_ns, reverse=True)
+        except OSError as e:
+            logger.warning(f"查找检查点失败: {e}")
+            return []
+        return [str(path) for path in files]
+
+    @classmethod
+    def load(cls, path: str, metadata_only: bool = False) -> Optional['StackingCheckpoint']:
+        """读取检查点，文件不存在或无法读取时返回None
+
+        metadata_only 为True时不读取累加器状态和星点（只判断检查点是否可用）
+        """
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data['meta']))
+                if meta.get('version') != CHECKPOINT_VERSION:
+                    raise ValueError(f"不支持的检查点版本: {meta.get('version')}")
+                arrays, reference_stars, frame_stars = {}, None, {}
+                if not metadata_only:
+                    arrays = {key[len(_STATE_PREFIX):]: data[key] for key in data.files
+                              if key.startswith(_STATE_PREFIX)}
+                    if 'reference_stars' in data.files:
+                        reference_stars = data['reference_stars']
+                    if meta.get('star_frames'):
+                        # 各帧星点依次拼接保存，按每帧的星点数切分
+                        chunks = np.split(data['frame_stars'], np.cumsum(data['star_counts'])[:-1])
+                        frame_stars = {frame: [tuple(point) for point in chunk.tolist()]
+                                       for frame, chunk in zip(meta['star_frames'], chunks)}
+
+            checkpoint = cls(path, meta['frames'], meta['params'], meta.get('frame_interval', 100))
+            checkpoint.status = meta['status']
+            checkpoint.transforms = {frame: np.array(matrix, dtype=np.float64)
+                                     for frame, matrix in meta['transforms'].items()}
+            checkpoint.frame_quality = meta['frame_quality']
+            checkpoint.frame_stars = frame_stars
+            if reference_stars is not None:
+                checkpoint.reference_stars = [tuple(point) for point in reference_stars.tolist()]
+            if meta['state'] is not None:
+                checkpoint.state = dict(meta['state'], **arrays)
+            return checkpoint
+
+        except FileNotFoundError:
+            logger.error(f"检查点不存在: {path}")
+            return None
+        except Exception as e:
+            logger.error(f"读取检查点失败 {path}: {e}")
+            return None
+
+    @property
+    def paths(self) -> List[str]:
+        return [frame['path'] for frame in self.frames]
+
+    @property
+    def current_pass(self) -> int:
+        """正在进行的累加遍数"""
+        if self.accumulator is not None:
+            return self.accumulator.current_pass
+        return int(self.state['current_pass']) if self.state is not None else 0
+
+    def changed_frames(self) -> List[str]:
+        """写入检查点之后被修改或删除的帧"""
+        changed = []
+        for frame in self.frames:
+            try:
+                stat = Path(frame['path']).stat()
+            except OSError:
+                changed.append(frame['path'])
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (frame['size'], frame['mtime']):
+                changed.append(frame['path'])
+        return changed
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的帧数"""
+        counts = dict.fromkeys((PENDING, INTEGRATED, ALIGNED, FAILED, REJECTED), 0)
+        for path in self.paths:
+            counts[self.status.get(path, PENDING)] += 1
+        return counts
+
+    def record(self, path: str, status: str, transform: Optional[np.ndarray] = None):
+        """记录帧在本遍的状态，上次写入之后累加/配准的帧数达到 frame_interval 时写入文件"""
+        with self._lock:
+            self.status[path] = status
+            if transform is not None:
+                self.transforms[path] = transform
+            if status in (INTEGRATED, ALIGNED):
+                self.pending_records += 1
+        if self.pending_records >= self.frame_interval:
+            self.flush()
+
+    def record_stars(self, path: str, stars: List[Tuple[float, float]]):
+        """记录帧的星点，随下一次写入保存"""
+        with self._lock:
+            self.frame_stars[path] = stars
+
+    def next_pass(self):
+        """累加器进入下一遍：已累加的帧重新变为待处理，并立即写入"""
+        with self._lock:
+            self.status = {path: PENDING if status == INTEGRATED else status
+                           for path, status in self.status.items()}
+        self.flush()
+
+    def flush(self):
+        """写入文件（先写临时文件再替换，写入中途崩溃不会损坏已有的检查点）"""
+        try:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            with self._lock:
+                meta = {
+                    'version': CHECKPOINT_VERSION,
+                    'frames': self.frames,
+                    'params': self.params,
+                    'frame_interval': self.frame_interval,
+                    'status': dict(self.status),
+                    'transforms': {frame: np.asarray(matrix).tolist()
+                                   for frame, matrix in self.transforms.items()},
+                    'frame_quality': self.frame_quality,
+                    'state': None,
+                }
+                arrays = {}
+                state = self.accumulator.state() if self.accumulator is not None else self.state
+                if state is not None:
+                    meta['state'] = {key: value for key, value in state.items()
+                                     if not isinstance(value, np.ndarray) and value is not None}
+                    arrays = {_STATE_PREFIX + key: value for key, value in state.items()
+                              if isinstance(value, np.ndarray)}
+                if self.reference_stars is not None:
+                    arrays['reference_stars'] = np.array(self.reference_stars, dtype=np.float64)
+                if self.frame_stars:
+                    meta['star_frames'] = list(self.frame_stars)
+                    arrays['star_counts'] = np.array([len(stars) for stars in self.frame_stars.values()],
+                                                     dtype=np.int64)
+                    arrays['frame_stars'] = np.array(
+                        [point for stars in self.frame_stars.values() for point in stars],
+                        dtype=np.float64).reshape(-1, 2)
+
+                temp_path = self.path + '.tmp'
+                with open(temp_path, 'wb') as f:
+                    np.savez(f, meta=np.array(json.dumps(meta, default=_json_value)), **arrays)
+                os.replace(temp_path, self.path)
+                self.pending_records = 0
+        except Exception as e:
+            logger.warning(f"写入检查点失败 {self.path}: {e}")
+
+    def remove(self):
+        """任务完成后删除检查点"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"删除检查点失败 {self.path}: {e}")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+热像素/冷像素表
+每次堆叠只检测一次坏像素，保存为平铺索引数组；加载每帧时用邻域中值替换，
+避免热像素被当作星点参与匹配，也不会残留在堆叠结果中
+"""
+
+from typing import Iterable, Tuple
+import logging
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 8邻域偏移
+_NEIGHBOR_DY = np.array([-1, -1, -1, 0, 0, 1, 1, 1])
+_NEIGHBOR_DX = np.array([-1, 0, 1, -1, 1, -1, 0, 1])
+# 坏像素与邻域的差值至少占其与局部背景差值的比例，星点核心的亮度变化平缓，比例较低
+_ISOLATION_RATIO = 0.8
+
+
+class DefectMap:
+    """坏像素表，indices 为 H×W 平面上的平铺索引"""
+
+    def __init__(self, indices: np.ndarray, shape: Tuple[int, ...]):
+        self.shape = tuple(shape[:2])
+        self.indices = np.unique(np.asarray(indices, dtype=np.int64)).astype(np.int32)
+        self.neighbors = neighbor_indices(self.indices, self.shape)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """用8邻域中值替换坏像素，原地修改并返回frame"""
+        if len(self.indices) == 0:
+            return frame
+        if frame.shape[:2] != self.shape:
+            raise ValueError(f"坏像素表尺寸 {self.shape} 与图像 {frame.shape[:2]} 不一致")
+
+        if not (frame.flags.c_contiguous and frame.flags.writeable):
+            frame = frame.copy()
+        h, w = self.shape
+        flat = frame.reshape(h * w, -1)
+        values = np.median(flat[self.neighbors], axis=1)
+        if np.issubdtype(frame.dtype, np.integer):
+            values = np.rint(values)
+        flat[self.indices] = values.astype(frame.dtype)
+        return frame
+
+
+def neighbor_indices(indices: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """返回每个平铺索引的8邻域平铺索引 (N, 8)，图像边缘处取边缘像素"""
+    h, w = shape
+    y, x = np.divmod(np.asarray(indices, dtype=np.int64), w)
+    ny = np.clip(y[:, None] + _NEIGHBOR_DY, 0, h - 1)
+    nx = np.clip(x[:, None] + _NEIGHBOR_DX, 0, w - 1)
+    return (ny * w + nx).astype(np.int32)
+
+
+def _level(frame: np.ndarray) -> np.ndarray:
+    """各通道中的最大值，单通道的热像素去马赛克后只在一个颜色中明显"""
+    level = frame.astype(np.float32)
+    return level.max(axis=2) if level.ndim == 3 else level
+
+
+def find_defects_in_dark(dark: np.ndarray, sigma: float = 5.0) -> np.ndarray:
+    """在主暗场中查找明显高于整体水平的热像素，返回平铺索引"""
+    level = _level(dark)
+    median = np.median(level)
+    noise = max(np.median(np.abs(level - median)) * 1.4826, 1.0)
+    return np.flatnonzero(level > median + sigma * noise)
+
+
+def find_defects_in_frames(frames: Iterable[np.ndarray], sigma: float = 5.0,
+                           min_fraction: float = 0.75) -> np.ndarray:
+    """
+    按时间统计在一组亮场中查找坏像素，返回平铺索引
+
+    在至少 min_fraction 的帧中都是孤立异常值（与3×3中值相差超过 sigma 倍噪声，
+    且差值接近其与5×5局部背景的差值）的像素视为坏像素；星点在帧间移动或亮度分布平缓，
+    不会被误判
+    """
+    counts = None
+    total = 0
+    for frame in frames:
+        level = _level(frame)
+        residual = level - cv2.medianBlur(level, 3)
+        local = level - cv2.medianBlur(level, 5)
+        noise = max(np.median(np.abs(residual)) * 1.4826, 1.0)
+
+        outlier = (np.abs(residual) > sigma * noise) & (np.sign(residual) == np.sign(local))
+        outlier &= np.abs(residual) > _ISOLATION_RATIO * np.abs(local)
+        counts = outlier.astype(np.uint16) if counts is None else counts + outlier
+        total += 1
+
+    if counts is None:
+        return np.empty(0, dtype=np.int64)
+    return np.flatnonzero(counts >= max(1, int(np.ceil(min_fraction * total))))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+磁盘映射的对齐帧存储
+将所有对齐后的图像写入一个连续的memmap立方体，按行带读取进行分块归约
+"""
+
+import numpy as np
+import os
+import tempfile
+from typing import Iterator, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MemmapFrameStore:
+    """
+    基于 numpy.memmap 的对齐帧存储
+
+    数据按 (H, N, W, C) 布局：同一行带内所有帧的像素在文件中是连续的，
+    读取 [y0:y1] 行带时只需一次顺序读取
+    """
+
+    def __init__(self, capacity: int, frame_shape: Tuple[int, ...],
+                 dtype=np.uint8, directory: Optional[str] = None):
+        self.capacity = capacity
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.size = 0  # 已写入的帧数
+
+        fd, self.path = tempfile.mkstemp(prefix='sky_editor_stack_', suffix='.dat', dir=directory)
+        os.close(fd)
+
+        shape = (self.frame_shape[0], capacity) + self.frame_shape[1:]
+        self.cube = np.memmap(self.path, dtype=self.dtype, mode='w+', shape=shape)
+        logger.info(f"创建帧存储 {self.path}: {capacity} 帧, {self.cube.nbytes / 1024 ** 2:.1f}MB")
+
+    def append(self, frame: np.ndarray) -> int:
+        """写入一帧图像，返回其槽位"""
+        if self.size >= self.capacity:
+            raise ValueError("帧存储已满")
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"图像尺寸不一致: {frame.shape} != {self.frame_shape}")
+
+        slot = self.size
+        self.cube[:, slot] = frame
+        self.size += 1
+        return slot
+
+    def frame(self, slot: int) -> np.ndarray:
+        """读取一整帧（各行分散在文件中，比按行带读取慢，用于逐帧重放）"""
+        return np.array(self.cube[:, slot])
+
+    def band(self, y0: int, y1: int) -> np.ndarray:
+        """读取行带，返回 (N, y1-y0, W, C) 视图"""
+        return np.moveaxis(self.cube[y0:y1, :self.size], 1, 0)
+
+    def rows_per_band(self, memory_budget_mb: float, bytes_per_value: int = 32) -> int:
+        """根据内存预算计算每个行带的行数
+
+        bytes_per_value 为归约时每个像素值的工作内存（float64副本及临时数组）
+        """
+        values_per_row = max(self.size, 1) * int(np.prod(self.frame_shape[1:], dtype=np.int64))
+        rows = int(memory_budget_mb * 1024 ** 2 // (values_per_row * bytes_per_value))
+        return max(1, min(rows, self.frame_shape[0]))
+
+    def iter_bands(self, memory_budget_mb: float,
+                   bytes_per_value: int = 32) -> Iterator[Tuple[int, int]]:
+        """按内存预算依次产出行带范围 (y0, y1)"""
+        rows = self.rows_per_band(memory_budget_mb, bytes_per_value)
+        height = self.frame_shape[0]
+        for y0 in range(0, height, rows):
+            yield y0, min(y0 + rows, height)
+
+    def close(self):
+        """释放映射并删除临时文件"""
+        self.cube = None
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            logger.warning(f"删除帧存储文件失败 {self.path}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
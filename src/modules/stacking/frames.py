@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+帧句柄和解码帧缓存
+堆叠器只为每帧保存一个轻量句柄（路径、尺寸、数据类型和文件信息），图像在需要时解码；
+最近使用的解码帧保留在按字节预算淘汰的LRU缓存中，常驻内存由缓存预算和流水线深度决定，
+而与帧数无关
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 支持的RAW格式（加载、预检和实时堆叠共用）
+RAW_EXTENSIONS = {'.arw', '.cr2', '.cr3', '.nef', '.dng', '.raf', '.orf', '.rw2'}
+
+
+class FrameCache:
+    """按字节预算保留最近使用的解码帧（LRU），可在多个线程中使用"""
+
+    def __init__(self, budget_mb: float = 1024):
+        self.budget = int(budget_mb * 1024 ** 2)
+        self.nbytes = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def get(self, key: str, load: Callable[[str], np.ndarray]) -> np.ndarray:
+        """返回缓存的帧，不在缓存中时调用 load(key) 解码并放入缓存（解码时不持有锁）"""
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                return frame
+        frame = load(key)
+        self.put(key, frame)
+        return frame
+
+    def put(self, key: str, frame: np.ndarray):
+        """放入缓存并淘汰最久未使用的帧，超过整个预算的帧不缓存"""
+        if frame.nbytes > self.budget:
+            return
+        with self._lock:
+            previous = self._frames.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._frames[key] = frame
+            self.nbytes += frame.nbytes
+            while self.nbytes > self.budget:
+                _, evicted = self._frames.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
+
+
+class FrameHandle:
+    """
+    一帧图像的句柄，image 属性在需要时解码
+
+    有缓存时通过缓存解码，否则每次访问都重新解码；
+    直接传入 image 的句柄（如内存中的图像）始终持有该图像
+    """
+
+    __slots__ = ('path', 'shape', 'dtype', 'metadata', '_loader', '_cache', '_image')
+
+    def __init__(self, path: str, loader: Optional[Callable[[str], np.ndarray]] = None,
+                 cache: Optional[FrameCache] = None, image: Optional[np.ndarray] = None,
+                 shape: Optional[Tuple[int, ...]] = None, dtype: Optional[np.dtype] = None,
+                 metadata: Optional[Dict[str, Any]] = None):
+        if loader is None and image is None:
+            raise ValueError("帧句柄需要解码函数或图像")
+        self.path = path
+        self._loader = loader
+        self._cache = cache
+        self._image = image
+        self.shape = tuple(image.shape) if image is not None else shape
+        self.dtype = image.dtype if image is not None else dtype
+        self.metadata = metadata or {}
+
+    @property
+    def image(self) -> np.ndarray:
+        if self._image is not None:
+            return self._image
+        if self._cache is not None:
+            frame = self._cache.get(self.path, self._loader)
+        else:
+            frame = self._loader(self.path)
+        self.shape, self.dtype = tuple(frame.shape), frame.dtype
+        return frame
+
+    @property
+    def nbytes(self) -> Optional[int]:
+        """解码后的字节数，尚未解码过时为None"""
+        if self.shape is None:
+            return None
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+    def __repr__(self) -> str:
+        return f"FrameHandle({self.path!r}, shape={self.shape}, dtype={self.dtype})"
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+星点最近邻匹配
+基于空间索引的向量化实现，并保留逐点暴力匹配作为参考实现
+"""
+
+import numpy as np
+from typing import List, Tuple
+import logging
+
+# 尝试导入scipy的KD树
+try:
+    from scipy.spatial import cKDTree
+    KDTREE_SUPPORT = True
+except ImportError:
+    KDTREE_SUPPORT = False
+    logging.warning("scipy未安装，星点匹配使用分块向量化搜索")
+
+logger = logging.getLogger(__name__)
+
+# 无KD树时每次计算距离矩阵的参考星点数
+_CHUNK_SIZE = 256
+
+
+def two_nearest_neighbors(tree_points: np.ndarray, query_points: np.ndarray,
+                          max_distance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """对每个查询点返回最近和次近的距离及索引（超出max_distance记为inf）"""
+    if KDTREE_SUPPORT:
+        k = 2 if len(tree_points) > 1 else 1
+        dist, idx = cKDTree(tree_points).query(query_points, k=k, distance_upper_bound=max_distance)
+        if k == 1:
+            dist = np.column_stack([dist, np.full(len(dist), np.inf)])
+            idx = np.column_stack([idx, np.full(len(idx), len(tree_points))])
+        return dist, idx
+
+    # 分块计算距离矩阵，避免一次性分配 N×M 数组
+    dist = np.full((len(query_points), 2), np.inf)
+    idx = np.full((len(query_points), 2), len(tree_points), dtype=np.int64)
+    k = min(2, len(tree_points))
+    tree_norms = (tree_points ** 2).sum(axis=1)
+    for start in range(0, len(query_points), _CHUNK_SIZE):
+        chunk = query_points[start:start + _CHUNK_SIZE]
+        # |q - t|^2 = |q|^2 + |t|^2 - 2 q·t，用矩阵乘法代替逐点相减
+        d = (chunk ** 2).sum(axis=1)[:, None] + tree_norms[None, :] - 2.0 * chunk @ tree_points.T
+        d = np.sqrt(np.maximum(d, 0.0))
+        nearest = np.argpartition(d, k - 1, axis=1)[:, :k]
+        nearest_d = np.take_along_axis(d, nearest, axis=1)
+        order = np.argsort(nearest_d, axis=1)
+        dist[start:start + len(chunk), :k] = np.take_along_axis(nearest_d, order, axis=1)
+        idx[start:start + len(chunk), :k] = np.take_along_axis(nearest, order, axis=1)
+
+    outside = dist > max_distance
+    dist[outside] = np.inf
+    idx[outside] = len(tree_points)
+    return dist, idx
+
+
+def match_nearest_neighbors(ref_points: np.ndarray, cur_points: np.ndarray,
+                            max_distance: float = 100.0, ratio: float = 0.7,
+                            mutual: bool = True) -> np.ndarray:
+    """
+    最近邻星点匹配
+
+    Args:
+        ref_points: 参考星点 (N, 2)
+        cur_points: 当前星点 (M, 2)
+        max_distance: 最大匹配距离（像素）
+        ratio: 最近距离/次近距离的上限，>=1 表示不做比值检验
+        mutual: 是否要求互为最近邻
+
+    Returns:
+        匹配索引对 (K, 2)，每行为 (参考星点索引, 当前星点索引)
+    """
+    ref_points = np.asarray(ref_points, dtype=np.float64).reshape(-1, 2)
+    cur_points = np.asarray(cur_points, dtype=np.float64).reshape(-1, 2)
+    if len(ref_points) == 0 or len(cur_points) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    dist, idx = two_nearest_neighbors(cur_points, ref_points, max_distance)
+    keep = np.isfinite(dist[:, 0])
+
+    # 比值检验：最近邻明显优于次近邻时才认为匹配可靠
+    if ratio < 1.0:
+        keep &= dist[:, 0] < ratio * dist[:, 1]
+
+    ref_idx = np.nonzero(keep)[0]
+    cur_idx = idx[keep, 0]
+
+    # 互为最近邻检验
+    if mutual and len(ref_idx):
+        _, back = two_nearest_neighbors(ref_points, cur_points[cur_idx], max_distance)
+        consistent = back[:, 0] == ref_idx
+        ref_idx, cur_idx = ref_idx[consistent], cur_idx[consistent]
+
+    return np.column_stack([ref_idx, cur_idx]).astype(np.int64)
+
+
+def match_stars_bruteforce(ref_points: np.ndarray, cur_points: np.ndarray,
+                           max_distance: float = 100.0) -> List[Tuple[int, int]]:
+    """逐点暴力最近邻匹配（参考实现，仅用于测试对比）"""
+    matches = []
+    for i, ref_point in enumerate(ref_points):
+        min_dist = float('inf')
+        best_match = -1
+
+        for j, cur_point in enumerate(cur_points):
+            dist = np.linalg.norm(ref_point - cur_point)
+            if dist < min_dist:
+                min_dist = dist
+                best_match = j
+
+        # 只保留距离合理的匹配
+        if min_dist < max_distance:
+            matches.append((i, best_match))
+
+    return matches
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+堆叠流水线
+用有界队列串联 加载 → 检测 → 匹配 → 变换 等阶段，各阶段在独立线程中并发执行，
+同时在途的帧数受限，内存占用由流水线深度而不是帧数决定
+"""
+
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 队列结束标记
+_END = object()
+# 阶段处理失败或主动丢弃的帧
+_DROPPED = object()
+
+
+class FramePipeline:
+    """
+    多阶段帧处理流水线
+
+    stages 为 [(阶段名, 处理函数, 线程数), ...]，处理函数签名为 func(index, data)，
+    返回None表示丢弃该帧。run() 按输入顺序产出 (index, 最后一个阶段的结果)
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable[[int, Any], Any], int]],
+                 max_in_flight: int = 4, cancel_check: Optional[Callable[[], bool]] = None):
+        self.stages = stages
+        self.max_in_flight = max(1, max_in_flight)
+        self.cancel_check = cancel_check or (lambda: False)
+        self._stop = threading.Event()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """放入队列，队列满时阻塞（背压），流水线停止时返回False"""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        """从队列取出，流水线停止时返回结束标记"""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def run(self, items: Iterable) -> Iterator[Tuple[int, Any]]:
+        """运行流水线，按输入顺序产出未被丢弃的结果"""
+        self._stop = threading.Event()
+        queues = [queue.Queue(maxsize=self.max_in_flight) for _ in range(len(self.stages) + 1)]
+        in_flight = threading.Semaphore(self.max_in_flight)
+        threads = []
+
+        def feed():
+            for index, item in enumerate(items):
+                # 限制同时在途的帧数
+                while not in_flight.acquire(timeout=0.1):
+                    if self._stop.is_set():
+                        return
+                if self.cancel_check() or not self._put(queues[0], (index, item)):
+                    break
+            for _ in range(self.stages[0][2]):
+                self._put(queues[0], _END)
+
+        def make_worker(stage_index, name, func, remaining):
+            source, target = queues[stage_index], queues[stage_index + 1]
+            next_workers = self.stages[stage_index + 1][2] if stage_index + 1 < len(self.stages) else 1
+
+            def work():
+                while True:
+                    item = self._get(source)
+                    if item is _END:
+                        # 本阶段最后一个线程结束时通知下游
+                        with remaining['lock']:
+                            remaining['count'] -= 1
+                            last = remaining['count'] == 0
+                        if last:
+                            for _ in range(next_workers):
+                                self._put(target, _END)
+                        return
+
+                    index, data = item
+                    result = _DROPPED
+                    if data is not _DROPPED:
+                        try:
+                            output = func(index, data)
+                            if output is not None:
+                                result = output
+                        except Exception as e:
+                            logger.error(f"流水线阶段 {name} 处理第 {index} 帧失败: {e}")
+                    if not self._put(target, (index, result)):
+                        return
+            return work
+
+        threads.append(threading.Thread(target=feed, name="pipeline-feed", daemon=True))
+        for stage_index, (name, func, workers) in enumerate(self.stages):
+            remaining = {'count': workers, 'lock': threading.Lock()}
+            for n in range(workers):
+                threads.append(threading.Thread(target=make_worker(stage_index, name, func, remaining),
+                                                name=f"pipeline-{name}-{n}", daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        # 多线程阶段的输出可能乱序，按索引重新排序后产出
+        pending = {}
+        next_index = 0
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _END:
+                    break
+
+                index, result = item
+                pending[index] = result
+                while next_index in pending:
+                    result = pending.pop(next_index)
+                    in_flight.release()
+                    if result is not _DROPPED:
+                        yield next_index, result
+                    next_index += 1
+
+                if self.cancel_check():
+                    break
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join(timeout=1.0)
@@ -8,28 +8,108 @@
 import numpy as np
 from PIL import Image, ImageEnhance
 import cv2
+import os
 import threading
 import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
 import json
-from typing import List, Tuple, Optional, Dict, Any
+from typing import List, Tuple, Optional, Dict, Any, Iterator, Iterable, Callable, Sequence
 import logging
 
+from .accumulator import create_accumulator, create_live_accumulator, STREAMING_METHODS
+from .frame_store import MemmapFrameStore
+from .frames import FrameCache, FrameHandle, RAW_EXTENSIONS
+from .matching import match_nearest_neighbors
+from .asterism import AsterismIndex
+from .pipeline import FramePipeline
+from .cache import StackingCache, params_key
+from .calibration import (CalibrationMasters, CALIBRATION_KINDS, master_key, master_path,
+                          load_master, save_master)
+from .rejection import reject_stack, REJECTION_METHODS
+from .selection import median_stack
+from .defects import DefectMap, find_defects_in_dark, find_defects_in_frames
+from .triage import load_preview, score_preview, triage_decisions
+from .checkpoint import StackingCheckpoint, frame_record, PENDING, INTEGRATED, ALIGNED, FAILED, REJECTED
+from .transport import (FrameRing, attach_ring, can_allocate, create_process_pool, frame_nbytes, owned,
+                        write_slot)
+
+# 尝试导入rawpy用于RAW文件支持
+try:
+    import rawpy
+    RAW_SUPPORT = True
+except ImportError:
+    RAW_SUPPORT = False
+    logging.warning("rawpy未安装，堆叠时无法读取RAW格式文件")
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 可以保存16位/浮点结果的格式
+HIGH_BIT_DEPTH_FORMATS = {'.tif', '.tiff', '.png'}
+# 实时堆叠监视的图像格式
+LIVE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp'} | RAW_EXTENSIONS
+# 评估帧质量时统计亮度的最亮星点数
+_QUALITY_STARS = 20
+# 堆叠窗口自动生成的结果文件名前缀，实时堆叠时跳过
+RESULT_PREFIX = 'stacked_'
+# 按行带在帧的原数据类型上归约的堆叠方法，调用前不转换为float32
+NATIVE_METHODS = REJECTION_METHODS + ('median',)
+
 class AstroStacker:
     """天体摄影图像堆叠器"""
     
     def __init__(self):
-        self.images = []  # 原始图像列表
+        self.images = []  # 帧句柄列表（FrameHandle），图像按需解码
+        self.frame_cache = FrameCache()  # 最近使用的解码帧
+        self.image_paths = []  # 待处理的图像路径
         self.aligned_images = []  # 对齐后的图像列表
         self.reference_image = None  # 参考图像
+        self.transforms = {}  # 成功对齐图像的变换矩阵 {图像索引: 2x3矩阵}
+        self.asterism_index = None  # 参考星点的三角形不变量索引
+        self.reference_data = None  # 快速配准共用的参考数据（降采样星点、精配准星点、相位相关亮度图）
+        self.coarse_index = None  # 降采样参考星点的星组索引
+        self.phase_window = None  # 相位相关使用的汉宁窗
+        self.predicting = False  # 当前对齐是否按前几帧预测变换（只有顺序对齐和实时堆叠预测，影响变换缓存的参数）
+        self.star_cache = None  # 星点缓存
         self.star_points = []  # 检测到的星点
         self.progress_callback = None  # 进度回调函数
         self.cancel_flag = False  # 取消标志
         
+        self.calibration = None  # 当前使用的主校准帧
+        self.calibration_key = None  # 主校准帧对应的输入标识
+        self.loaded_calibration = None  # 已加载图像所用的校准标识
+        self.defect_map = None  # 热像素/冷像素表
+        self.defect_key = None  # 坏像素表对应的输入标识
+        self.loaded_defects = None  # 已加载图像所用的坏像素表标识
+        self.frame_quality = {}  # 帧质量指标 {图像索引: {stars, fwhm, background, noise}}
+        self.assessed_stars = {}  # 评估质量时检测、尚未用于配准的星点 {图像索引: 星点}
+        self.frame_weights = {}  # 质量加权时各帧的相对权重 {图像索引: 权重}
+        self.rejected_frames = set()  # 因质量较差在配准前排除的图像索引
+        self.quality_rejection = None  # 排除帧时使用的 quality_reject
+        self.preview_scores = {}  # 预检评分 {路径: (文件大小和修改时间, 评分)}
+        self.triage_results = []  # 最近一次预检的决定，与输入路径顺序相同
+        self.decode_pool = None  # 解码RAW文件的进程池，只在加载期间存在
+        self.decode_slots = 0  # 解码结果帧槽环的槽数（每个加载线程一个）
+        self.decode_ring = None  # 解码进程写入结果的共享内存帧槽环，第一帧解码后创建
+        self.decode_ring_lock = threading.Lock()
+        self.loaded_raw = None  # 已加载图像所用的RAW解码参数
+        self.proxy_frames = None  # self.images 中的配准帧：'cfa' 为绿色平面，'raw' 为按配准参数解码的RAW，None 为全分辨率图像
+        self.checkpoint = None  # 正在进行的堆叠任务的检查点
+        self.collected_stars = None  # 对齐工作进程中检测的各帧星点 {索引: 星点}，传回主进程写入检查点
+        self.checkpoint_file = None  # 当前任务的检查点文件路径
+        self.resume_checkpoint = None  # 从检查点继续时读取的检查点，只在 resume_stack 期间存在
+        
+        # 实时堆叠状态
+        self.live_accumulator = None  # 实时堆叠的单遍累加器
+        self.live_ref_stars = None  # 参考图像星点
+        self.live_history = []  # 最近对齐成功的 (帧索引, 变换矩阵)，用于预测配准
+        self.live_seen = set()  # 已处理的文件
+        self.live_pending = {}  # 尚未写完的文件 {路径: 上次扫描时的大小}
+        
         # 星点检测参数
         self.star_detection_params = {
             'threshold': 50,  # 星点检测阈值
@@ -41,16 +121,98 @@ class AstroStacker:
         # 图像对齐参数
         self.alignment_params = {
             'max_features': 500,  # 最大特征点数量
-            'match_threshold': 0.7,  # 特征匹配阈值
+            'match_threshold': 0.7,  # 特征匹配阈值（最近邻/次近邻距离比）
             'ransac_threshold': 5.0,  # RANSAC阈值
+            'match_radius': 100.0,  # 最近邻匹配的最大像素距离
+            'mutual_match': True,  # 是否要求互为最近邻
+            'matcher': 'auto',  # 匹配方式: nearest(最近邻), asterism(星组), auto(最近邻失败时使用星组)
+            'min_inliers': 8,  # 认为变换可靠所需的最少RANSAC内点数
+            'min_inlier_ratio': 0.5,  # 认为最近邻匹配可靠所需的最低内点比例
+            'workers': 0,  # 并行对齐的工作线程/进程数，0或1表示顺序处理
+            'executor': 'thread',  # 并行方式: thread(线程池), process(进程池)
+            'registration': 'stars',  # 配准方式: stars(全分辨率星点), pyramid(金字塔由粗到精), phase(相位相关，仅平移)
+            'pyramid_scale': 4,  # 金字塔配准的降采样倍数
+            'refine_stars': 50,  # 金字塔精配准使用的全分辨率星点数
+            'refine_radius': 5,  # 精配准时在预测位置周围搜索的窗口半径（像素）
+            'phase_scale': 4,  # 相位相关配准的降采样倍数
+            'phase_min_response': 0.1,  # 相位相关峰值低于该值时认为不可靠，改用星点匹配
+            'predictive': True,  # 顺序对齐时用前几帧的变换预测当前帧（线性漂移模型）
+            'predict_radius': 10.0,  # 按预测变换映射后的星点匹配半径（像素）
+            'cfa_registration': False,  # RAW文件在拜耳阵列绿色平面上配准，只在最后变换时去马赛克
         }
         
         # 堆叠参数
         self.stacking_params = {
-            'method': 'average',  # 堆叠方法: average, median, maximum, sigma_clip
+            'method': 'average',  # 堆叠方法: average, median, maximum, sigma_clip, winsorized_sigma, percentile_clip
             'sigma_low': 2.0,     # Sigma裁剪下限
             'sigma_high': 2.0,    # Sigma裁剪上限
-            'rejection_ratio': 0.1,  # 拒绝比例
+            'rejection_ratio': 1.0,  # 拒绝比例：Sigma裁剪时每个像素最多拒绝的帧比例（至少一帧），1表示不限制
+            'clip_iterations': 3,  # Sigma裁剪的迭代次数（流式引擎每次迭代多遍历一次全部帧）
+            'reject_workers': 0,  # 按行带并行裁剪和中值选择的线程数，0表示CPU核数
+            'engine': 'memory',   # 堆叠引擎: memory(内存), streaming(流式), out_of_core(磁盘映射), auto(按方法自动选择)
+            'percentile_low': 10.0,   # 百分位裁剪下限
+            'percentile_high': 90.0,  # 百分位裁剪上限
+            'memory_budget_mb': 1024,  # 磁盘映射模式下行带归约的内存预算
+            'scratch_dir': None,  # 磁盘映射文件目录，None表示系统临时目录
+            'pipeline': False,  # 是否以流水线方式边加载边对齐边堆叠
+            'pipeline_depth': 4,  # 流水线中同时在途的最大帧数
+            'bit_depth': 8,  # 位深: 8, 16(以uint16读取和输出), 32(以uint16读取，输出0~1浮点)
+            'quality_reject': 0.0,  # 配准前按质量排除最差帧的比例，0表示不排除
+            'quality_weighting': False,  # 平均堆叠时按帧质量加权
+            'frame_cache_mb': 1024,  # 解码帧缓存的内存预算，超出时按最久未使用淘汰，需要时重新解码
+            'shared_memory': True,  # 进程池通过共享内存帧槽传递解码和变换后的帧，而不是pickle
+        }
+        
+        # 实时堆叠参数
+        self.live_params = {
+            'poll_interval': 2.0,  # 扫描文件夹的间隔（秒）
+            'preview_interval': 10.0,  # 刷新预览的最短间隔（秒）
+        }
+        
+        # 校准参数
+        self.calibration_params = {
+            'bias': [],  # 偏置场文件
+            'dark': [],  # 暗场文件（与亮场曝光时间相同，已包含偏置）
+            'flat': [],  # 平场文件
+            'flat_dark': [],  # 平场暗场文件（与平场曝光时间相同，没有时用偏置场或暗场扣除平场的偏置）
+            'method': 'median',  # 合成主校准帧的方法，与堆叠方法相同
+        }
+        
+        # 坏像素校正参数
+        self.defect_params = {
+            'enabled': False,  # 是否在加载时替换热像素/冷像素
+            'sigma': 5.0,  # 偏离邻域超过该倍数噪声的像素视为坏像素
+            'sample_frames': 8,  # 没有暗场时用于时间统计的亮场数
+            'min_fraction': 0.75,  # 在至少该比例的亮场中都异常才视为坏像素
+        }
+        
+        # 预检参数
+        self.triage_params = {
+            'enabled': False,  # 是否在全分辨率解码前按预览图排除异常帧
+            'preview_size': 400,  # 预览图长边像素数
+            'sigma': 4.0,  # 亮度或锐度偏离整体超过该倍数时排除
+            'min_star_ratio': 0.5,  # 星点数低于中值的该比例时排除
+            'workers': 0,  # 读取预览图的线程数，0表示CPU核数
+        }
+        
+        # RAW解码参数
+        self.raw_params = {
+            'half_size': False,  # 配准时半尺寸解码（每个2×2拜耳单元合成一个像素，不做插值），堆叠始终全分辨率
+            'demosaic': 'ahd',  # 配准时的去马赛克算法: ahd(高质量), linear(双线性，速度快)，堆叠始终用AHD
+            'workers': 0,  # 解码RAW文件的进程数，0表示CPU核数，1表示在当前线程解码
+        }
+        
+        # 检查点参数
+        self.checkpoint_params = {
+            'enabled': False,  # 堆叠时定期写入检查点，中断后可以继续
+            'directory': None,  # 检查点目录，None表示临时文件目录（scratch_dir，未指定时为系统临时目录）
+            'frame_interval': 100,  # 每累加/配准多少帧写入一次检查点（每一遍结束时总会写入）
+        }
+        
+        # 缓存参数
+        self.cache_params = {
+            'enabled': True,  # 是否在图像目录中缓存星点检测结果和变换矩阵
+            'directory': None,  # 缓存目录，None表示第一张图像所在目录
         }
     
     def set_star_detection_params(self, threshold=None, min_area=None, max_area=None, gaussian_blur=None):
@@ -64,14 +226,38 @@ class AstroStacker:
         if gaussian_blur is not None:
             self.star_detection_params['gaussian_blur'] = gaussian_blur
     
-    def set_alignment_params(self, max_features=None, match_threshold=None):
+    def set_alignment_params(self, max_features=None, match_threshold=None, match_radius=None, mutual_match=None,
+                             matcher=None, workers=None, executor=None, registration=None,
+                             pyramid_scale=None, predictive=None, cfa_registration=None):
         """设置图像对齐参数"""
         if max_features is not None:
             self.alignment_params['max_features'] = max_features
         if match_threshold is not None:
             self.alignment_params['match_threshold'] = match_threshold
+        if match_radius is not None:
+            self.alignment_params['match_radius'] = match_radius
+        if mutual_match is not None:
+            self.alignment_params['mutual_match'] = mutual_match
+        if matcher is not None:
+            self.alignment_params['matcher'] = matcher
+        if workers is not None:
+            self.alignment_params['workers'] = workers
+        if executor is not None:
+            self.alignment_params['executor'] = executor
+        if registration is not None:
+            self.alignment_params['registration'] = registration
+        if pyramid_scale is not None:
+            self.alignment_params['pyramid_scale'] = pyramid_scale
+        if predictive is not None:
+            self.alignment_params['predictive'] = predictive
+        if cfa_registration is not None:
+            self.alignment_params['cfa_registration'] = cfa_registration
     
-    def set_stacking_params(self, method=None, sigma_clip=None, sigma_lower=None, sigma_upper=None, rejection_ratio=None):
+    def set_stacking_params(self, method=None, sigma_clip=None, sigma_lower=None, sigma_upper=None, rejection_ratio=None,
+                            engine=None, memory_budget_mb=None, scratch_dir=None, pipeline=None,
+                            pipeline_depth=None, bit_depth=None, clip_iterations=None,
+                            quality_reject=None, quality_weighting=None, frame_cache_mb=None,
+                            shared_memory=None):
         """设置图像堆叠参数"""
         if method is not None:
             self.stacking_params['method'] = method
@@ -83,46 +269,377 @@ class AstroStacker:
             self.stacking_params['sigma_high'] = sigma_upper
         if rejection_ratio is not None:
             self.stacking_params['rejection_ratio'] = rejection_ratio
+        if engine is not None:
+            self.stacking_params['engine'] = engine
+        if memory_budget_mb is not None:
+            self.stacking_params['memory_budget_mb'] = memory_budget_mb
+        if scratch_dir is not None:
+            self.stacking_params['scratch_dir'] = scratch_dir
+        if pipeline is not None:
+            self.stacking_params['pipeline'] = pipeline
+        if pipeline_depth is not None:
+            self.stacking_params['pipeline_depth'] = pipeline_depth
+        if bit_depth is not None:
+            self.stacking_params['bit_depth'] = bit_depth
+        if clip_iterations is not None:
+            self.stacking_params['clip_iterations'] = clip_iterations
+        if quality_reject is not None:
+            self.stacking_params['quality_reject'] = quality_reject
+        if quality_weighting is not None:
+            self.stacking_params['quality_weighting'] = quality_weighting
+        if frame_cache_mb is not None:
+            self.stacking_params['frame_cache_mb'] = frame_cache_mb
+        if shared_memory is not None:
+            self.stacking_params['shared_memory'] = shared_memory
+    
+    def set_checkpoint_params(self, enabled=None, directory=None, frame_interval=None):
+        """设置检查点参数"""
+        if enabled is not None:
+            self.checkpoint_params['enabled'] = enabled
+        if directory is not None:
+            self.checkpoint_params['directory'] = directory
+        if frame_interval is not None:
+            self.checkpoint_params['frame_interval'] = max(1, int(frame_interval))
+    
+    def set_cache_params(self, enabled=None, directory=None):
+        """设置缓存参数"""
+        if enabled is not None:
+            self.cache_params['enabled'] = enabled
+        if directory is not None:
+            self.cache_params['directory'] = directory
+    
+    def set_calibration_frames(self, bias=None, dark=None, flat=None, flat_dark=None, method=None):
+        """设置校准帧文件列表，传入空列表表示不使用该类校准"""
+        if bias is not None:
+            self.calibration_params['bias'] = list(bias)
+        if dark is not None:
+            self.calibration_params['dark'] = list(dark)
+        if flat is not None:
+            self.calibration_params['flat'] = list(flat)
+        if flat_dark is not None:
+            self.calibration_params['flat_dark'] = list(flat_dark)
+        if method is not None:
+            self.calibration_params['method'] = method
+    
+    def set_defect_params(self, enabled=None, sigma=None, sample_frames=None):
+        """设置坏像素校正参数"""
+        if enabled is not None:
+            self.defect_params['enabled'] = enabled
+        if sigma is not None:
+            self.defect_params['sigma'] = sigma
+        if sample_frames is not None:
+            self.defect_params['sample_frames'] = sample_frames
+    
+    def set_raw_params(self, half_size=None, demosaic=None, workers=None):
+        """设置RAW解码参数"""
+        if half_size is not None:
+            self.raw_params['half_size'] = half_size
+        if demosaic is not None:
+            self.raw_params['demosaic'] = demosaic
+        if workers is not None:
+            self.raw_params['workers'] = workers
+    
+    def set_triage_params(self, enabled=None, preview_size=None, sigma=None, min_star_ratio=None, workers=None):
+        """设置预检参数"""
+        if enabled is not None:
+            self.triage_params['enabled'] = enabled
+        if preview_size is not None:
+            self.triage_params['preview_size'] = preview_size
+        if sigma is not None:
+            self.triage_params['sigma'] = sigma
+        if min_star_ratio is not None:
+            self.triage_params['min_star_ratio'] = min_star_ratio
+        if workers is not None:
+            self.triage_params['workers'] = workers
+    
+    def set_live_params(self, poll_interval=None, preview_interval=None):
+        """设置实时堆叠参数"""
+        if poll_interval is not None:
+            self.live_params['poll_interval'] = poll_interval
+        if preview_interval is not None:
+            self.live_params['preview_interval'] = preview_interval
+    
+    def high_bit_depth(self) -> bool:
+        """是否以16位读取图像并输出16位/浮点结果"""
+        return self.stacking_params.get('bit_depth', 8) != 8
+    
+    def load_frame(self, path: str) -> np.ndarray:
+        """读取单张亮场并校准，高位深模式下为uint16"""
+        image = self.decode_frame(path)
+        if self.calibration is not None:
+            image = self.calibration.apply(image)
+        if self.defect_map is not None:
+            image = self.defect_map.apply(image)
+        return image
+    
+    def decode_frame(self, path: str) -> np.ndarray:
+        """读取单张图像为RGB数组（不校准），高位深模式下为uint16"""
+        if Path(path).suffix.lower() in RAW_EXTENSIONS:
+            return self.load_raw_frame(path)
+        
+        if not self.high_bit_depth():
+            img = Image.open(path)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            return np.array(img)
+        
+        # PIL无法读取16位彩色图像，使用OpenCV保留原始位深（imdecode支持非ASCII路径）
+        image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError(f"无法读取图像: {path}")
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        elif image.shape[2] == 4:
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+        else:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return to_uint16(image)
+    
+    def load_raw_frame(self, path: str, registration: bool = False) -> np.ndarray:
+        """解码RAW文件为RGB数组，高位深模式下输出16位；加载期间在进程池中解码
+        
+        registration 为True时按配准参数（半尺寸、线性去马赛克）解码，否则全分辨率AHD解码。
+        解码进程把结果写入共享内存帧槽，只返回是否写入；帧槽在复制出结果后立即归还，
+        因为校准会原地修改图像，帧缓存也会长期持有图像
+        """
+        options = self.raw_decode_options(registration)
+        if self.decode_pool is None:
+            return decode_raw(path, **options)
+        
+        ring = self.decode_ring
+        if ring is None:
+            # 第一帧解码后才知道帧尺寸，之后的帧直接写入帧槽
+            image = self.decode_pool.submit(decode_raw, path, **options).result()
+            self.open_decode_ring(image)
+            return image
+        
+        slot = ring.acquire()
+        try:
+            image = self.decode_pool.submit(_decode_raw_worker, ring.spec, slot, path, options).result()
+            return ring.view(slot).copy() if image is None else image
+        finally:
+            ring.release(slot)
+    
+    def open_decode_ring(self, image: np.ndarray):
+        """按第一帧的尺寸创建解码结果的帧槽环（未启用共享内存或空间不足时保持pickle传输）"""
+        with self.decode_ring_lock:
+            if self.decode_ring is not None or self.decode_pool is None:
+                return
+            if not self.shared_transport(self.decode_slots, image.shape, image.dtype):
+                return
+            self.decode_ring = FrameRing(self.decode_slots, image.shape, image.dtype)
+    
+    def shared_transport(self, slots: int, shape: Tuple[int, ...], dtype) -> bool:
+        """进程池是否用共享内存帧槽传递 slots 帧该尺寸的图像"""
+        if not self.stacking_params.get('shared_memory', True):
+            return False
+        nbytes = slots * frame_nbytes(shape, dtype)
+        if not can_allocate(nbytes):
+            logger.warning(f"共享内存空间不足 ({nbytes / 1024 ** 2:.0f} MB)，进程间改用pickle传输帧")
+            return False
+        return True
+    
+    def load_cfa_plane(self, path: str) -> np.ndarray:
+        """读取RAW文件拜耳阵列的绿色平面（每个2×2单元一个像素，不去马赛克，不校准）"""
+        bit_depth = 16 if self.high_bit_depth() else 8
+        if self.decode_pool is not None:
+            return self.decode_pool.submit(decode_cfa_plane, path, bit_depth).result()
+        return decode_cfa_plane(path, bit_depth)
+    
+    def load_raw_proxy(self, path: str) -> np.ndarray:
+        """按配准参数解码RAW文件，只用于配准，不校准（主校准帧为全分辨率）"""
+        return self.load_raw_frame(path, registration=True)
+    
+    def raw_decode_options(self, registration: bool = False) -> Dict[str, Any]:
+        """decode_raw 的参数；半尺寸和线性去马赛克只用于配准，堆叠和主校准帧始终全分辨率AHD解码"""
+        options = {'bit_depth': 16 if self.high_bit_depth() else 8, 'half_size': False, 'demosaic': 'ahd'}
+        if registration:
+            options.update(half_size=self.raw_params.get('half_size', False),
+                           demosaic=self.raw_params.get('demosaic', 'ahd'))
+        return options
+    
+    def raw_cache_params(self) -> Dict[str, Any]:
+        """影响配准用RAW解码结果的参数（位深另外记录），默认解码时为空，已有的缓存仍然有效"""
+        params = {key: self.raw_params.get(key) for key in ('half_size', 'demosaic')}
+        return {} if params == {'half_size': False, 'demosaic': 'ahd'} else {'raw': params}
+    
+    def decode_workers(self, image_paths: List[str]) -> int:
+        """解码RAW文件的进程数，没有RAW文件或只用一个进程时为0"""
+        raw_count = sum(1 for path in image_paths if Path(path).suffix.lower() in RAW_EXTENSIONS)
+        workers = min(self.raw_params.get('workers', 0) or os.cpu_count() or 1, raw_count)
+        return workers if workers > 1 else 0
+    
+    @contextmanager
+    def raw_decode_pool(self, image_paths: List[str]):
+        """
+        在 with 块内用进程池解码RAW文件，产出进程数（为0时不使用进程池）
+        
+        rawpy解码是单线程且持有GIL的CPU密集运算，只有多进程才能并行；
+        进程池只负责解码，校准和坏像素替换仍在当前进程中进行
+        """
+        workers = self.decode_workers(image_paths)
+        if workers == 0:
+            yield 0
+            return
+        self.decode_pool = create_process_pool(workers)
+        self.decode_slots = workers
+        try:
+            yield workers
+        finally:
+            pool, self.decode_pool = self.decode_pool, None
+            pool.shutdown(cancel_futures=True)
+            ring, self.decode_ring = self.decode_ring, None
+            if ring is not None:
+                ring.close()
+    
+    def frame_loader(self, proxy: Optional[str] = None) -> Callable[[str], np.ndarray]:
+        """读取单帧的函数：proxy 为 'cfa' 时读取绿色平面，为 'raw' 时按配准参数解码，否则读取并校准亮场"""
+        if proxy == 'cfa':
+            return self.load_cfa_plane
+        if proxy == 'raw':
+            return self.load_raw_proxy
+        return self.load_frame
+    
+    def try_load_frame(self, path: str, proxy: Optional[str] = None) -> Optional[np.ndarray]:
+        """读取单帧（proxy 见 frame_loader），失败时记录日志并返回None"""
+        try:
+            return self.frame_loader(proxy)(path)
+        except Exception as e:
+            logger.error(f"加载图像失败 {path}: {e}")
+            return None
+    
+    def iter_loaded_frames(self, image_paths: List[str], proxy: Optional[str] = None
+                           ) -> Iterator[Tuple[str, Optional[np.ndarray]]]:
+        """按顺序产出 (路径, 图像)，加载失败的图像为None
+        
+        有RAW文件时在进程池中解码，每个解码进程对应一个加载线程，
+        同时在途的帧数限制为进程数的两倍
+        """
+        with self.raw_decode_pool(image_paths) as workers:
+            if not workers:
+                for path in image_paths:
+                    yield path, self.try_load_frame(path, proxy)
+                return
+            
+            executor = ThreadPoolExecutor(max_workers=workers)
+            pending = deque()
+            try:
+                for path in image_paths:
+                    pending.append((path, executor.submit(self.try_load_frame, path, proxy)))
+                    if len(pending) >= workers * 2:
+                        done, future = pending.popleft()
+                        yield done, future.result()
+                while pending:
+                    done, future = pending.popleft()
+                    yield done, future.result()
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+    
+    def preview_score(self, path: str) -> Optional[Dict[str, float]]:
+        """读取预览图并评分，文件未变时直接使用上次的评分；无法读取时返回None"""
+        try:
+            stat = Path(path).stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+            cached = self.preview_scores.get(path)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+            score = score_preview(load_preview(path, self.triage_params.get('preview_size', 400)))
+            self.preview_scores[path] = (signature, score)
+            return score
+        except Exception as e:
+            logger.warning(f"无法读取预览图 {Path(path).name}: {e}")
+            return None
+    
+    def triage_frames(self, image_paths: List[str]) -> List[Dict[str, Any]]:
+        """按预览图并行评估所有帧并决定是否排除，返回与 image_paths 顺序相同的决定
+        
+        只读取RAW内嵌预览或缩小解码的图像，不做全分辨率解码；无法读取预览的帧保留，
+        交给加载阶段处理
+        """
+        total = len(image_paths)
+        workers = self.triage_params.get('workers', 0) or None
+        
+        scores = []
+        if workers == 1:
+            results = map(self.preview_score, image_paths)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+            results = executor.map(self.preview_score, image_paths)
+        try:
+            for n, score in enumerate(results):
+                scores.append(score)
+                if self.progress_callback:
+                    self.progress_callback(f"预检图像 {n+1}/{total}", (n + 1) / total * 100)
+        finally:
+            if workers != 1:
+                executor.shutdown()
+        
+        scored = [i for i, score in enumerate(scores) if score is not None]
+        decisions = triage_decisions([scores[i] for i in scored],
+                                     self.triage_params.get('sigma', 4.0),
+                                     self.triage_params.get('min_star_ratio', 0.5))
+        results = [{'excluded': False, 'reason': None} for _ in image_paths]
+        for i, decision in zip(scored, decisions):
+            results[i] = decision
+        for path, decision in zip(image_paths, results):
+            decision['path'] = path
+        
+        self.triage_results = results
+        excluded = [Path(d['path']).name for d in results if d['excluded']]
+        if excluded:
+            logger.info(f"预检排除 {len(excluded)} 张图像: {', '.join(excluded)}")
+        return results
+    
+    def triaged_paths(self, image_paths: List[str]) -> List[str]:
+        """启用预检时返回通过预检的路径，否则原样返回"""
+        if not self.triage_params.get('enabled'):
+            self.triage_results = []
+            return list(image_paths)
+        return [d['path'] for d in self.triage_frames(image_paths) if not d['excluded']]
     
-    def load_images(self, image_paths: List[str]) -> bool:
-        """加载图像文件"""
+    def load_images(self, image_paths: List[str], proxy: Optional[str] = None) -> bool:
+        """
+        加载图像文件，proxy 不为None时只读取配准帧（见 frame_loader），堆叠时重新全分辨率解码
+        
+        只完整解码参考图像，其余帧只读取文件头确认可以识别并记录尺寸，在配准时才解码；
+        self.images 中只保存帧句柄，解码结果放入按字节预算淘汰的帧缓存，超出预算的帧在之后需要时重新解码
+        """
         try:
             self.images = []
+            self.image_paths = list(image_paths)
+            self.frame_quality = {}
+            self.assessed_stars = {}
+            self.proxy_frames = proxy
+            self.frame_cache = FrameCache(self.stacking_params.get('frame_cache_mb', 1024))
+            loader = self.frame_loader(proxy)
             total = len(image_paths)
             
             for i, path in enumerate(image_paths):
                 if self.cancel_flag:
                     return False
-                    
-                try:
-                    # 加载图像
-                    img = Image.open(path)
-                    
-                    # 转换为RGB模式
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    # 转换为numpy数组
-                    img_array = np.array(img)
-                    
-                    self.images.append({
-                        'path': path,
-                        'image': img_array,
-                        'original': img
-                    })
-                    
-                    if self.progress_callback:
-                        self.progress_callback(f"加载图像: {Path(path).name}", (i + 1) / total * 20)
-                        
-                except Exception as e:
-                    logger.error(f"加载图像失败 {path}: {e}")
+                handle = self.frame_handle(path, loader, proxy)
+                if handle is None:
                     continue
+                
+                if not self.images:
+                    # 第一张可以读取的图像为参考图像，始终保留
+                    image = self.try_load_frame(path, proxy)
+                    if image is None:
+                        continue
+                    self.reference_image = image
+                    self.frame_cache.put(path, image)
+                    handle.shape, handle.dtype = image.shape, image.dtype
+                self.images.append(handle)
+                
+                if self.progress_callback:
+                    self.progress_callback(f"加载图像: {Path(path).name}", (i + 1) / total * 20)
             
             if len(self.images) < 2:
                 raise ValueError("至少需要2张图像进行堆叠")
-                
-            # 设置第一张图像为参考图像
-            self.reference_image = self.images[0]['image']
+            
+            self.loaded_calibration = self.calibration_key
+            self.loaded_defects = self.defect_key
+            self.loaded_raw = self.raw_decode_options(proxy == 'raw')
             logger.info(f"成功加载 {len(self.images)} 张图像")
             return True
             
@@ -130,59 +647,420 @@ class AstroStacker:
             logger.error(f"加载图像时出错: {e}")
             return False
     
-    def detect_stars(self, image: np.ndarray) -> List[Tuple[float, float]]:
-        """检测图像中的星点"""
+    def frame_handle(self, path: str, loader: Callable[[str], np.ndarray],
+                     proxy: Optional[str] = None) -> Optional[FrameHandle]:
+        """
+        按文件头建立帧句柄（不解码），无法识别的文件记录日志并返回None
+        
+        全分辨率图像的尺寸取自文件头（RGB，高位深模式下为uint16）；
+        配准帧（绿色平面、缩小解码）的尺寸在第一次解码后记录
+        """
         try:
-            # 转换为灰度图
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-            else:
-                gray = image.copy()
+            width, height = read_image_size(path)
+            stat = Path(path).stat()
+        except Exception as e:
+            logger.error(f"加载图像失败 {path}: {e}")
+            return None
+        shape, dtype = None, None
+        if proxy is None:
+            shape, dtype = (height, width, 3), np.dtype(np.uint16 if self.high_bit_depth() else np.uint8)
+        return FrameHandle(path, loader, self.frame_cache, shape=shape, dtype=dtype,
+                           metadata={'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+    
+    def frame_image(self, index: int) -> Optional[np.ndarray]:
+        """解码第 index 帧，失败时记录日志并返回None（该帧按对齐失败处理）"""
+        try:
+            return self.images[index].image
+        except Exception as e:
+            logger.error(f"加载图像失败 {self.images[index].path}: {e}")
+            return None
+    
+    def calibration_signature(self) -> Optional[str]:
+        """当前校准帧设置的标识（文件指纹和合成参数），没有校准帧时为None"""
+        params = self.master_params()
+        keys = {kind: master_key(kind, self.calibration_params[kind], params)
+                for kind in CALIBRATION_KINDS if self.calibration_params[kind]}
+        return params_key(keys) if keys else None
+    
+    def master_params(self) -> Dict[str, Any]:
+        """影响主校准帧的合成参数（RAW校准帧始终全分辨率解码，不受配准解码参数影响）"""
+        return dict(method=self.calibration_params['method'], high_bit_depth=self.high_bit_depth())
+    
+    def prepare_calibration(self) -> bool:
+        """按当前校准帧设置准备主校准帧，设置未变化时直接复用，失败时返回False"""
+        try:
+            signature = self.calibration_signature()
+            if signature is None:
+                self.calibration, self.calibration_key = None, None
+                return True
+            if signature == self.calibration_key and self.calibration is not None:
+                return True
+            
+            masters = {}
+            for kind in CALIBRATION_KINDS:
+                paths = self.calibration_params[kind]
+                if not paths:
+                    continue
+                if self.progress_callback:
+                    self.progress_callback(f"生成主{kind}帧", 0)
+                masters[kind] = self.build_master(kind, paths)
+                if masters[kind] is None:
+                    raise ValueError(f"无法生成主{kind}帧")
             
-            # 高斯模糊减少噪点
-            blurred = cv2.GaussianBlur(gray, (0, 0), self.star_detection_params['gaussian_blur'])
+            dtype = np.uint16 if self.high_bit_depth() else np.uint8
+            self.calibration = CalibrationMasters(dtype=dtype, **masters)
+            self.calibration_key = signature
+            logger.info(f"使用校准帧: {', '.join(masters)}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"准备校准帧失败: {e}")
+            self.calibration, self.calibration_key = None, None
+            return False
+    
+    def defect_sample(self, image_paths: List[str]) -> List[str]:
+        """用于时间统计的亮场（均匀抽样），有暗场时不需要"""
+        if self.calibration_params['dark']:
+            return []
+        count = min(self.defect_params['sample_frames'], len(image_paths))
+        if count < 3:
+            return []
+        return [image_paths[i] for i in np.linspace(0, len(image_paths) - 1, count).round().astype(int)]
+    
+    def defect_signature(self, image_paths: List[str]) -> Optional[str]:
+        """坏像素表的输入标识，未启用时为None"""
+        if not self.defect_params['enabled']:
+            return None
+        return params_key({'calibration': self.calibration_signature(),
+                           'frames': self.defect_sample(image_paths),
+                           'sigma': self.defect_params['sigma'],
+                           'min_fraction': self.defect_params['min_fraction']})
+    
+    def prepare_defect_map(self, image_paths: List[str]):
+        """
+        每次堆叠检测一次坏像素表：有暗场时在主暗场中查找热像素，
+        否则在抽样的亮场中按时间统计查找热像素和冷像素
+        """
+        signature = self.defect_signature(image_paths)
+        if signature is not None and signature == self.defect_key:
+            return
+        self.defect_map, self.defect_key = None, None
+        if signature is None:
+            return
+        
+        try:
+            sigma = self.defect_params['sigma']
+            sample = self.defect_sample(image_paths)
+            if self.calibration is not None and self.calibration_params['dark']:
+                offset = self.calibration.offset
+                indices, shape = find_defects_in_dark(offset, sigma), offset.shape
+            elif sample:
+                if self.progress_callback:
+                    self.progress_callback("检测热像素", 0)
+                # 此时坏像素表为空，load_frame 只做校准
+                first = self.load_frame(sample[0])
+                frames = (first if i == 0 else self.load_frame(path) for i, path in enumerate(sample))
+                indices = find_defects_in_frames(frames, sigma, self.defect_params['min_fraction'])
+                shape = first.shape
+            else:
+                logger.warning("没有暗场且亮场太少，无法检测热像素")
+                return
             
-            # 自适应阈值处理
-            _, thresh = cv2.threshold(blurred, self.star_detection_params['threshold'], 255, cv2.THRESH_BINARY)
+            self.defect_map = DefectMap(indices, shape)
+            self.defect_key = signature
+            logger.info(f"检测到 {len(self.defect_map)} 个坏像素")
             
-            # 查找轮廓
-            contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        except Exception as e:
+            logger.error(f"检测热像素失败: {e}")
+            self.defect_map, self.defect_key = None, None
+    
+    def build_master(self, kind: str, paths: List[str]) -> Optional[np.ndarray]:
+        """合成主校准帧（float32），以输入文件指纹和合成参数为键缓存到磁盘"""
+        key = master_key(kind, paths, self.master_params())
+        directory = self.cache_params['directory'] or str(Path(paths[0]).resolve().parent)
+        path = master_path(directory, kind, key)
+        
+        if self.cache_params['enabled']:
+            master = load_master(path)
+            if master is not None:
+                logger.info(f"读取缓存的主{kind}帧: {path}")
+                return master
+        
+        master = self.combine_frames(paths, self.calibration_params['method'])
+        if master is not None and self.cache_params['enabled']:
+            save_master(path, master)
+        return master
+    
+    def combine_frames(self, paths: List[str], method: str) -> Optional[np.ndarray]:
+        """用堆叠的流式累加器或磁盘映射行带归约合成未对齐的帧，返回float32数组"""
+        try:
+            if method in STREAMING_METHODS:
+                accumulator = create_accumulator(method, self.stacking_params)
+                while True:
+                    for path in paths:
+                        accumulator.add(self.decode_frame(path))
+                    if not accumulator.needs_another_pass():
+                        break
+                    accumulator.next_pass()
+                return accumulator.result()
             
-            star_points = []
-            for contour in contours:
-                area = cv2.contourArea(contour)
-                
-                # 过滤面积不合适的轮廓
-                if (self.star_detection_params['min_area'] <= area <= 
-                    self.star_detection_params['max_area']):
-                    
-                    # 计算质心
-                    M = cv2.moments(contour)
-                    if M["m00"] != 0:
-                        cx = M["m10"] / M["m00"]
-                        cy = M["m01"] / M["m00"]
-                        star_points.append((cx, cy))
-            
-            # 按亮度排序，选择最亮的星点
-            if len(star_points) > self.alignment_params['max_features']:
-                # 计算每个星点的亮度
-                star_brightness = []
-                for x, y in star_points:
-                    x, y = int(x), int(y)
-                    if 0 <= x < gray.shape[1] and 0 <= y < gray.shape[0]:
-                        brightness = float(gray[y, x])
-                        star_brightness.append((brightness, (x, y)))
+            first = self.decode_frame(paths[0])
+            with MemmapFrameStore(len(paths), first.shape, first.dtype,
+                                  self.stacking_params.get('scratch_dir')) as store:
+                store.append(first)
+                for path in paths[1:]:
+                    store.append(self.decode_frame(path))
                 
-                # 按亮度排序并选择前N个
-                star_brightness.sort(reverse=True)
-                star_points = [point for _, point in star_brightness[:self.alignment_params['max_features']]]
+                result = np.empty(first.shape, dtype=np.float32)
+                budget = self.stacking_params.get('memory_budget_mb', 1024)
+                for y0, y1 in store.iter_bands(budget, bytes_per_value=16):
+                    band = store.band(y0, y1)
+                    if method not in NATIVE_METHODS:
+                        band = band.astype(np.float32)
+                    result[y0:y1] = self.reduce_stack(band, method)
+                return result
+            
+        except Exception as e:
+            logger.error(f"合成校准帧失败: {e}")
+            return None
+    
+    def detect_stars(self, image: np.ndarray) -> List[Tuple[float, float]]:
+        """检测图像中的星点，按亮度从高到低返回亚像素质心"""
+        return self.detect_frame(image)[0]
+    
+    def detect_frame(self, image: np.ndarray) -> Tuple[List[Tuple[float, float]], Optional[Dict[str, float]]]:
+        """检测星点并由检测结果得到帧质量指标，返回 (星点列表, 质量指标)，失败时为 ([], None)"""
+        try:
+            catalog = self.detect_star_catalog(image, self.proxy_detection_params())
+            star_points = list(zip(catalog['x'].tolist(), catalog['y'].tolist()))
             
             logger.info(f"检测到 {len(star_points)} 个星点")
-            return star_points
+            return star_points, frame_quality_metrics(catalog)
             
         except Exception as e:
             logger.error(f"星点检测失败: {e}")
-            return []
+            return [], None
+    
+    def proxy_detection_params(self) -> Optional[Dict[str, Any]]:
+        """绿色平面或半尺寸配准帧上的检测参数：一个像素对应2×2个像素，模糊半径减半、面积缩小为1/4"""
+        half_size = self.proxy_frames == 'raw' and self.raw_params.get('half_size', False)
+        if self.proxy_frames != 'cfa' and not half_size:
+            return None
+        params = self.star_detection_params
+        return {
+            'gaussian_blur': max(0.5, params['gaussian_blur'] / 2),
+            'min_area': max(1, params['min_area'] // 4),
+            'max_area': max(2, params['max_area'] // 4),
+        }
+    
+    def detect_star_catalog(self, image: np.ndarray, params: Optional[Dict[str, Any]] = None,
+                            max_features: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """
+        用外轮廓找到连通域的外接框，只在外接框内标记和测量，全部统计量以向量化方式计算
+        
+        params 可覆盖部分星点检测参数（如降采样图像上的检测），不修改 star_detection_params
+        
+        Returns:
+            按峰值亮度从高到低排列、最多 max_features 个星点的数组字典：
+            x, y: 以高于阈值部分的亮度加权的亚像素质心
+            area: 像素面积
+            peak: 峰值亮度（未模糊的灰度）
+            flux: 高于阈值部分的积分亮度
+            fwhm: 半峰全宽（像素）
+            以及整帧的标量 count（通过筛选的星点总数）、background（背景亮度）、noise（背景噪声），
+            亮度均为检测所用的8位灰度
+        """
+        params = dict(self.star_detection_params, **(params or {}))
+        
+        # 转换为灰度图
+        if len(image.shape) == 3:
+            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        else:
+            gray = image
+        
+        # 检测阈值按8位亮度设置，高位深图像先缩放到8位（绿色平面等视图复制为连续数组，按一维索引取窗口）
+        gray = np.ascontiguousarray(to_uint8(gray))
+        
+        # 高斯模糊减少噪点，核在3σ处截断（OpenCV默认的核对8位图像更宽，外侧权重取整后为0，只增加耗时）
+        sigma = params['gaussian_blur']
+        ksize = 2 * max(1, int(3 * sigma)) + 1
+        blurred = cv2.GaussianBlur(gray, (ksize, ksize), sigma)
+        
+        # 阈值处理
+        threshold = params['threshold']
+        
+        # 在稀疏采样的直方图中用低于阈值的像素估计背景和噪声，星点不参与
+        hist = cv2.calcHist([gray[::4, ::4]], [0], None, [256], [0, 256]).ravel()
+        sky = hist[:min(256, int(np.ceil(threshold)))]
+        background, noise = histogram_median_std(sky if sky.sum() else hist)
+        _, thresh = cv2.threshold(blurred, threshold, 255, cv2.THRESH_BINARY)
+        
+        # 外轮廓只跟踪连通域的边界，比标记整幅图像快得多；外接框和轮廓起点向量化计算
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes, seeds = contour_boxes(contours)
+        
+        # 8连通域的像素数不少于外接框的长边、不多于外接框面积，先按外接框排除一定不合适的连通域
+        width, height = boxes[:, 2], boxes[:, 3]
+        candidates = ((width * height >= params['min_area']) &
+                      (np.maximum(width, height) <= params['max_area']))
+        boxes, seeds = boxes[candidates], seeds[candidates]
+        
+        areas, cx, cy, peak, flux, fwhm = self.measure_components(gray, blurred, thresh, boxes, seeds,
+                                                                  threshold, background)
+        # 过滤面积不合适的连通域
+        valid = (areas >= params['min_area']) & (areas <= params['max_area']) & (flux > 0)
+        areas, cx, cy, peak, flux, fwhm = (areas[valid], cx[valid], cy[valid], peak[valid], flux[valid],
+                                           fwhm[valid])
+        
+        # 按亮度选择最亮的星点，部分排序即可
+        max_features = max_features or self.alignment_params['max_features']
+        order = np.arange(len(areas))
+        if len(order) > max_features:
+            order = np.argpartition(-peak, max_features - 1)[:max_features]
+        order = order[np.lexsort((-flux[order], -peak[order]))]
+        
+        return {
+            'x': cx[order],
+            'y': cy[order],
+            'area': areas[order],
+            'peak': peak[order],
+            'flux': flux[order],
+            'fwhm': fwhm[order],
+            'count': len(areas),
+            'background': background,
+            'noise': noise,
+        }
+    
+    def measure_components(self, gray: np.ndarray, blurred: np.ndarray, thresh: np.ndarray,
+                           boxes: np.ndarray, seeds: np.ndarray, threshold: float,
+                           background: float = 0.0
+                           ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        在各连通域的外接框内计算 (像素面积, 质心x, 质心y, 峰值, 积分亮度, 半峰全宽)
+        
+        boxes 为 (N, 4) 的外接框 (left, top, width, height)，seeds 为 (N, 2) 的连通域内一点 (x, y)。
+        外接框按尺寸分组（2的幂），每组用同样大小的窗口一次性提取；窗口拼接后标记连通域，
+        只保留包含 seed 的那一个，排除落入外接框的相邻连通域。
+        计算量与星点像素数成正比，不需要遍历整幅图像
+        """
+        n = len(boxes)
+        areas = np.zeros(n, dtype=np.int64)
+        cx, cy = np.zeros(n), np.zeros(n)
+        peak, flux, fwhm = np.zeros(n, dtype=np.float32), np.zeros(n), np.zeros(n)
+        if n == 0:
+            return areas, cx, cy, peak, flux, fwhm
+        
+        left, top, width, height = boxes.T
+        size = np.maximum(width, height)
+        patch_sizes = np.where(size <= 16, size, 1 << np.ceil(np.log2(size)).astype(np.int64))
+        h, w = thresh.shape
+        
+        for patch in np.unique(patch_sizes):
+            sel = np.flatnonzero(patch_sizes == patch)
+            offsets = np.arange(patch)
+            rows = top[sel, None] + offsets
+            cols = left[sel, None] + offsets
+            # 超出外接框的部分不属于该连通域，截断到图像内后再用掩码排除
+            inside = ((offsets < height[sel, None])[:, :, None] &
+                      (offsets < width[sel, None])[:, None, :])
+            rows, cols = np.minimum(rows, h - 1), np.minimum(cols, w - 1)
+            # 一维索引只计算一次，三幅图像都按它取窗口
+            index = (rows[:, :, None] * w + cols[:, None, :]).ravel()
+            shape = (len(sel), patch, patch)
+            
+            # 窗口之间留一行一列空白，竖直拼接后一次标记
+            mosaic = np.zeros((len(sel), patch + 1, patch + 1), dtype=np.uint8)
+            mosaic[:, :patch, :patch] = np.where(inside, thresh.ravel().take(index).reshape(shape), 0)
+            _, labels = cv2.connectedComponents(mosaic.reshape(-1, patch + 1), connectivity=8,
+                                                ltype=cv2.CV_32S)
+            labels = labels.reshape(mosaic.shape)[:, :patch, :patch]
+            own = labels[np.arange(len(sel)), seeds[sel, 1] - top[sel], seeds[sel, 0] - left[sel]]
+            mask = labels == own[:, None, None]
+            areas[sel] = np.count_nonzero(mask, axis=(1, 2))
+            
+            # 以高于阈值的部分作为权重，减小背景对质心的影响；先按行、列求和再乘坐标
+            weights = blurred.ravel().take(index).reshape(shape).astype(np.float32) - np.float32(threshold)
+            weights[~mask] = 0
+            total = weights.sum(axis=(1, 2), dtype=np.float64)
+            safe_total = np.where(total > 0, total, 1.0)
+            
+            flux[sel] = total
+            cx[sel] = (weights.sum(axis=1, dtype=np.float64) * cols).sum(axis=1) / safe_total
+            cy[sel] = (weights.sum(axis=2, dtype=np.float64) * rows).sum(axis=1) / safe_total
+            values = gray.ravel().take(index).reshape(shape)
+            values[~mask] = 0
+            peak[sel] = values.max(axis=(1, 2))
+            
+            # 不低于半峰值的面积换算为等效圆直径，拖线或失焦的星点面积更大
+            half = (peak[sel] + background) / 2
+            half_area = np.count_nonzero(values >= half[:, None, None], axis=(1, 2))
+            fwhm[sel] = 2 * np.sqrt(half_area / np.pi)
+        
+        return areas, cx, cy, peak, flux, fwhm
+    
+    def quality_enabled(self) -> bool:
+        """是否需要在配准前评估所有帧的质量"""
+        return (self.stacking_params.get('quality_reject', 0) > 0 or
+                bool(self.stacking_params.get('quality_weighting', False)))
+    
+    def assess_frames(self, load: Callable[[int], np.ndarray], total: int):
+        """
+        在配准和变换之前测量所有帧的质量，按 quality_reject 排除最差的帧并计算加权权重
+        
+        load(i) 返回第 i 帧图像，无法读取时为None；参考帧（索引0）始终保留，且至少保留两帧
+        """
+        self.rejected_frames = set()
+        self.frame_weights = {}
+        self.quality_rejection = self.stacking_params.get('quality_reject', 0)
+        if not self.quality_enabled():
+            return
+        
+        if self.progress_callback:
+            self.progress_callback("评估帧质量", 25)
+        
+        def measure(i):
+            if self.cancel_flag:
+                return
+            image = load(i)
+            if image is not None:
+                self.get_frame_quality(i, image)
+        
+        pending = [i for i in range(total) if i not in self.frame_quality]
+        workers = self.alignment_params.get('workers', 0)
+        if workers > 1 and len(pending) > 1:
+            # 星点检测在OpenCV中释放GIL，线程池即可并行
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(measure, pending))
+        else:
+            for i in pending:
+                measure(i)
+        
+        # 检测失败的帧没有质量指标，视为最差
+        weights = quality_weights(self.frame_quality)
+        count = min(int(self.quality_rejection * total), total - 2)
+        if count > 0:
+            ranked = sorted(range(1, total), key=lambda i: weights.get(i, 0.0))
+            self.rejected_frames = set(ranked[:count])
+            for i in self.rejected_frames:
+                self.assessed_stars.pop(i, None)
+            logger.info(f"按质量排除 {count} 张图像: {sorted(self.rejected_frames)}")
+        if self.stacking_params.get('quality_weighting'):
+            self.frame_weights = weights
+        if self.checkpoint is not None:
+            self.checkpoint.frame_quality = {self.frame_path(i): metrics
+                                             for i, metrics in self.frame_quality.items()}
+    
+    def frame_weight(self, index: int) -> float:
+        """帧的质量权重，未启用质量加权时为1"""
+        if not self.frame_weights:
+            return 1.0
+        return self.frame_weights.get(index, 0.0)
+    
+    def stack_weights(self) -> Optional[np.ndarray]:
+        """按 self.transforms 顺序排列的已对齐帧权重，未启用质量加权时为None"""
+        if not self.frame_weights:
+            return None
+        return np.array([self.frame_weight(i) for i in self.transforms], dtype=np.float32)
     
     def align_images(self) -> bool:
         """对齐所有图像到参考图像"""
@@ -191,55 +1069,12 @@ class AstroStacker:
                 return False
             
             self.aligned_images = []
-            total = len(self.images)
-            
-            # 检测参考图像的星点
-            ref_stars = self.detect_stars(self.reference_image)
-            if len(ref_stars) < 10:
-                raise ValueError("参考图像中检测到的星点太少，无法进行对齐")
-            
-            if self.progress_callback:
-                self.progress_callback("检测参考图像星点", 25)
+            for i, aligned in self.iter_aligned_frames():
+                self.aligned_images.append(owned(aligned))
+                self.record_frame(i, ALIGNED)
             
-            for i, img_data in enumerate(self.images):
-                if self.cancel_flag:
-                    return False
-                
-                try:
-                    current_image = img_data['image']
-                    
-                    if i == 0:
-                        # 参考图像直接添加
-                        self.aligned_images.append(current_image)
-                        if self.progress_callback:
-                            self.progress_callback(f"处理参考图像", 30 + (i / total) * 40)
-                        continue
-                    
-                    # 检测当前图像的星点
-                    current_stars = self.detect_stars(current_image)
-                    
-                    if len(current_stars) < 10:
-                        logger.warning(f"图像 {i} 中检测到的星点太少，跳过")
-                        continue
-                    
-                    # 星点匹配
-                    transformation_matrix = self.match_stars(ref_stars, current_stars)
-                    
-                    if transformation_matrix is not None:
-                        # 应用变换
-                        h, w = self.reference_image.shape[:2]
-                        aligned = cv2.warpAffine(current_image, transformation_matrix, (w, h))
-                        self.aligned_images.append(aligned)
-                        logger.info(f"成功对齐图像 {i}")
-                    else:
-                        logger.warning(f"图像 {i} 对齐失败，跳过")
-                    
-                    if self.progress_callback:
-                        self.progress_callback(f"对齐图像 {i+1}/{total}", 30 + ((i + 1) / total) * 40)
-                        
-                except Exception as e:
-                    logger.error(f"对齐图像 {i} 时出错: {e}")
-                    continue
+            if self.cancel_flag:
+                return False
             
             logger.info(f"成功对齐 {len(self.aligned_images)} 张图像")
             return len(self.aligned_images) >= 2
@@ -248,139 +1083,1311 @@ class AstroStacker:
             logger.error(f"图像对齐失败: {e}")
             return False
     
-    def match_stars(self, ref_stars: List[Tuple[float, float]], 
-                   current_stars: List[Tuple[float, float]]) -> Optional[np.ndarray]:
-        """匹配两组星点并计算变换矩阵"""
-        try:
-            if len(ref_stars) < 3 or len(current_stars) < 3:
-                return None
-            
-            # 转换为numpy数组
-            ref_points = np.array(ref_stars, dtype=np.float32)
-            cur_points = np.array(current_stars, dtype=np.float32)
-            
-            # 使用最近邻匹配
-            matches = []
-            for i, ref_point in enumerate(ref_points):
-                min_dist = float('inf')
-                best_match = -1
-                
-                for j, cur_point in enumerate(cur_points):
-                    dist = np.linalg.norm(ref_point - cur_point)
-                    if dist < min_dist:
-                        min_dist = dist
-                        best_match = j
-                
-                # 只保留距离合理的匹配
-                if min_dist < 100:  # 像素距离阈值
-                    matches.append((i, best_match))
-            
-            if len(matches) < 3:
-                return None
+    def iter_aligned_frames(self, transform_registered: bool = True) -> Iterator[Tuple[int, np.ndarray]]:
+        """逐帧对齐图像，按顺序产出 (图像索引, 对齐后的图像)
+        
+        对齐后的图像不会被保存，调用方可以直接累加后丢弃，
+        变换矩阵记录在 self.transforms 中以便再次变换。
+        从检查点继续时，已配准的帧按检查点中的变换矩阵重新变换后产出；
+        transform_registered 为False时这些帧只记录变换矩阵，不解码也不产出
+        """
+        self.transforms = {}
+        total = len(self.images)
+        self.open_cache()
+        
+        # 检测参考图像的星点
+        ref_stars = self.reference_stars()
+        if len(ref_stars) < 10:
+            raise ValueError("参考图像中检测到的星点太少，无法进行对齐")
+        
+        self.prepare_reference(ref_stars)
+        
+        if self.progress_callback:
+            self.progress_callback("检测参考图像星点", 25)
+        
+        # 配准前按质量排除最差的帧，这些帧不再配准、变换和写入
+        self.assess_frames(self.frame_image, total)
+        
+        # 从检查点继续时，已有结果的帧不再加载和配准，已配准的帧不再配准
+        resumed = self.resumed_frames(total)
+        registered = self.registered_frames(total)
+        
+        # 结果按图像顺序返回，进度因此单调递增
+        for i, aligned, transformation_matrix in self.iter_frame_alignments(ref_stars, {**resumed, **registered}):
+            if self.progress_callback:
+                message = "处理参考图像" if i == 0 else f"对齐图像 {i+1}/{total}"
+                self.progress_callback(message, 30 + ((i + 1) / total) * 40)
             
-            # 提取匹配的点对
-            src_pts = np.array([cur_points[m[1]] for m in matches], dtype=np.float32)
-            dst_pts = np.array([ref_points[m[0]] for m in matches], dtype=np.float32)
+            if i in resumed:
+                if resumed[i] is not None:
+                    self.transforms[i] = resumed[i]
+                continue
             
-            # 计算仿射变换矩阵
-            transformation_matrix = cv2.estimateAffinePartial2D(
-                src_pts, dst_pts,
-                method=cv2.RANSAC,
-                ransacReprojThreshold=self.alignment_params['ransac_threshold']
-            )[0]
+            if i in registered:
+                transformation_matrix = registered[i]
+                if not transform_registered:
+                    self.transforms[i] = transformation_matrix
+                    continue
+                image = self.frame_image(i)
+                if image is None:
+                    transformation_matrix = None
+                else:
+                    aligned = image if i == 0 else self.warp_frame(image, transformation_matrix)
             
-            return transformation_matrix
+            if transformation_matrix is None:
+                self.record_frame(i, REJECTED if i in self.rejected_frames else FAILED)
+                continue
             
-        except Exception as e:
-            logger.error(f"星点匹配失败: {e}")
-            return None
+            self.transforms[i] = transformation_matrix
+            yield i, aligned
     
-    def stack_images(self) -> Optional[np.ndarray]:
-        """堆叠对齐后的图像"""
+    def prepare_reference(self, ref_stars: List[Tuple[float, float]],
+                          reference_data: Optional[Dict[str, np.ndarray]] = None):
+        """构建所有帧共用的参考数据：星组索引、金字塔配准和相位相关配准的参考
+        
+        在并行对齐开始前调用，工作线程只读取这些数据；
+        reference_data 为主进程中已计算好的数据（进程池工作进程没有参考图像）
+        """
+        # 星组索引只为参考星点构建一次，供所有帧查询
+        use_asterism = self.alignment_params['matcher'] in ('asterism', 'auto')
+        self.asterism_index = None
+        if use_asterism:
+            self.asterism_index = AsterismIndex(np.array(ref_stars, dtype=np.float32))
+        
+        if reference_data is None:
+            reference_data = self.build_reference_data(ref_stars)
+        self.reference_data = reference_data
+        
+        coarse_stars = reference_data.get('coarse_stars')
+        self.coarse_index = None
+        if coarse_stars is not None and use_asterism and len(coarse_stars) >= 3:
+            self.coarse_index = AsterismIndex(coarse_stars)
+        
+        luminance = reference_data['phase_luminance']
+        self.phase_window = cv2.createHanningWindow((luminance.shape[1], luminance.shape[0]), cv2.CV_32F)
+    
+    def build_reference_data(self, ref_stars: List[Tuple[float, float]]) -> Dict[str, np.ndarray]:
+        """计算快速配准所需的参考数据
+        
+        refine_points 为用窗口质心重新测量的最亮参考星点，
+        精配准时当前帧用同样的窗口质心测量，两边的测量偏差相互抵消
+        """
+        registration = self.alignment_params.get('registration', 'stars')
+        data = {
+            # 星点过少的帧总是尝试相位相关，因此始终准备
+            'phase_luminance': self.phase_luminance(self.reference_image),
+        }
+        
+        if registration in ('pyramid', 'phase'):
+            radius = int(self.alignment_params['refine_radius'])
+            ref_points = np.asarray(ref_stars, dtype=np.float64).reshape(-1, 2)
+            ref_points = ref_points[:self.alignment_params['refine_stars'] * 2]
+            measured, valid = measure_window_centroids(self.reference_image, ref_points, radius)
+            data['refine_points'] = measured[valid]
+        
+        if registration == 'pyramid':
+            data['coarse_stars'] = self.detect_coarse_stars(self.reference_image)
+        
+        return data
+    
+    def iter_frame_alignments(self, ref_stars: List[Tuple[float, float]],
+                              resumed: Optional[Dict[int, Optional[np.ndarray]]] = None
+                              ) -> Iterator[Tuple[int, Optional[np.ndarray], Optional[np.ndarray]]]:
+        """按图像顺序产出每帧的 (图像索引, 对齐后的图像, 变换矩阵)，失败的帧为 (索引, None, None)
+        
+        resumed 为从检查点继续时已有结果（已累加或已配准）的帧 {索引: 变换矩阵}，与按质量排除的帧一样
+        不加载也不对齐，产出 (索引, None, None)；无法解码的帧按对齐失败处理。
+        alignment_params['workers'] > 1 时多帧并行处理，同时在途的帧数限制为工作数的两倍，
+        RAW文件在解码进程池中解码。进程池通过共享内存帧槽传递图像时，产出的是帧槽视图，
+        只在下一次迭代前有效，需要保留的调用方应复制（transport.owned）
+        """
+        h, w = self.reference_image.shape[:2]
+        workers = self.alignment_params.get('workers', 0)
+        resumed = resumed or {}
+        skip = self.rejected_frames | set(resumed)
+        # 并行对齐时各帧独立配准，不使用预测
+        self.predicting = workers <= 1 and self.alignment_params.get('predictive', True)
+        
+        if workers <= 1:
+            # 顺序处理时记录最近对齐成功的帧，用于预测下一帧的变换
+            history = []
+            for i in range(len(self.images)):
+                if self.cancel_flag:
+                    return
+                if i in skip:
+                    if resumed.get(i) is not None:
+                        # 已有结果的帧仍用于预测后面的帧，与不中断时的配准一致
+                        history = (history + [(i, resumed[i])])[-2:]
+                    yield i, None, None
+                    continue
+                image = self.frame_image(i)
+                if image is None:
+                    yield i, None, None
+                    continue
+                prediction = self.predict_transform(i, history)
+                aligned, matrix = self.align_frame(i, image, ref_stars, prediction=prediction)
+                if matrix is not None:
+                    history = (history + [(i, matrix)])[-2:]
+                yield i, aligned, matrix
+            return
+        
+        resources = ExitStack()
+        executor, loaders, rings = None, None, None
         try:
-            if not self.aligned_images:
-                return None
-            
-            if self.progress_callback:
-                self.progress_callback("开始图像堆叠", 75)
-            
-            # 转换为浮点数组以避免溢出
-            images_array = np.array(self.aligned_images, dtype=np.float64)
-            
-            method = self.stacking_params['method']
-            
-            if method == 'average':
-                # 平均堆叠
-                result = np.mean(images_array, axis=0)
-                
-            elif method == 'median':
-                # 中位数堆叠
-                result = np.median(images_array, axis=0)
+            # 未缓存的RAW帧在解码进程池中解码，加载线程或对齐线程只等待结果并校准
+            resources.enter_context(self.raw_decode_pool([handle.path for handle in self.images]))
+            if self.alignment_params.get('executor') == 'process':
+                # OpenCV之外的部分（匹配、投票）受GIL限制，进程池可以完全并行
+                executor = create_process_pool(
+                    workers,
+                    initializer=_init_align_worker,
+                    initargs=(ref_stars, self.star_detection_params, self.alignment_params, (w, h),
+                              [self.frame_path(i) for i in range(len(self.images))],
+                              self.star_cache.path if self.star_cache is not None else None,
+                              self.stacking_params, self.reference_data, self.calibration_key, self.defect_key,
+                              self.raw_params, self.proxy_frames, self.checkpoint is not None)
+                )
+                shape, dtype = self.reference_image.shape, self.reference_image.dtype
+                if self.shared_transport(workers * 4 + 1, shape, dtype):
+                    # 在途的每帧占用一个输入槽和一个输出槽，调用方正在读取的帧另占一个输出槽
+                    rings = (resources.enter_context(FrameRing(workers * 2, shape, dtype)),
+                             resources.enter_context(FrameRing(workers * 2 + 1, shape, dtype)))
                 
-            elif method == 'maximum':
-                # 最大值堆叠
-                result = np.max(images_array, axis=0)
-                
-            elif method == 'sigma_clip':
-                # Sigma裁剪堆叠
-                result = self.sigma_clip_stack(images_array)
+                def load_and_submit(i):
+                    image = self.frame_image(i)
+                    if image is None:
+                        return None
+                    # 评估质量时检测的星点随任务传给工作进程
+                    stars = self.assessed_stars.pop(i, None)
+                    if rings is not None:
+                        return self.submit_shared_alignment(executor, rings, i, image, stars)
+                    return executor.submit(_align_frame_worker, i, image, stars=stars)
                 
+                # 工作进程不能访问帧缓存和主校准帧，帧在加载线程中解码和校准后再提交，
+                # 提交方不等待解码，各帧的解码与对齐同时进行
+                loaders = ThreadPoolExecutor(max_workers=workers)
+                submit = lambda i: loaders.submit(load_and_submit, i)
             else:
-                # 默认使用平均堆叠
-                result = np.mean(images_array, axis=0)
-            
-            # 确保结果在有效范围内
-            result = np.clip(result, 0, 255).astype(np.uint8)
+                # OpenCV在检测和变换时释放GIL，线程池即可重叠各帧的计算；未缓存的帧在工作线程中解码
+                def align_loaded(i):
+                    image = self.frame_image(i)
+                    if image is None:
+                        return None, None
+                    return self.align_frame(i, image, ref_stars)
+                
+                executor = ThreadPoolExecutor(max_workers=workers)
+                submit = lambda i: executor.submit(align_loaded, i)
             
-            if self.progress_callback:
-                self.progress_callback("堆叠完成", 95)
+            def receive(index, task) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], Optional[int]]:
+                """等待一帧的结果，返回 (对齐后的图像, 变换矩阵, 调用方读取后要归还的输出槽)"""
+                if task is not None and loaders is not None:
+                    # 加载线程解码后提交的对齐任务，无法解码的帧为None
+                    task = task.result()
+                if task is None:
+                    return None, None, None
+                if loaders is None:
+                    # 线程池中对齐，星点已在本进程中记录
+                    return task.result() + (None,)
+                if rings is None:
+                    aligned, matrix, stars = task.result()
+                    self.note_frame_stars(index, stars)
+                    return aligned, matrix, None
+                future, source_slot, target_slot = task
+                try:
+                    aligned, matrix, stars = future.result()
+                finally:
+                    if source_slot is not None:
+                        rings[0].release(source_slot)
+                self.note_frame_stars(index, stars)
+                if matrix is None or aligned is not None:
+                    rings[1].release(target_slot)
+                    return aligned, matrix, None
+                return rings[1].view(target_slot), matrix, target_slot
             
-            logger.info(f"使用 {method} 方法成功堆叠 {len(self.aligned_images)} 张图像")
-            return result
+            pending = deque()
+            for i in range(len(self.images)):
+                if self.cancel_flag:
+                    return
+                # 排除的帧不提交，但仍按顺序产出
+                pending.append((i, None if i in skip else submit(i)))
+                
+                if len(pending) >= workers * 2:
+                    j, task = pending.popleft()
+                    aligned, matrix, slot = receive(j, task)
+                    yield j, aligned, matrix
+                    if slot is not None:
+                        rings[1].release(slot)
             
-        except Exception as e:
-            logger.error(f"图像堆叠失败: {e}")
-            return None
+            while pending:
+                if self.cancel_flag:
+                    return
+                j, task = pending.popleft()
+                aligned, matrix, slot = receive(j, task)
+                yield j, aligned, matrix
+                if slot is not None:
+                    rings[1].release(slot)
+        finally:
+            for pool in (loaders, executor):
+                if pool is not None:
+                    pool.shutdown(wait=False, cancel_futures=True)
+            resources.close()
     
-    def sigma_clip_stack(self, images_array: np.ndarray) -> np.ndarray:
-        """Sigma裁剪堆叠算法"""
+    def submit_shared_alignment(self, executor: ProcessPoolExecutor, rings: Tuple[FrameRing, FrameRing],
+                                index: int, image: np.ndarray,
+                                stars: Optional[List[Tuple[float, float]]] = None):
+        """把图像复制到输入槽并提交对齐任务，工作进程把结果变换到输出槽
+        
+        stars 为已检测的星点（工作进程不再检测）；返回 (future, 输入槽, 输出槽)，
+        尺寸与参考图像不同的帧不占输入槽，按pickle传递
+        """
+        source, target = rings
+        source_slot = None
+        if source.fits(image):
+            source_slot = source.acquire()
+            np.copyto(source.view(source_slot), image)
+            image = None
+        target_slot = target.acquire()
+        future = executor.submit(_align_frame_worker, index, image,
+                                 (source.spec, target.spec), (source_slot, target_slot), stars)
+        return future, source_slot, target_slot
+    
+    def align_frame(self, index: int, image: np.ndarray, ref_stars: List[Tuple[float, float]],
+                    frame_size: Optional[Tuple[int, int]] = None,
+                    prediction: Optional[np.ndarray] = None, out: Optional[np.ndarray] = None
+                    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """对齐单帧图像，返回 (对齐后的图像, 变换矩阵)，失败时均为None
+        
+        prediction 为预测的变换矩阵，提供时先在其附近配准，失败再做完整匹配；
+        out 为变换结果的目标数组（如共享内存帧槽），参考图像不变换，仍返回原图像
+        """
         try:
-            # 计算初始平均值和标准差
-            mean = np.mean(images_array, axis=0)
-            std = np.std(images_array, axis=0)
-            
-            # 创建掩码，排除异常值
-            sigma_low = self.stacking_params['sigma_low']
-            sigma_high = self.stacking_params['sigma_high']
+            if index == 0:
+                # 参考图像直接添加
+                return image, np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float64)
             
-            lower_bound = mean - sigma_low * std
-            upper_bound = mean + sigma_high * std
+            # 检测参数和匹配参数未变化时直接使用缓存的变换矩阵
+            cached, transformation_matrix = self.get_cached_transform(index)
+            if not cached:
+                transformation_matrix = self.compute_transform(index, image, ref_stars, prediction)
             
-            # 扩展维度以便广播
-            lower_bound = np.expand_dims(lower_bound, axis=0)
-            upper_bound = np.expand_dims(upper_bound, axis=0)
+            if transformation_matrix is None:
+                logger.warning(f"图像 {index} 对齐失败，跳过")
+                return None, None
             
-            # 创建有效像素掩码
-            valid_mask = (images_array >= lower_bound) & (images_array <= upper_bound)
-            
-            # 计算加权平均
-            masked_images = np.where(valid_mask, images_array, 0)
-            valid_count = np.sum(valid_mask, axis=0)
-            
-            # 避免除零
-            valid_count = np.where(valid_count == 0, 1, valid_count)
-            
-            result = np.sum(masked_images, axis=0) / valid_count
-            
-            return result
+            # 应用变换
+            aligned = self.warp_frame(image, transformation_matrix, frame_size, out)
+            logger.info(f"成功对齐图像 {index}")
+            return aligned, transformation_matrix
             
         except Exception as e:
-            logger.error(f"Sigma裁剪堆叠失败: {e}")
-            return np.mean(images_array, axis=0)
+            logger.error(f"对齐图像 {index} 时出错: {e}")
+            return None, None
     
-    def enhance_result(self, image: np.ndarray) -> np.ndarray:
-        """增强堆叠结果"""
+    def compute_transform(self, index: int, image: np.ndarray,
+                          ref_stars: List[Tuple[float, float]],
+                          prediction: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """检测星点并匹配，计算帧到参考图像的变换矩阵，结果（包括失败）写入缓存"""
+        registration = self.alignment_params.get('registration', 'stars')
+        refine_points = (self.reference_data or {}).get('refine_points')
+        if prediction is not None and refine_points is not None:
+            # 直接在预测位置附近测量参考星点，不做粗配准和整幅检测
+            transformation_matrix = self.refine_transform(image, refine_points, prediction)
+            if transformation_matrix is not None:
+                self.put_cached_transform(index, transformation_matrix)
+                return transformation_matrix
+        
+        if registration != 'stars':
+            # 金字塔或相位相关配准，失败时退回全分辨率星点匹配
+            transformation_matrix = self.register_fast(image, ref_stars)
+            if transformation_matrix is not None:
+                self.put_cached_transform(index, transformation_matrix)
+                return transformation_matrix
+            logger.info(f"图像 {index} {registration} 配准失败，使用全分辨率星点匹配")
+        
+        # 检测当前图像的星点
+        current_stars = self.get_frame_stars(index, image)
+        
+        if len(current_stars) < 10:
+            # 星点太少时尝试相位相关（如薄云、月光下的帧）
+            logger.warning(f"图像 {index} 中检测到的星点太少，尝试相位相关配准")
+            transformation_matrix = self.register_phase(image, refine=False)
+        else:
+            transformation_matrix = None
+            if prediction is not None:
+                transformation_matrix = self.match_predicted(ref_stars, current_stars, prediction)
+                if transformation_matrix is None:
+                    logger.info(f"图像 {index} 预测配准失败，使用完整星点匹配")
+            if transformation_matrix is None:
+                # 星点匹配
+                transformation_matrix = self.match_stars(ref_stars, current_stars)
+        
+        self.put_cached_transform(index, transformation_matrix)
+        return transformation_matrix
+    
+    def register_fast(self, image: np.ndarray,
+                      ref_stars: List[Tuple[float, float]]) -> Optional[np.ndarray]:
+        """按 registration 参数进行金字塔或相位相关配准，失败时返回None"""
+        registration = self.alignment_params.get('registration', 'stars')
+        if registration == 'phase':
+            return self.register_phase(image)
+        if registration == 'pyramid':
+            return self.register_pyramid(image, ref_stars)
+        return None
+    
+    def phase_luminance(self, image: np.ndarray) -> np.ndarray:
+        """相位相关使用的降采样亮度图（float32，去除大尺度背景）"""
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+        small = downsample(gray, self.alignment_params['phase_scale']).astype(np.float32)
+        # 光污染梯度和暗角会把相关峰拉向零位移，减去大尺度背景只保留星点
+        return small - cv2.GaussianBlur(small, (0, 0), 8)
+    
+    def register_phase(self, image: np.ndarray, refine: bool = True) -> Optional[np.ndarray]:
+        """
+        用FFT相位相关估计帧间平移
+        
+        只适用于平移（赤道仪跟踪的序列），相关峰较弱时返回None；
+        refine 为True且有精配准参考星点时再用全分辨率窗口质心精化，
+        精化失败说明帧间存在旋转等非平移运动，同样返回None
+        """
+        if self.reference_data is None:
+            return None
+        
+        reference = self.reference_data['phase_luminance']
+        luminance = self.phase_luminance(image)
+        if luminance.shape != reference.shape:
+            return None
+        
+        (dx, dy), response = cv2.phaseCorrelate(reference, luminance, self.phase_window)
+        if response < self.alignment_params['phase_min_response']:
+            logger.info(f"相位相关峰值过低 ({response:.3f})")
+            return None
+        
+        # 当前帧相对参考帧平移了 (dx, dy)，变换矩阵将其移回
+        scale = self.alignment_params['phase_scale']
+        transformation_matrix = np.array([[1, 0, -dx * scale], [0, 1, -dy * scale]], dtype=np.float64)
+        
+        refine_points = self.reference_data.get('refine_points')
+        if refine and refine_points is not None:
+            return self.refine_transform(image, refine_points, transformation_matrix)
+        return transformation_matrix
+    
+    def detect_coarse_stars(self, image: np.ndarray) -> np.ndarray:
+        """在降采样图像上检测星点，返回全分辨率坐标系下的 (N, 2) 数组"""
+        scale = self.alignment_params['pyramid_scale']
+        gray = to_uint8(cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image)
+        small = downsample(gray, scale)
+        
+        # 区域平均会把星点峰值压低，阈值按降采样倍数相对背景降低；面积和模糊半径同样缩小
+        background = float(np.median(small[::4, ::4]))
+        threshold = self.star_detection_params['threshold']
+        params = {
+            'threshold': background + max(1.0, (threshold - background) / scale),
+            'gaussian_blur': max(0.5, self.star_detection_params['gaussian_blur'] / scale),
+            'min_area': 1,
+            'max_area': max(2, self.star_detection_params['max_area'] // scale ** 2),
+        }
+        catalog = self.detect_star_catalog(small, params)
+        
+        # 降采样像素中心 i 对应全分辨率坐标 i*scale + (scale-1)/2
+        offset = (scale - 1) / 2.0
+        return np.column_stack([catalog['x'] * scale + offset, catalog['y'] * scale + offset])
+    
+    def register_pyramid(self, image: np.ndarray,
+                         ref_stars: List[Tuple[float, float]]) -> Optional[np.ndarray]:
+        """由粗到精配准：降采样图像上匹配得到初始变换，再用少量全分辨率星点精化"""
+        if self.reference_data is None or 'coarse_stars' not in self.reference_data:
+            return None
+        
+        ref_coarse = self.reference_data['coarse_stars']
+        coarse_stars = self.detect_coarse_stars(image)
+        if len(coarse_stars) < 3 or len(ref_coarse) < 3:
+            return None
+        
+        # 降采样星点已换算到全分辨率坐标，匹配半径和RANSAC阈值不变
+        coarse_matrix = self.match_stars(ref_coarse, coarse_stars, asterism_index=self.coarse_index)
+        if coarse_matrix is None:
+            return None
+        
+        return self.refine_transform(image, self.reference_data['refine_points'], coarse_matrix)
+    
+    def refine_transform(self, image: np.ndarray, ref_points: np.ndarray,
+                         initial_matrix: np.ndarray) -> Optional[np.ndarray]:
+        """
+        在初始变换预测的位置附近测量参考星点的全分辨率质心，重新拟合变换
+        
+        只读取每颗星周围的小窗口，不做整幅图像的星点检测
+        """
+        radius = int(self.alignment_params['refine_radius'])
+        h, w = image.shape[:2]
+        ref_points = np.asarray(ref_points, dtype=np.float64).reshape(-1, 2)
+        
+        # 参考星点按亮度排列，预测它们在当前帧中的位置
+        inverse = cv2.invertAffineTransform(initial_matrix)
+        predicted = ref_points @ inverse[:, :2].T + inverse[:, 2]
+        inside = ((predicted[:, 0] >= radius) & (predicted[:, 0] < w - radius - 1) &
+                  (predicted[:, 1] >= radius) & (predicted[:, 1] < h - radius - 1))
+        count = self.alignment_params['refine_stars']
+        ref_points, predicted = ref_points[inside][:count], predicted[inside][:count]
+        if len(ref_points) < self.alignment_params['min_inliers']:
+            return None
+        
+        measured, valid = measure_window_centroids(image, predicted, radius)
+        src_pts, dst_pts = measured[valid], ref_points[valid]
+        if len(src_pts) < self.alignment_params['min_inliers']:
+            return None
+        
+        transformation_matrix, inliers = cv2.estimateAffinePartial2D(
+            src_pts.astype(np.float32), dst_pts.astype(np.float32),
+            method=cv2.RANSAC, ransacReprojThreshold=min(2.0, self.alignment_params['ransac_threshold'])
+        )
+        # 初始变换有误（如相位相关遇到旋转）时，大部分预测位置附近找不到对应星点
+        required = max(self.alignment_params['min_inliers'],
+                       self.alignment_params['min_inlier_ratio'] * len(ref_points))
+        if transformation_matrix is None or inliers is None or inliers.sum() < required:
+            return None
+        return transformation_matrix
+    
+    def frame_path(self, index: int) -> Optional[str]:
+        """返回帧对应的文件路径"""
+        if self.images:
+            return self.images[index].path if index < len(self.images) else None
+        return self.image_paths[index] if index < len(self.image_paths) else None
+    
+    def open_cache(self) -> Optional[StackingCache]:
+        """打开当前图像所在目录的星点缓存"""
+        if not self.cache_params['enabled']:
+            if self.star_cache is not None:
+                self.star_cache.close()
+            self.star_cache = None
+            return None
+        
+        paths = [handle.path for handle in self.images] or self.image_paths
+        location = StackingCache.location(paths, self.cache_params['directory'])
+        if self.star_cache is not None:
+            if self.star_cache.path == location:
+                return self.star_cache
+            self.star_cache.close()
+        
+        self.star_cache = StackingCache.open(location)
+        return self.star_cache
+    
+    def detection_cache_params(self) -> Dict[str, Any]:
+        """影响星点检测结果的全部参数"""
+        # 高位深模式下检测的是缩放到8位的亮度，与8位读取的结果可能略有差异
+        return dict(self.star_detection_params, max_features=self.alignment_params['max_features'],
+                    high_bit_depth=self.high_bit_depth(), detector='contour_boxes',
+                    calibration=self.calibration_key, defects=self.defect_key,
+                    **(self.raw_cache_params() if self.proxy_frames == 'raw' else {}),
+                    **({'cfa': True} if self.proxy_frames == 'cfa' else {}))
+    
+    def get_frame_stars(self, index: int, image: np.ndarray) -> List[Tuple[float, float]]:
+        """获取帧的星点列表，评估质量时已检测或检测参数未变化时直接读取缓存"""
+        path = self.frame_path(index)
+        params = self.detection_cache_params()
+        
+        # 评估质量时检测的星点只用于配准一次，之后释放
+        stars = self.assessed_stars.pop(index, None)
+        if stars is not None:
+            self.note_frame_stars(index, stars)
+            return stars
+        
+        # 从检查点继续时使用检查点中保存的星点
+        if self.checkpoint is not None and path in self.checkpoint.frame_stars:
+            return self.checkpoint.frame_stars[path]
+        
+        if self.star_cache is not None and path:
+            stars = self.star_cache.get_stars(path, params)
+            if stars is not None:
+                quality = self.star_cache.get_quality(path, params)
+                if quality is not None:
+                    self.frame_quality[index] = quality
+                self.note_frame_stars(index, stars)
+                return stars
+        
+        return self.store_frame_detection(index, image)
+    
+    def get_frame_quality(self, index: int, image: np.ndarray) -> Optional[Dict[str, float]]:
+        """获取帧的质量指标，缓存中没有时检测星点（星点保留到配准时使用，不再重复检测）"""
+        if index in self.frame_quality:
+            return self.frame_quality[index]
+        
+        path = self.frame_path(index)
+        if self.star_cache is not None and path:
+            quality = self.star_cache.get_quality(path, self.detection_cache_params())
+            if quality is not None:
+                self.frame_quality[index] = quality
+                return quality
+        
+        self.assessed_stars[index] = self.store_frame_detection(index, image)
+        return self.frame_quality.get(index)
+    
+    def store_frame_detection(self, index: int, image: np.ndarray) -> List[Tuple[float, float]]:
+        """检测帧的星点，记录质量指标并写入缓存，返回星点列表"""
+        path = self.frame_path(index)
+        params = self.detection_cache_params()
+        stars, quality = self.detect_frame(image)
+        if quality is not None:
+            self.frame_quality[index] = quality
+        if self.star_cache is not None and path:
+            self.star_cache.put_stars(path, params, stars)
+            if quality is not None:
+                self.star_cache.put_quality(path, params, quality)
+        self.note_frame_stars(index, stars)
+        return stars
+    
+    def note_frame_stars(self, index: int, stars: Optional[List[Tuple[float, float]]]):
+        """记录帧的星点：有检查点时写入检查点，在对齐工作进程中暂存，随对齐结果传回主进程"""
+        if stars is None:
+            return
+        if self.checkpoint is not None:
+            self.checkpoint.record_stars(self.frame_path(index), stars)
+        elif self.collected_stars is not None:
+            self.collected_stars[index] = stars
+    
+    def alignment_cache_params(self) -> Dict[str, Any]:
+        """影响变换矩阵的全部参数（星点检测参数和匹配参数）"""
+        params = self.detection_cache_params()
+        for key in ('match_threshold', 'ransac_threshold', 'match_radius', 'mutual_match',
+                    'matcher', 'min_inliers', 'min_inlier_ratio', 'registration'):
+            params[key] = self.alignment_params[key]
+        # 相位相关也用于星点过少的帧，其参数始终影响结果
+        keys = ['phase_scale', 'phase_min_response']
+        if params['registration'] in ('pyramid', 'phase'):
+            keys += ['refine_stars', 'refine_radius']
+        if params['registration'] == 'pyramid':
+            keys.append('pyramid_scale')
+        # 预测只在顺序对齐中使用，并行对齐的结果与预测参数无关
+        if self.predicting:
+            keys += ['predictive', 'predict_radius']
+        for key in keys:
+            params[key] = self.alignment_params[key]
+        return params
+    
+    def get_cached_transform(self, index: int) -> Tuple[bool, Optional[np.ndarray]]:
+        """读取帧到参考图像的缓存变换矩阵，返回 (是否命中, 变换矩阵)"""
+        reference, path = self.frame_path(0), self.frame_path(index)
+        if self.star_cache is None or not reference or not path:
+            return False, None
+        return self.star_cache.get_transform(reference, path, self.alignment_cache_params())
+    
+    def put_cached_transform(self, index: int, transformation_matrix: Optional[np.ndarray]):
+        """缓存帧到参考图像的变换矩阵，None表示对齐失败"""
+        reference, path = self.frame_path(0), self.frame_path(index)
+        if self.star_cache is not None and reference and path:
+            self.star_cache.put_transform(reference, path, self.alignment_cache_params(), transformation_matrix)
+    
+    def warp_frame(self, image: np.ndarray, transformation_matrix: np.ndarray,
+                   frame_size: Optional[Tuple[int, int]] = None,
+                   out: Optional[np.ndarray] = None) -> np.ndarray:
+        """将图像按变换矩阵变换到参考图像坐标系，frame_size为 (宽, 高)，提供 out 时写入其中"""
+        if frame_size is None:
+            h, w = self.reference_image.shape[:2]
+            frame_size = (w, h)
+        return cv2.warpAffine(image, transformation_matrix, frame_size, dst=out)
+    
+    def match_stars(self, ref_stars: List[Tuple[float, float]], 
+                   current_stars: List[Tuple[float, float]],
+                   asterism_index: Optional[AsterismIndex] = None) -> Optional[np.ndarray]:
+        """匹配两组星点并计算变换矩阵，asterism_index 为 ref_stars 预先构建的星组索引"""
+        try:
+            if len(ref_stars) < 3 or len(current_stars) < 3:
+                return None
+            
+            # 转换为numpy数组
+            ref_points = np.array(ref_stars, dtype=np.float32)
+            cur_points = np.array(current_stars, dtype=np.float32)
+            matcher = self.alignment_params['matcher']
+            
+            transformation_matrix = None
+            if matcher in ('nearest', 'auto'):
+                # 基于空间索引的最近邻匹配
+                matches = match_nearest_neighbors(
+                    ref_points, cur_points,
+                    max_distance=self.alignment_params['match_radius'],
+                    ratio=self.alignment_params['match_threshold'],
+                    mutual=self.alignment_params['mutual_match']
+                )
+                transformation_matrix, inliers = self.estimate_transform(ref_points, cur_points, matches)
+                
+                # 帧间位移过大时最近邻匹配多为随机对应，内点比例很低
+                if matcher == 'auto' and (inliers < self.alignment_params['min_inliers'] or
+                                          inliers < self.alignment_params['min_inlier_ratio'] * len(matches)):
+                    transformation_matrix = None
+            
+            if transformation_matrix is None and matcher in ('asterism', 'auto'):
+                # 星组匹配，与平移、旋转和缩放无关
+                index = asterism_index
+                if index is None:
+                    if (self.asterism_index is None or
+                            not np.array_equal(self.asterism_index.ref_points, ref_points)):
+                        self.asterism_index = AsterismIndex(ref_points)
+                    index = self.asterism_index
+                matches = index.match(cur_points)
+                transformation_matrix, inliers = self.estimate_transform(ref_points, cur_points, matches)
+                
+                if inliers < self.alignment_params['min_inliers']:
+                    transformation_matrix = None
+            
+            return transformation_matrix
+            
+        except Exception as e:
+            logger.error(f"星点匹配失败: {e}")
+            return None
+    
+    def predict_transform(self, index: int,
+                          history: List[Tuple[int, np.ndarray]]) -> Optional[np.ndarray]:
+        """
+        根据之前对齐成功的帧预测当前帧的变换矩阵
+        
+        history 为最近的 [(帧索引, 变换矩阵), ...]，两帧以上时按帧索引线性外推（匀速漂移），
+        只有一帧时沿用其变换，未启用或没有历史时返回None
+        """
+        if not self.alignment_params.get('predictive', True) or index == 0 or not history:
+            return None
+        last_index, last = history[-1]
+        if len(history) < 2:
+            return last.copy()
+        previous_index, previous = history[-2]
+        step = (index - last_index) / float(last_index - previous_index)
+        return last + (last - previous) * step
+    
+    def match_predicted(self, ref_stars: List[Tuple[float, float]],
+                        current_stars: List[Tuple[float, float]],
+                        prediction: np.ndarray) -> Optional[np.ndarray]:
+        """
+        以预测变换为初值匹配星点，失败时返回None
+        
+        当前星点先按预测变换映射到参考坐标系，匹配半径缩小到 predict_radius，
+        与累计漂移量无关；预测残差足够小时直接用最小二乘拟合，跳过RANSAC
+        """
+        if len(ref_stars) < 3 or len(current_stars) < 3:
+            return None
+        ref_points = np.asarray(ref_stars, dtype=np.float64).reshape(-1, 2)
+        cur_points = np.asarray(current_stars, dtype=np.float64).reshape(-1, 2)
+        mapped = cur_points @ prediction[:, :2].T + prediction[:, 2]
+        matches = match_nearest_neighbors(
+            ref_points, mapped,
+            max_distance=self.alignment_params['predict_radius'],
+            ratio=self.alignment_params['match_threshold'],
+            mutual=self.alignment_params['mutual_match']
+        )
+        required = max(self.alignment_params['min_inliers'],
+                       self.alignment_params['min_inlier_ratio'] * len(matches))
+        if len(matches) < required:
+            return None
+        
+        residuals = np.linalg.norm(mapped[matches[:, 1]] - ref_points[matches[:, 0]], axis=1)
+        inliers = residuals < self.alignment_params['ransac_threshold']
+        if inliers.sum() >= required:
+            # 预测已经足够准确，内点确定后直接拟合
+            return fit_similarity(cur_points[matches[inliers, 1]], ref_points[matches[inliers, 0]])
+        
+        transformation_matrix, count = self.estimate_transform(
+            ref_points.astype(np.float32), cur_points.astype(np.float32), matches)
+        if count < required:
+            return None
+        return transformation_matrix
+    
+    def estimate_transform(self, ref_points: np.ndarray, cur_points: np.ndarray,
+                           matches: np.ndarray) -> Tuple[Optional[np.ndarray], int]:
+        """根据匹配点对用RANSAC估计仿射变换，返回 (变换矩阵, 内点数)"""
+        if len(matches) < 3:
+            return None, 0
+        
+        # 提取匹配的点对
+        src_pts = cur_points[matches[:, 1]]
+        dst_pts = ref_points[matches[:, 0]]
+        
+        # 计算仿射变换矩阵
+        transformation_matrix, inliers = cv2.estimateAffinePartial2D(
+            src_pts, dst_pts,
+            method=cv2.RANSAC,
+            ransacReprojThreshold=self.alignment_params['ransac_threshold']
+        )
+        
+        if transformation_matrix is None or inliers is None:
+            return None, 0
+        return transformation_matrix, int(inliers.sum())
+    
+    def stack_images(self) -> Optional[np.ndarray]:
+        """堆叠对齐后的图像"""
         try:
+            if not self.aligned_images:
+                return None
+            
+            if self.progress_callback:
+                self.progress_callback("开始图像堆叠", 75)
+            
+            method = self.stacking_params['method']
+            if method in NATIVE_METHODS:
+                # 中值和像素拒绝按行带在原数据类型上归约，不需要整个立方体的浮点副本
+                images_array = np.stack(self.aligned_images)
+            else:
+                # 转换为float32数组以避免溢出（精度足够且内存只有float64的一半）
+                images_array = np.array(self.aligned_images, dtype=np.float32)
+
+            result = self.reduce_stack(images_array, method, self.stack_weights())
+            
+            # 确保结果在有效范围内
+            result = self.to_output(result)
+            
+            if self.progress_callback:
+                self.progress_callback("堆叠完成", 95)
+            
+            logger.info(f"使用 {method} 方法成功堆叠 {len(self.aligned_images)} 张图像")
+            return result
+            
+        except Exception as e:
+            logger.error(f"图像堆叠失败: {e}")
+            return None
+    
+    def reduce_stack(self, images_array: np.ndarray, method: str,
+                     weights: Optional[np.ndarray] = None) -> np.ndarray:
+        """沿第0轴（帧）归约图像数组，weights 为各帧的质量权重（只用于平均堆叠）"""
+        if method == 'average':
+            if weights is not None and weights.sum() > 0:
+                # 质量加权平均，tensordot 保持float32，不生成加权后的立方体
+                return np.tensordot(weights, images_array, axes=1) / weights.sum()
+            # 平均堆叠
+            return np.mean(images_array, axis=0)
+        
+        if method == 'median':
+            # 中位数堆叠
+            return self.median_stack(images_array)
+        
+        if method == 'maximum':
+            # 最大值堆叠
+            return np.max(images_array, axis=0)
+        
+        if method in REJECTION_METHODS:
+            # Sigma裁剪、Winsorized Sigma裁剪、百分位裁剪
+            return self.reject_stack(images_array, method)
+        
+        # 默认使用平均堆叠
+        return np.mean(images_array, axis=0)
+    
+    def resolve_engine(self, method: Optional[str] = None) -> str:
+        """根据堆叠方法确定实际使用的堆叠引擎
+        
+        auto 只把单遍的方法交给流式累加；需要多遍的方法（迭代Sigma裁剪）在流式累加时每一遍都要重新解码和变换
+        所有帧，自动模式下改为写入磁盘映射存储后只归约一次
+        """
+        method = method or self.stacking_params['method']
+        engine = self.stacking_params.get('engine', 'memory')
+        
+        if method in STREAMING_METHODS and (engine == 'streaming' or
+                                            (engine == 'auto' and not self.multi_pass(method))):
+            return 'streaming'
+        if engine in ('out_of_core', 'auto'):
+            return 'out_of_core'
+        if engine == 'streaming':
+            logger.warning(f"堆叠方法 {method} 不支持流式处理，使用内存模式")
+        return 'memory'
+    
+    def multi_pass(self, method: str) -> bool:
+        """流式累加该方法时是否需要多遍遍历所有帧"""
+        return method in STREAMING_METHODS and create_accumulator(method, self.stacking_params).passes > 1
+    
+    def stack_images_streaming(self) -> Optional[np.ndarray]:
+        """流式对齐并堆叠图像
+        
+        每帧对齐后立即折叠进累加器，不保留对齐后的图像，峰值内存只有累加状态（几个单帧大小的数组，
+        Sigma裁剪为float64的和与平方和等，不随迭代次数增加）；多遍的方法每一遍重新解码并变换所有帧。
+        启用检查点时定期保存累加状态
+        """
+        completed = False
+        try:
+            if not self.images or self.reference_image is None:
+                return None
+            
+            method = self.stacking_params['method']
+            accumulator = create_accumulator(method, self.stacking_params)
+            self.aligned_images = []
+            self.start_checkpoint(accumulator, self.frame_records)
+            
+            for i, aligned in self.iter_aligned_frames():
+                accumulator.add(aligned, self.frame_weight(i))
+                self.record_frame(i, INTEGRATED)
+            
+            if self.cancel_flag:
+                return None
+            
+            logger.info(f"成功对齐 {len(self.transforms)} 张图像")
+            if len(self.transforms) < 2:
+                return None
+            
+            if self.progress_callback:
+                self.progress_callback("开始图像堆叠", 75)
+            
+            # 需要多遍的方法（如sigma_clip）按记录的变换矩阵重新变换各帧
+            result = self.finish_accumulation(accumulator, lambda indices: (
+                self.warp_frame(self.images[i].image, self.transforms[i]) for i in indices
+            ))
+            if result is None:
+                return None
+            completed = True
+            
+            if self.progress_callback:
+                self.progress_callback("堆叠完成", 95)
+            
+            logger.info(f"使用 {method} 方法流式堆叠 {len(self.transforms)} 张图像")
+            return result
+            
+        except Exception as e:
+            logger.error(f"流式堆叠失败: {e}")
+            return None
+        finally:
+            self.close_checkpoint(completed)
+    
+    def stack_images_out_of_core(self) -> Optional[np.ndarray]:
+        """对齐图像写入磁盘映射存储，再按行带归约
+        
+        适用于中位数、Sigma裁剪等需要完整像素列的方法，
+        内存占用由 memory_budget_mb 控制而与帧数无关；启用检查点时记录各帧的变换矩阵
+        """
+        completed = False
+        try:
+            if not self.images or self.reference_image is None:
+                return None
+            
+            method = self.stacking_params['method']
+            self.aligned_images = []
+            self.start_checkpoint(None, self.frame_records)
+            
+            with MemmapFrameStore(len(self.images), self.reference_image.shape,
+                                  self.reference_image.dtype,
+                                  self.stacking_params.get('scratch_dir')) as store:
+                for i, aligned in self.iter_aligned_frames():
+                    store.append(aligned)
+                    self.record_frame(i, ALIGNED)
+                
+                if self.cancel_flag:
+                    return None
+                
+                logger.info(f"成功对齐 {store.size} 张图像")
+                if store.size < 2:
+                    return None
+                
+                if self.progress_callback:
+                    self.progress_callback("开始图像堆叠", 75)
+                
+                result = self.reduce_frame_store(store, method)
+            
+            if result is not None:
+                completed = True
+                logger.info(f"使用 {method} 方法分块堆叠 {len(self.transforms)} 张图像")
+            return result
+            
+        except Exception as e:
+            logger.error(f"分块堆叠失败: {e}")
+            return None
+        finally:
+            self.close_checkpoint(completed)
+    
+    def stack_images_memory(self) -> Optional[np.ndarray]:
+        """对齐全部图像后在内存中归约；启用检查点时记录各帧的变换矩阵"""
+        completed = False
+        try:
+            self.start_checkpoint(None, self.frame_records)
+            if not self.align_images():
+                return None
+            result = self.stack_images()
+            completed = result is not None
+            return result
+        finally:
+            self.close_checkpoint(completed)
+    
+    def finish_accumulation(self, accumulator,
+                            warped_frames: Callable[[List[int]], Iterable[np.ndarray]]) -> Optional[np.ndarray]:
+        """完成累加器剩余的遍数并返回输出位深的结果
+        
+        warped_frames(indices) 返回一个按顺序产出 indices 中各帧已对齐图像的迭代器；
+        从检查点继续时累加器可能停在后面的某一遍，先补完这一遍中尚未累加的帧
+        """
+        if accumulator.current_pass > 0 and not self.integrate_pass(accumulator, warped_frames):
+            return None
+        while accumulator.needs_another_pass():
+            accumulator.next_pass()
+            if self.checkpoint is not None:
+                self.checkpoint.next_pass()
+            if not self.integrate_pass(accumulator, warped_frames):
+                return None
+        
+        result = accumulator.result()
+        if result is None:
+            return None
+        
+        # 确保结果在有效范围内
+        return self.to_output(result)
+    
+    def integrate_pass(self, accumulator, warped_frames: Callable[[List[int]], Iterable[np.ndarray]]) -> bool:
+        """把本遍尚未累加的已对齐帧累加到累加器，取消时返回False"""
+        indices = [i for i in self.transforms if not self.frame_integrated(i)]
+        for i, frame in zip(indices, warped_frames(indices)):
+            if self.cancel_flag:
+                return False
+            accumulator.add(frame)
+            self.record_frame(i, INTEGRATED)
+        return not self.cancel_flag
+    
+    @property
+    def checkpoint_directory(self) -> Optional[str]:
+        """检查点目录，None表示系统临时目录"""
+        return self.checkpoint_params.get('directory') or self.stacking_params.get('scratch_dir')
+    
+    def checkpoint_location(self, image_paths: List[str]) -> Optional[str]:
+        """图像列表用当前参数堆叠时的检查点文件路径，图像不是文件时为None"""
+        return StackingCheckpoint.location(image_paths, self.checkpoint_job_params(), self.checkpoint_directory)
+    
+    def find_checkpoint(self, image_paths: List[str]) -> Optional[str]:
+        """图像列表最近写入的、可以继续的检查点（写入之后帧未被修改），没有时为None"""
+        for path in StackingCheckpoint.candidates(image_paths, self.checkpoint_directory):
+            checkpoint = StackingCheckpoint.load(path, metadata_only=True)
+            if checkpoint is not None and not checkpoint.changed_frames():
+                return path
+        return None
+    
+    def has_checkpoint(self, image_paths: List[str]) -> bool:
+        """图像列表是否有可以继续的堆叠任务"""
+        return self.find_checkpoint(image_paths) is not None
+    
+    def frame_records(self) -> List[Dict[str, Any]]:
+        """按帧索引排列的检查点帧记录（读取文件信息，内存中的图像没有对应的文件）"""
+        return [frame_record(handle.path, handle.shape, handle.dtype) for handle in self.images]
+    
+    def checkpoint_job_params(self) -> Dict[str, Dict[str, Any]]:
+        """写入检查点的任务参数，继续时恢复，保证前后两段的处理方式一致"""
+        return {name: dict(getattr(self, name)) for name in CHECKPOINT_PARAMS}
+    
+    def start_checkpoint(self, accumulator, frames: Callable[[], List[Dict[str, Any]]]):
+        """
+        开始记录当前堆叠任务的检查点，frames() 返回按帧索引排列的 frame_record
+        （读取文件信息，只在需要检查点时调用；内存中的图像没有对应的文件）
+        
+        accumulator 为流式累加的累加器，不能逐帧累加的引擎为None，只记录各帧的配准结果；
+        从检查点继续时恢复累加器状态和帧质量指标，之后在原检查点上继续记录
+        """
+        self.checkpoint = None
+        checkpoint = self.resume_checkpoint
+        if checkpoint is not None:
+            if checkpoint.paths != [frame['path'] for frame in frames()]:
+                raise ValueError("检查点的帧列表与当前任务不一致")
+            if checkpoint.state is not None and accumulator is not None:
+                accumulator.load_state(checkpoint.state)
+            index = {path: i for i, path in enumerate(checkpoint.paths)}
+            self.frame_quality = {index[path]: metrics for path, metrics in checkpoint.frame_quality.items()
+                                  if path in index}
+        elif self.checkpoint_params.get('enabled') and self.checkpoint_file is not None:
+            # 新检查点先只写入帧列表，累加器状态在累加若干帧之后才写入
+            checkpoint = StackingCheckpoint(self.checkpoint_file, frames(), self.checkpoint_job_params(),
+                                            self.checkpoint_params.get('frame_interval', 100))
+            checkpoint.flush()
+        else:
+            return
+        
+        checkpoint.accumulator = accumulator
+        self.checkpoint = checkpoint
+    
+    def record_frame(self, index: int, status: str):
+        """在检查点中记录帧的状态（及变换矩阵），没有检查点时不做任何事"""
+        if self.checkpoint is not None:
+            self.checkpoint.record(self.frame_path(index), status, self.transforms.get(index))
+    
+    def frame_integrated(self, index: int) -> bool:
+        """帧在当前这一遍中是否已经累加（从检查点继续时）"""
+        return (self.checkpoint is not None and
+                self.checkpoint.status.get(self.frame_path(index)) == INTEGRATED)
+    
+    def resumed_frames(self, total: int) -> Dict[int, Optional[np.ndarray]]:
+        """
+        检查点中已有结果、本次不再配准的帧 {图像索引: 变换矩阵}，对齐失败的帧为None
+        
+        第一遍中已累加或对齐失败的帧；检查点停在后面的遍数时第一遍已经完成，所有帧都有结果
+        """
+        checkpoint = self.checkpoint
+        if checkpoint is None:
+            return {}
+        later_pass = checkpoint.current_pass > 0
+        resumed = {}
+        for i in range(total):
+            path = self.frame_path(i)
+            status = checkpoint.status.get(path, PENDING)
+            if status in (INTEGRATED, FAILED) or (later_pass and path in checkpoint.transforms):
+                resumed[i] = checkpoint.transforms.get(path) if status != FAILED else None
+        return resumed
+    
+    def registered_frames(self, total: int) -> Dict[int, np.ndarray]:
+        """检查点中已配准但尚未归约的帧 {图像索引: 变换矩阵}，继续时只重新变换，不再配准"""
+        checkpoint = self.checkpoint
+        if checkpoint is None:
+            return {}
+        registered = {}
+        for i in range(total):
+            path = self.frame_path(i)
+            if checkpoint.status.get(path) == ALIGNED and path in checkpoint.transforms:
+                registered[i] = checkpoint.transforms[path]
+        return registered
+    
+    def reference_stars(self) -> List[Tuple[float, float]]:
+        """参考图像的星点，从检查点继续时使用检查点中的星点，保证与已累加的帧配准一致"""
+        checkpoint = self.checkpoint
+        if checkpoint is not None and checkpoint.reference_stars is not None:
+            return checkpoint.reference_stars
+        ref_stars = self.get_frame_stars(0, self.reference_image)
+        if checkpoint is not None:
+            checkpoint.reference_stars = ref_stars
+        return ref_stars
+    
+    def close_checkpoint(self, completed: bool):
+        """任务结束：完成时删除检查点，取消或失败时写入最终状态以便继续"""
+        checkpoint, self.checkpoint = self.checkpoint, None
+        if checkpoint is None:
+            return
+        if completed:
+            checkpoint.remove()
+        else:
+            checkpoint.flush()
+            logger.info(f"堆叠未完成，检查点已保存: {checkpoint.path}")
+    
+    def to_output(self, result: np.ndarray) -> np.ndarray:
+        """将浮点堆叠结果转换为输出位深：uint8、uint16 或 0~1 的float32"""
+        bit_depth = self.stacking_params.get('bit_depth', 8)
+        if bit_depth == 32:
+            return (np.clip(result, 0, 65535) / 65535).astype(np.float32)
+        if bit_depth == 16:
+            return np.clip(result, 0, 65535).astype(np.uint16)
+        return np.clip(result, 0, 255).astype(np.uint8)
+    
+    def reduce_frame_store(self, store: MemmapFrameStore, method: str) -> Optional[np.ndarray]:
+        """按内存预算逐行带归约帧存储"""
+        result = None
+        height = store.frame_shape[0]
+        weights = self.stack_weights()
+        # 每个像素值的工作内存为float32副本及临时数组
+        for y0, y1 in store.iter_bands(self.stacking_params.get('memory_budget_mb', 1024), bytes_per_value=16):
+            if self.cancel_flag:
+                return None
+            
+            band = store.band(y0, y1)
+            if method not in NATIVE_METHODS:
+                band = band.astype(np.float32)
+            band = self.to_output(self.reduce_stack(band, method, weights))
+            if result is None:
+                result = np.empty(store.frame_shape, dtype=band.dtype)
+            result[y0:y1] = band
+            
+            if self.progress_callback:
+                self.progress_callback(f"堆叠行 {y1}/{height}", 75 + y1 / height * 20)
+        
+        return result
+    
+    def stack_images_pipelined(self, image_paths: List[str]) -> Optional[np.ndarray]:
+        """以流水线方式加载、对齐并堆叠图像
+        
+        下一张图像的解码与当前图像的检测、匹配、变换和累加同时进行，
+        各阶段之间是有界队列，同时在途的帧数不超过 pipeline_depth，
+        图像不会保存在 self.images 中；可以流式累加的方法启用检查点时定期保存累加状态
+        """
+        store = None
+        completed = False
+        resources = ExitStack()
+        try:
+            self.images = []
+            self.frame_cache.clear()
+            self.aligned_images = []
+            self.transforms = {}
+            self.frame_quality = {}
+            self.assessed_stars = {}
+            self.proxy_frames = None
+            # 流水线中各帧独立配准，不使用预测
+            self.predicting = False
+            self.image_paths = list(image_paths)
+            total = len(image_paths)
+            method = self.stacking_params['method']
+            depth = self.stacking_params.get('pipeline_depth', 4)
+            workers = max(1, self.alignment_params.get('workers', 0))
+            # RAW文件在进程池中解码，加载阶段每个解码进程对应一个线程
+            loaders = max(1, resources.enter_context(self.raw_decode_pool(image_paths)))
+            depth = max(depth, loaders)
+            identity = np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float64)
+            
+            if total < 2:
+                raise ValueError("至少需要2张图像进行堆叠")
+            
+            # 参考图像单独先加载，其余帧都对齐到它
+            self.open_cache()
+            self.reference_image = self.load_frame(image_paths[0])
+            
+            # 只能整列归约的方法写入磁盘映射存储（检查点只记录配准结果），其余方法直接累加；
+            # 需要多遍的方法只在指定流式引擎时累加（每一遍重新解码），否则也写入存储只归约一次
+            records = lambda: [frame_record(path) for path in image_paths]
+            if method in STREAMING_METHODS and (self.stacking_params.get('engine') == 'streaming' or
+                                                not self.multi_pass(method)):
+                accumulator = create_accumulator(method, self.stacking_params)
+                self.start_checkpoint(accumulator, records)
+                sink = lambda i, aligned: accumulator.add(aligned, self.frame_weight(i))
+                status = INTEGRATED
+            else:
+                store = MemmapFrameStore(total, self.reference_image.shape, self.reference_image.dtype,
+                                         self.stacking_params.get('scratch_dir'))
+                self.start_checkpoint(None, records)
+                sink = lambda i, aligned: store.append(aligned)
+                status = ALIGNED
+            
+            ref_stars = self.reference_stars()
+            if len(ref_stars) < 10:
+                raise ValueError("参考图像中检测到的星点太少，无法进行对齐")
+            
+            self.prepare_reference(ref_stars)
+            
+            if self.progress_callback:
+                self.progress_callback("检测参考图像星点", 25)
+            
+            def load(i, path):
+                if i in self.rejected_frames:
+                    return None
+                return self.reference_image if i == 0 else self.load_frame(path)
+            
+            # 按质量排除帧需要先看到所有帧，因此多解码一遍；星点写入缓存，检测阶段不再重复
+            self.assess_frames(lambda i: load(i, image_paths[i]), total)
+            
+            # 从检查点继续时，已有结果的帧在第一遍中不再加载和配准，已配准的帧只重新变换
+            resumed = self.resumed_frames(total)
+            registered = self.registered_frames(total)
+            self.transforms.update((i, matrix) for i, matrix in resumed.items() if matrix is not None)
+            first_load = lambda i, path: None if i in resumed else load(i, path)
+            
+            def detect(i, image):
+                if i == 0:
+                    return image, None, identity
+                if i in registered:
+                    return image, None, registered[i]
+                # 命中变换缓存的帧跳过检测和匹配
+                cached, matrix = self.get_cached_transform(i)
+                if cached:
+                    if matrix is None:
+                        logger.warning(f"图像 {i} 对齐失败，跳过")
+                        return None
+                    return image, None, matrix
+                matrix = self.register_fast(image, ref_stars)
+                if matrix is None:
+                    stars = self.get_frame_stars(i, image)
+                    if len(stars) >= 10:
+                        return image, stars, None
+                    # 星点太少时尝试相位相关
+                    matrix = self.register_phase(image, refine=False)
+                self.put_cached_transform(i, matrix)
+                if matrix is None:
+                    logger.warning(f"图像 {i} 对齐失败，跳过")
+                    return None
+                return image, None, matrix
+            
+            def match(i, data):
+                image, stars, matrix = data
+                if matrix is None:
+                    matrix = self.match_stars(ref_stars, stars)
+                    self.put_cached_transform(i, matrix)
+                if matrix is None:
+                    logger.warning(f"图像 {i} 对齐失败，跳过")
+                    return None
+                return image, matrix
+            
+            def warp(i, data):
+                image, matrix = data
+                return (image if i == 0 else self.warp_frame(image, matrix)), matrix
+            
+            pipeline = FramePipeline(
+                [('load', first_load, loaders), ('detect', detect, workers), ('match', match, workers),
+                 ('warp', warp, workers)],
+                max_in_flight=depth, cancel_check=lambda: self.cancel_flag
+            )
+            
+            for i, (aligned, matrix) in pipeline.run(image_paths):
+                self.transforms[i] = matrix
+                sink(i, aligned)
+                self.record_frame(i, status)
+                if self.progress_callback:
+                    # 与其他引擎的阶段范围一致：对齐（同时累加）占30%~70%，归约和增强在其后
+                    self.progress_callback(f"对齐图像 {i+1}/{total}", 30 + (i + 1) / total * 40)
+            
+            if self.cancel_flag:
+                return None
+            self.transforms = dict(sorted(self.transforms.items()))
+            
+            logger.info(f"成功对齐 {len(self.transforms)} 张图像")
+            if len(self.transforms) < 2:
+                return None
+            
+            if self.progress_callback:
+                self.progress_callback("开始图像堆叠", 75)
+            
+            if store is not None:
+                result = self.reduce_frame_store(store, method)
+            else:
+                # 第二遍重新解码并变换，同样经过流水线
+                def warped_frames(indices):
+                    second_pass = FramePipeline(
+                        [('load', lambda n, i: (i, load(i, image_paths[i])), loaders),
+                         ('warp', lambda n, data: warp(data[0], (data[1], self.transforms[data[0]]))[0], workers)],
+                        max_in_flight=depth, cancel_check=lambda: self.cancel_flag
+                    )
+                    return (aligned for _, aligned in second_pass.run(indices))
+                
+                result = self.finish_accumulation(accumulator, warped_frames)
+            
+            if result is None:
+                return None
+            completed = True
+            
+            if self.progress_callback:
+                self.progress_callback("堆叠完成", 95)
+            
+            logger.info(f"使用 {method} 方法流水线堆叠 {len(self.transforms)} 张图像")
+            return result
+            
+        except Exception as e:
+            logger.error(f"流水线堆叠失败: {e}")
+            return None
+        finally:
+            self.close_checkpoint(completed)
+            if store is not None:
+                store.close()
+            resources.close()
+    
+    def sigma_clip_stack(self, images_array: np.ndarray) -> np.ndarray:
+        """迭代Sigma裁剪堆叠算法"""
+        return self.reject_stack(images_array, 'sigma_clip')
+    
+    def percentile_clip_stack(self, images_array: np.ndarray) -> np.ndarray:
+        """百分位裁剪堆叠算法"""
+        return self.reject_stack(images_array, 'percentile_clip')
+    
+    def median_stack(self, images_array: np.ndarray) -> np.ndarray:
+        """按行带部分选择的中值堆叠，整数帧不转换为浮点，额外内存不超过 memory_budget_mb 的四分之一"""
+        try:
+            return median_stack(images_array,
+                                workers=self.stacking_params.get('reject_workers', 0),
+                                memory_budget_mb=self.stacking_params.get('memory_budget_mb', 1024) / 4)
+        except Exception as e:
+            logger.error(f"中值堆叠失败: {e}")
+            return np.median(images_array, axis=0)
+    
+    def reject_stack(self, images_array: np.ndarray, method: str) -> np.ndarray:
+        """按行带并行的像素拒绝堆叠，额外内存不超过 memory_budget_mb 的四分之一"""
+        try:
+            return reject_stack(images_array, method, self.stacking_params,
+                                workers=self.stacking_params.get('reject_workers', 0),
+                                memory_budget_mb=self.stacking_params.get('memory_budget_mb', 1024) / 4)
+        except Exception as e:
+            logger.error(f"{method} 堆叠失败: {e}")
+            return np.mean(images_array, axis=0, dtype=np.float32)
+    
+    def enhance_result(self, image: np.ndarray) -> np.ndarray:
+        """增强堆叠结果"""
+        try:
+            if image.dtype != np.uint8:
+                return self.enhance_high_bit_depth(image)
+            
             # 转换为PIL图像进行增强
             pil_image = Image.fromarray(image)
             
@@ -398,6 +2405,22 @@ class AstroStacker:
             logger.error(f"图像增强失败: {e}")
             return image
     
+    def enhance_high_bit_depth(self, image: np.ndarray) -> np.ndarray:
+        """在float32中增强高位深结果，效果与8位时的PIL对比度和锐度增强相同"""
+        max_value = 1.0 if image.dtype == np.float32 else 65535.0
+        data = image.astype(np.float32)
+        
+        # 轻微增强对比度：以灰度均值为中心拉伸
+        mean = float(cv2.cvtColor(data, cv2.COLOR_RGB2GRAY).mean())
+        data = mean + (data - mean) * 1.1
+        
+        # 轻微增强锐度：相对PIL SMOOTH滤波结果外推
+        kernel = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+        smooth = cv2.filter2D(data, -1, kernel)
+        data = smooth + (data - smooth) * 1.05
+        
+        return np.clip(data, 0, max_value).astype(image.dtype)
+    
     def process_stack(self, image_paths: List[str], 
                      progress_callback=None) -> Optional[np.ndarray]:
         """完整的堆叠处理流程"""
@@ -408,40 +2431,508 @@ class AstroStacker:
             if self.progress_callback:
                 self.progress_callback("开始处理", 0)
             
-            # 1. 加载图像
-            if not self.load_images(image_paths):
+            # 预检在任何全分辨率解码之前排除异常帧；从检查点继续时帧列表已经过预检
+            if self.resume_checkpoint is None:
+                # 检查点以预检前的帧列表命名，继续时按同一帧列表查找；未开启时不读写任何检查点
+                self.checkpoint_file = (self.checkpoint_location(image_paths)
+                                        if self.checkpoint_params.get('enabled') else None)
+                image_paths = self.triaged_paths(image_paths)
+            if len(image_paths) < 2:
+                logger.error("通过预检的图像少于2张")
                 return None
             
-            # 2. 对齐图像
-            if not self.align_images():
+            # 主校准帧和坏像素表在加载亮场之前准备好，加载时逐帧校准
+            if not self.prepare_calibration():
                 return None
+            self.prepare_defect_map(image_paths)
+            
+            proxy = self.registration_proxy(image_paths)
+            if proxy is not None:
+                # 在绿色平面或缩小解码的RAW上配准，只在最后变换时全分辨率解码
+                result = self.stack_images_proxy(image_paths, proxy)
+                if result is None:
+                    return None
+                return self.finish_result(result)
+            
+            if self.stacking_params.get('pipeline'):
+                # 加载、对齐和堆叠在流水线中同时进行
+                result = self.stack_images_pipelined(image_paths)
+                if result is None:
+                    return None
+                return self.finish_result(result)
+            
+            # 1. 加载图像（从检查点继续时只解码参考图像，其余帧在对齐时解码）
+            if self.resume_checkpoint is not None:
+                if not self.restore_images(self.resume_checkpoint):
+                    return None
+            elif not self.load_images(image_paths):
+                return None
+            
+            # 2. 对齐并堆叠图像
+            engine = self.resolve_engine()
+            if engine == 'streaming':
+                result = self.stack_images_streaming()
+            elif engine == 'out_of_core':
+                result = self.stack_images_out_of_core()
+            else:
+                result = self.stack_images_memory()
             
-            # 3. 堆叠图像
-            result = self.stack_images()
             if result is None:
                 return None
             
-            # 4. 增强结果
-            enhanced_result = self.enhance_result(result)
+            # 3. 增强结果
+            return self.finish_result(result)
+            
+        except Exception as e:
+            logger.error(f"堆叠处理失败: {e}")
+            return None
+    
+    def restack(self, image_paths: Optional[List[str]] = None,
+                progress_callback=None) -> Optional[np.ndarray]:
+        """只修改了堆叠参数时重新堆叠
+        
+        复用上次加载的图像和记录的变换矩阵，只重新执行变换和归约；
+        没有可复用的图像时执行完整流程，变换矩阵从磁盘缓存读取
+        """
+        if image_paths is None:
+            # 预检前的完整列表，在同一组图像上重新决定
+            image_paths = [d['path'] for d in self.triage_results] or self.image_paths
+        paths = list(image_paths)
+        loaded_dtype = np.uint16 if self.high_bit_depth() else np.uint8
+        # 预检评分已缓存，只重新决定；决定改变时重新加载
+        if not (self.images and self.transforms and self.triaged_paths(paths) == self.image_paths and
+                self.reference_image.dtype == loaded_dtype and
+                self.loaded_calibration == self.calibration_signature() and
+                self.loaded_defects == self.defect_signature(paths) and
+                self.proxy_frames == self.registration_proxy(paths) and
+                self.loaded_raw == self.raw_decode_options(self.proxy_frames == 'raw') and
+                self.quality_rejection == self.stacking_params.get('quality_reject', 0)):
+            return self.process_stack(paths, progress_callback)
+        
+        try:
+            self.progress_callback = progress_callback
+            self.cancel_flag = False
             
             if self.progress_callback:
-                self.progress_callback("处理完成", 100)
+                self.progress_callback("重新堆叠", 0)
             
-            return enhanced_result
+            result = self.stack_transformed()
+            if result is None:
+                return None
+            
+            return self.finish_result(result)
             
         except Exception as e:
-            logger.error(f"堆叠处理失败: {e}")
+            logger.error(f"重新堆叠失败: {e}")
+            return None
+    
+    def resume_stack(self, image_paths: Optional[List[str]] = None, progress_callback=None,
+                     checkpoint_path: Optional[str] = None) -> Optional[np.ndarray]:
+        """
+        从检查点继续中断的流式堆叠任务，只处理尚未累加的帧
+        
+        checkpoint_path 为None时使用 image_paths 最近写入的检查点；
+        帧列表和堆叠参数从检查点恢复，写入检查点之后有帧被修改或删除时不能继续
+        """
+        try:
+            path = checkpoint_path or self.find_checkpoint(image_paths or self.image_paths)
+            if path is None:
+                logger.error("没有可以继续的堆叠任务")
+                return None
+            checkpoint = StackingCheckpoint.load(path)
+            if checkpoint is None:
+                return None
+            
+            changed = checkpoint.changed_frames()
+            if changed:
+                logger.error(f"写入检查点之后有 {len(changed)} 张图像被修改或删除，无法继续: "
+                             f"{Path(changed[0]).name}")
+                return None
+            
+            for name in CHECKPOINT_PARAMS:
+                getattr(self, name).update(checkpoint.params.get(name, {}))
+            counts = checkpoint.counts()
+            logger.info(f"从检查点继续第 {checkpoint.current_pass + 1} 遍: 已累加 {counts[INTEGRATED]} 张，"
+                        f"已配准 {counts[ALIGNED]} 张，待处理 {counts[PENDING]} 张")
+            
+            self.resume_checkpoint = checkpoint
+            self.checkpoint_file = path
+            return self.process_stack(checkpoint.paths, progress_callback)
+            
+        except Exception as e:
+            logger.error(f"继续堆叠失败: {e}")
+            return None
+        finally:
+            self.resume_checkpoint = None
+    
+    def restore_images(self, checkpoint: StackingCheckpoint) -> bool:
+        """按检查点的帧列表建立帧句柄，只解码参考图像，其余帧在配准或变换时才解码"""
+        try:
+            self.image_paths = checkpoint.paths
+            self.frame_quality = {}
+            self.assessed_stars = {}
+            self.proxy_frames = None
+            self.frame_cache = FrameCache(self.stacking_params.get('frame_cache_mb', 1024))
+            self.images = [
+                FrameHandle(frame['path'], self.load_frame, self.frame_cache,
+                            shape=tuple(frame['shape']) if 'shape' in frame else None,
+                            dtype=np.dtype(frame['dtype']) if 'dtype' in frame else None,
+                            metadata={'size': frame['size'], 'mtime': frame['mtime']})
+                for frame in checkpoint.frames
+            ]
+            self.reference_image = self.load_frame(self.images[0].path)
+            self.frame_cache.put(self.images[0].path, self.reference_image)
+            
+            self.loaded_calibration = self.calibration_key
+            self.loaded_defects = self.defect_key
+            self.loaded_raw = self.raw_decode_options()
+            return True
+            
+        except Exception as e:
+            logger.error(f"按检查点加载图像时出错: {e}")
+            return False
+    
+    def iter_source_frames(self, indices: List[int]) -> Iterator[np.ndarray]:
+        """按顺序产出待变换的图像：在配准帧上配准时重新全分辨率解码，否则为已加载的图像"""
+        if self.proxy_frames is None:
+            for i in indices:
+                yield self.images[i].image
+            return
+        # 参考图像已经去马赛克，其余帧按顺序在进程池中预先解码
+        loaded = self.iter_loaded_frames([self.images[i].path for i in indices if i != 0])
+        for i in indices:
+            if i == 0:
+                yield self.reference_image
+                continue
+            path, image = next(loaded)
+            if image is None:
+                raise ValueError(f"无法加载图像: {Path(path).name}")
+            yield image
+    
+    def stack_transformed(self) -> Optional[np.ndarray]:
+        """按记录的变换矩阵变换已加载的图像并用当前堆叠参数归约"""
+        method = self.stacking_params['method']
+        engine = self.resolve_engine()
+        total = len(self.transforms)
+        # 排除比例未变，只可能重新计算加权权重（质量指标已在内存或缓存中）
+        self.assess_frames(self.frame_image, len(self.images))
+        
+        def warped_frames(indices, report=False):
+            for n, (i, image) in enumerate(zip(indices, self.iter_source_frames(indices))):
+                if self.cancel_flag:
+                    return
+                if report and self.progress_callback:
+                    self.progress_callback(f"变换图像 {n+1}/{total}", 30 + (n + 1) / total * 40)
+                yield self.warp_frame(image, self.transforms[i])
+        
+        if engine == 'streaming':
+            accumulator = create_accumulator(method, self.stacking_params)
+            indices = sorted(self.transforms)
+            with ExitStack() as resources:
+                # 在配准帧上配准时每帧都要全分辨率解码，需要多遍的方法（如sigma_clip）把第一遍
+                # 变换后的帧写入磁盘映射存储，之后各遍直接读取，每帧只解码一次
+                spool = None
+                if self.proxy_frames is not None and accumulator.passes > 1:
+                    spool = resources.enter_context(MemmapFrameStore(
+                        total, self.reference_image.shape, self.reference_image.dtype,
+                        self.stacking_params.get('scratch_dir')))
+                for i, frame in zip(indices, warped_frames(indices, report=True)):
+                    accumulator.add(frame, self.frame_weight(i))
+                    if spool is not None:
+                        spool.append(frame)
+                if self.cancel_flag:
+                    return None
+                if self.progress_callback:
+                    self.progress_callback("开始图像堆叠", 75)
+                if spool is not None:
+                    slots = {i: n for n, i in enumerate(indices)}
+                    replay = lambda pass_indices: (spool.frame(slots[i]) for i in pass_indices)
+                    result = self.finish_accumulation(accumulator, replay)
+                else:
+                    result = self.finish_accumulation(accumulator, warped_frames)
+        elif engine == 'out_of_core':
+            with MemmapFrameStore(total, self.reference_image.shape, self.reference_image.dtype,
+                                  self.stacking_params.get('scratch_dir')) as store:
+                for frame in warped_frames(sorted(self.transforms), report=True):
+                    store.append(frame)
+                if self.cancel_flag:
+                    return None
+                if self.progress_callback:
+                    self.progress_callback("开始图像堆叠", 75)
+                result = self.reduce_frame_store(store, method)
+        else:
+            # 内存模式下上次对齐的图像仍然保留时无需再次变换
+            if len(self.aligned_images) != total:
+                self.aligned_images = list(warped_frames(sorted(self.transforms), report=True))
+            if self.cancel_flag:
+                return None
+            result = self.stack_images()
+        
+        if result is not None:
+            logger.info(f"使用 {method} 方法重新堆叠 {total} 张图像")
+        return result
+    
+    def cfa_registration_enabled(self, image_paths: List[str]) -> bool:
+        """是否在拜耳阵列绿色平面上配准：需要启用该选项且全部输入为RAW文件"""
+        if not self.alignment_params.get('cfa_registration'):
+            return False
+        if not RAW_SUPPORT or not all(Path(path).suffix.lower() in RAW_EXTENSIONS for path in image_paths):
+            logger.warning("只有全部输入为RAW文件时才能在拜耳阵列上配准，改为去马赛克后配准")
+            return False
+        return True
+    
+    def raw_registration_enabled(self, image_paths: List[str]) -> bool:
+        """是否按半尺寸或线性去马赛克解码的RAW配准：需要设置了这些参数且全部输入为RAW文件"""
+        if not self.raw_cache_params():
+            return False
+        if not RAW_SUPPORT or not all(Path(path).suffix.lower() in RAW_EXTENSIONS for path in image_paths):
+            logger.warning("只有全部输入为RAW文件时才能按缩小解码的图像配准，改为全分辨率配准")
+            return False
+        return True
+    
+    def registration_proxy(self, image_paths: List[str]) -> Optional[str]:
+        """配准帧类型：'cfa'（拜耳阵列绿色平面）、'raw'（按配准参数解码的RAW），全分辨率配准时为None"""
+        if self.cfa_registration_enabled(image_paths):
+            return 'cfa'
+        if self.raw_registration_enabled(image_paths):
+            return 'raw'
+        return None
+    
+    def stack_images_proxy(self, image_paths: List[str], proxy: str = 'cfa') -> Optional[np.ndarray]:
+        """
+        在配准帧上配准，再全分辨率解码、变换并堆叠
+        
+        绿色平面直接取自 raw_image_visible，像素数为全分辨率的1/4且不需要去马赛克；
+        缩小解码的配准帧按半尺寸或线性去马赛克解码。配准帧上的变换矩阵换算到全分辨率坐标后，
+        每帧只在最后变换时全分辨率AHD解码一次，堆叠结果不受配准解码参数影响。
+        配准帧不做校准，校准和坏像素替换仍在全分辨率图像上进行
+        """
+        completed = False
+        try:
+            if not self.load_images(image_paths, proxy):
+                return None
+            
+            # 配准帧上的变换矩阵（缓存和检查点中也按配准帧坐标保存）
+            self.start_checkpoint(None, self.frame_records)
+            for i, _ in self.iter_aligned_frames(transform_registered=False):
+                self.record_frame(i, ALIGNED)
+            if self.cancel_flag:
+                return None
+            logger.info(f"在{'绿色平面' if proxy == 'cfa' else '缩小解码的图像'}上成功配准 "
+                        f"{len(self.transforms)} 张图像")
+            if len(self.transforms) < 2:
+                return None
+            
+            # 换算到去马赛克后的坐标，之后按全分辨率参考图像的尺寸变换
+            plane_shape = self.reference_image.shape[:2]
+            self.reference_image = self.load_frame(self.images[0].path)
+            scale = self.reference_image.shape[1] / plane_shape[1]
+            self.transforms = {i: scale_transform(matrix, scale) for i, matrix in self.transforms.items()}
+            self.aligned_images = []
+            
+            if self.progress_callback:
+                self.progress_callback("去马赛克并变换图像", 70)
+            result = self.stack_transformed()
+            completed = result is not None
+            return result
+            
+        except Exception as e:
+            logger.error(f"按配准帧堆叠失败: {e}")
+            return None
+        finally:
+            self.close_checkpoint(completed)
+    
+    def start_live_stack(self, reference_path: str) -> bool:
+        """以一张图像为参考开始实时堆叠，之后用 add_live_frame 逐帧加入
+        
+        实时模式只保留参考图像和累加器，不保留各帧原图，内存占用与帧数无关
+        """
+        try:
+            if not self.prepare_calibration():
+                return False
+            # 实时堆叠开始时只有一帧，坏像素只能从暗场中检测
+            self.prepare_defect_map([reference_path])
+            reference = self.load_frame(reference_path)
+            identity = np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float64)
+            self.images = []
+            self.frame_cache.clear()
+            self.aligned_images = []
+            self.image_paths = [reference_path]
+            self.reference_image = reference
+            self.transforms = {0: identity}
+            self.frame_quality = {}
+            self.assessed_stars = {}
+            self.proxy_frames = None
+            self.frame_weights = {}
+            self.rejected_frames = set()
+            self.live_accumulator = None
+            self.open_cache()
+            
+            ref_stars = self.get_frame_stars(0, reference)
+            if len(ref_stars) < 10:
+                logger.warning(f"参考图像 {Path(reference_path).name} 中检测到的星点太少")
+                return False
+            
+            self.prepare_reference(ref_stars)
+            self.live_ref_stars = ref_stars
+            self.live_history = [(0, identity)]
+            self.predicting = self.alignment_params.get('predictive', True)
+            self.live_accumulator = create_live_accumulator(self.stacking_params['method'], self.stacking_params)
+            self.live_accumulator.add(reference)
+            logger.info(f"实时堆叠参考图像: {reference_path}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"开始实时堆叠失败: {e}")
+            return False
+    
+    def add_live_frame(self, path: str) -> bool:
+        """对齐一帧新图像并折叠进实时累加器，只处理这一帧"""
+        if self.live_accumulator is None:
+            return False
+        try:
+            image = self.load_frame(path)
+            if image.shape != self.reference_image.shape:
+                logger.warning(f"图像 {Path(path).name} 尺寸与参考图像不同，跳过")
+                return False
+            
+            index = len(self.image_paths)
+            self.image_paths.append(path)
+            prediction = self.predict_transform(index, self.live_history)
+            aligned, matrix = self.align_frame(index, image, self.live_ref_stars, prediction=prediction)
+            if matrix is None:
+                return False
+            
+            self.live_history = (self.live_history + [(index, matrix)])[-2:]
+            self.transforms[index] = matrix
+            self.live_accumulator.add(aligned)
+            return True
+            
+        except Exception as e:
+            logger.error(f"实时堆叠加入图像 {path} 失败: {e}")
+            return False
+    
+    def live_result(self) -> Optional[np.ndarray]:
+        """返回当前的实时堆叠结果（已增强），尚未开始时返回None"""
+        if self.live_accumulator is None:
             return None
+        result = self.live_accumulator.result()
+        if result is None:
+            return None
+        return self.enhance_result(self.to_output(result))
+    
+    def scan_live_directory(self, directory: str) -> List[str]:
+        """返回文件夹中新出现且已写入完成的图像，按文件名排序
+        
+        文件大小在两次扫描间不变，或修改时间早于一个扫描间隔时，认为相机已经写完
+        """
+        ready = []
+        now = time.time()
+        for path in sorted(Path(directory).iterdir()):
+            key = str(path)
+            if (key in self.live_seen or path.suffix.lower() not in LIVE_EXTENSIONS or
+                    path.name.startswith(RESULT_PREFIX)):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if not path.is_file() or stat.st_size == 0:
+                continue
+            
+            settled = now - stat.st_mtime > self.live_params['poll_interval']
+            if settled or self.live_pending.get(key) == stat.st_size:
+                ready.append(key)
+                self.live_seen.add(key)
+                self.live_pending.pop(key, None)
+            else:
+                self.live_pending[key] = stat.st_size
+        return ready
+    
+    def run_live_stack(self, directory: str,
+                       preview_callback: Optional[Callable[[np.ndarray], None]] = None,
+                       progress_callback=None) -> Optional[np.ndarray]:
+        """
+        监视文件夹并实时堆叠，直到调用 cancel_processing
+        
+        第一张星点足够的图像作为参考，之后每张新图像只对齐并累加这一帧；
+        有新帧加入且距上次预览超过 preview_interval 时调用 preview_callback(当前结果)。
+        停止后返回最终结果，没有可用的参考图像时返回None
+        """
+        self.progress_callback = progress_callback
+        self.cancel_flag = False
+        self.live_accumulator = None
+        self.live_seen = set()
+        self.live_pending = {}
+        last_preview = 0.0
+        updated = False
+        
+        while not self.cancel_flag:
+            for path in self.scan_live_directory(directory):
+                if self.cancel_flag:
+                    break
+                if self.live_accumulator is None:
+                    updated = self.start_live_stack(path)
+                else:
+                    updated = self.add_live_frame(path) or updated
+                
+                if self.progress_callback and self.live_accumulator is not None:
+                    # 对齐成功的比例映射到对齐阶段的范围，停止后的生成结果和保存在其后
+                    aligned, total = len(self.transforms), len(self.image_paths)
+                    self.progress_callback(f"实时堆叠: 已对齐 {aligned}/{total} 张", 30 + aligned / total * 40)
+            
+            now = time.monotonic()
+            if updated and preview_callback and now - last_preview >= self.live_params['preview_interval']:
+                preview = self.live_result()
+                if preview is not None:
+                    preview_callback(preview)
+                last_preview = now
+                updated = False
+            
+            # 分段等待，及时响应停止
+            deadline = time.monotonic() + self.live_params['poll_interval']
+            while not self.cancel_flag and time.monotonic() < deadline:
+                time.sleep(min(0.1, self.live_params['poll_interval']))
+        
+        if self.progress_callback and self.live_accumulator is not None:
+            self.progress_callback("生成实时堆叠结果", 75)
+        result = self.live_result()
+        if result is not None:
+            logger.info(f"实时堆叠结束，共堆叠 {len(self.transforms)} 张图像")
+            if self.progress_callback:
+                self.progress_callback("堆叠完成", 95)
+        return result
+    
+    def finish_result(self, result: np.ndarray) -> np.ndarray:
+        """增强堆叠结果并报告完成"""
+        enhanced_result = self.enhance_result(result)
+        
+        if self.progress_callback:
+            self.progress_callback("处理完成", 100)
+        
+        return enhanced_result
     
     def cancel_processing(self):
         """取消处理"""
         self.cancel_flag = True
     
+    def frame_quality_report(self) -> List[Dict[str, Any]]:
+        """各帧的质量指标、相对权重以及是否被排除，按图像索引排列"""
+        weights = quality_weights(self.frame_quality)
+        return [
+            dict(quality, index=i, path=self.frame_path(i), weight=weights.get(i, 0.0),
+                 rejected=i in self.rejected_frames)
+            for i, quality in sorted(self.frame_quality.items())
+        ]
+    
     def get_stacking_info(self) -> Dict[str, Any]:
         """获取堆叠信息"""
         return {
-            'total_images': len(self.images),
-            'aligned_images': len(self.aligned_images),
+            'total_images': len(self.image_paths) or len(self.images),
+            'aligned_images': len(self.transforms),
+            'frame_quality': self.frame_quality_report(),
+            'rejected_frames': sorted(self.rejected_frames),
+            'triage': self.triage_results,
             'star_detection_params': self.star_detection_params,
             'alignment_params': self.alignment_params,
             'stacking_params': self.stacking_params,
@@ -449,8 +2940,17 @@ class AstroStacker:
     
     def save_result(self, result: np.ndarray, output_path: str, 
                    quality: int = 95) -> bool:
-        """保存堆叠结果"""
+        """保存堆叠结果，16位/浮点结果保存为TIFF或PNG时保留位深"""
         try:
+            if result.dtype != np.uint8:
+                suffix = Path(output_path).suffix.lower()
+                if suffix in HIGH_BIT_DEPTH_FORMATS:
+                    self.save_high_bit_depth(result, output_path)
+                    logger.info(f"堆叠结果已保存到: {output_path}")
+                    return True
+                logger.warning(f"{suffix} 格式不支持高位深，保存为8位图像")
+                result = to_uint8(result)
+            
             # 转换为PIL图像
             pil_image = Image.fromarray(result)
             
@@ -467,6 +2967,79 @@ class AstroStacker:
             logger.error(f"保存结果失败: {e}")
             return False
 
+    def save_high_bit_depth(self, result: np.ndarray, output_path: str):
+        """用OpenCV保存uint16或float32结果（PNG不支持浮点，转换为16位）"""
+        suffix = Path(output_path).suffix.lower()
+        if suffix == '.png':
+            result = to_uint16(result)
+        
+        success, encoded = cv2.imencode(suffix, cv2.cvtColor(result, cv2.COLOR_RGB2BGR))
+        if not success:
+            raise ValueError(f"无法编码图像: {output_path}")
+        encoded.tofile(output_path)
+
+# 写入检查点并在继续时恢复的参数
+CHECKPOINT_PARAMS = ('star_detection_params', 'alignment_params', 'stacking_params', 'calibration_params',
+                     'defect_params', 'raw_params', 'cache_params')
+
+# 进程池对齐的工作进程状态（每个进程初始化一次）
+_worker_stacker = None
+_worker_ref_stars = None
+_worker_frame_size = None
+
+def _init_align_worker(ref_stars, star_detection_params, alignment_params, frame_size,
+                       frame_paths=None, cache_path=None, stacking_params=None, reference_data=None,
+                       calibration_key=None, defect_key=None, raw_params=None, proxy_frames=None,
+                       collect_stars=False):
+    """初始化对齐工作进程，帧已在主进程中加载和校准，calibration_key/defect_key/raw_params/proxy_frames 只用于缓存键，
+    collect_stars 为True时检测的星点随对齐结果传回（写入主进程的检查点）"""
+    global _worker_stacker, _worker_ref_stars, _worker_frame_size
+    
+    _worker_stacker = AstroStacker()
+    _worker_stacker.image_paths = frame_paths or []
+    _worker_stacker.star_cache = StackingCache.open(cache_path)
+    _worker_stacker.star_detection_params.update(star_detection_params)
+    _worker_stacker.alignment_params.update(alignment_params)
+    _worker_stacker.alignment_params['workers'] = 0
+    _worker_stacker.stacking_params.update(stacking_params or {})
+    _worker_stacker.calibration_key = calibration_key
+    _worker_stacker.defect_key = defect_key
+    _worker_stacker.raw_params.update(raw_params or {})
+    _worker_stacker.proxy_frames = proxy_frames
+    _worker_stacker.collected_stars = {} if collect_stars else None
+    _worker_stacker.prepare_reference(ref_stars, reference_data)
+    
+    _worker_ref_stars = ref_stars
+    _worker_frame_size = frame_size
+
+def _align_frame_worker(index: int, image: Optional[np.ndarray], ring_specs=None, slots=None, stars=None):
+    """在工作进程中对齐单帧图像，stars 为主进程评估质量时已检测的星点
+    
+    返回 (对齐后的图像, 变换矩阵, 本帧检测的星点)，没有收集或没有检测星点时星点为None。
+    提供帧槽环时 image 为None表示从输入槽读取，对齐结果直接变换到输出槽，
+    返回的图像为None；无法写入输出槽的结果仍随返回值pickle传回
+    """
+    collected = _worker_stacker.collected_stars
+    if stars is not None:
+        _worker_stacker.assessed_stars[index] = stars
+    try:
+        if ring_specs is None:
+            aligned, matrix = _worker_stacker.align_frame(index, image, _worker_ref_stars, _worker_frame_size)
+            return aligned, matrix, collected.pop(index, None) if collected is not None else None
+        
+        if image is None:
+            image = attach_ring(ring_specs[0]).view(slots[0])
+        out = attach_ring(ring_specs[1]).view(slots[1])
+        aligned, matrix = _worker_stacker.align_frame(index, image, _worker_ref_stars, _worker_frame_size,
+                                                      out=out)
+    finally:
+        # 命中变换缓存时没有用到传入的星点
+        _worker_stacker.assessed_stars.pop(index, None)
+    stars = collected.pop(index, None) if collected is not None else None
+    if aligned is None or aligned is out:
+        return None, matrix, stars
+    return write_slot(ring_specs[1], slots[1], aligned), matrix, stars
+
 # 工具函数
 def estimate_processing_time(num_images: int, image_size: Tuple[int, int]) -> float:
     """估算处理时间（秒）"""
@@ -475,6 +3048,230 @@ def estimate_processing_time(num_images: int, image_size: Tuple[int, int]) -> fl
     size_factor = (image_size[0] * image_size[1]) / (1920 * 1080)  # 相对于1080p的尺寸因子
     return base_time * size_factor
 
+def downsample(image: np.ndarray, scale: int) -> np.ndarray:
+    """按整数倍区域平均降采样，裁掉不足一个降采样像素的边缘使倍数严格为整数"""
+    h, w = max(1, image.shape[0] // scale), max(1, image.shape[1] // scale)
+    return cv2.resize(image[:h * scale, :w * scale], (w, h), interpolation=cv2.INTER_AREA)
+
+def measure_window_centroids(image: np.ndarray, centers: np.ndarray, radius: int,
+                             iterations: int = 2) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    在每个预测位置周围 (2*radius+1)² 的窗口内计算扣除背景后的亮度加权质心
+    
+    Returns:
+        (质心 (N, 2), 是否有效 (N,))，窗口内没有明显高于背景的信号时无效
+    """
+    h, w = image.shape[:2]
+    offsets = np.arange(-radius, radius + 1)
+    centroids = np.asarray(centers, dtype=np.float64).reshape(-1, 2).copy()
+    valid = np.zeros(len(centroids), dtype=bool)
+    if len(centroids) == 0:
+        return centroids, valid
+    
+    for _ in range(iterations):
+        # 以上一次质心为中心重新取窗口
+        cx = np.clip(np.rint(centroids[:, 0]).astype(np.int64), radius, w - radius - 1)
+        cy = np.clip(np.rint(centroids[:, 1]).astype(np.int64), radius, h - radius - 1)
+        rows, cols = cy[:, None] + offsets, cx[:, None] + offsets
+        patches = image[rows[:, :, None], cols[:, None, :]].astype(np.float32)
+        if patches.ndim == 4:
+            patches = patches @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        
+        flat = patches.reshape(len(patches), -1)
+        background = np.median(flat, axis=1)
+        noise = np.median(np.abs(flat - background[:, None]), axis=1) * 1.4826 + 1e-3
+        # 只用明显高于噪声的像素，避免噪声把质心拉向窗口中心
+        weights = np.maximum(patches - (background + 2 * noise)[:, None, None], 0.0)
+        total = weights.sum(axis=(1, 2))
+        safe_total = np.where(total > 0, total, 1.0)
+        
+        centroids[:, 0] = (weights * cols[:, None, :]).sum(axis=(1, 2)) / safe_total
+        centroids[:, 1] = (weights * rows[:, :, None]).sum(axis=(1, 2)) / safe_total
+        valid = (total > 0) & (flat.max(axis=1) - background > 5 * noise)
+    
+    return centroids, valid
+
+def fit_similarity(src_pts: np.ndarray, dst_pts: np.ndarray) -> np.ndarray:
+    """最小二乘拟合相似变换（旋转、均匀缩放和平移），形式与 estimateAffinePartial2D 相同"""
+    src = np.asarray(src_pts, dtype=np.float64).reshape(-1, 2)
+    dst = np.asarray(dst_pts, dtype=np.float64).reshape(-1, 2)
+    src_mean, dst_mean = src.mean(axis=0), dst.mean(axis=0)
+    s, d = src - src_mean, dst - dst_mean
+    
+    # 把点看作复数，dst = (a + ib) * src + t
+    norm = max((s ** 2).sum(), 1e-12)
+    a = (s[:, 0] * d[:, 0] + s[:, 1] * d[:, 1]).sum() / norm
+    b = (s[:, 0] * d[:, 1] - s[:, 1] * d[:, 0]).sum() / norm
+    rotation = np.array([[a, -b], [b, a]])
+    return np.column_stack([rotation, dst_mean - rotation @ src_mean])
+
+def frame_quality_metrics(catalog: Dict[str, np.ndarray]) -> Dict[str, float]:
+    """由星点检测结果得到帧质量指标：星点数、FWHM中值、最亮星点的亮度、背景亮度和背景噪声"""
+    found = len(catalog['fwhm']) > 0
+    return {
+        'stars': int(catalog['count']),
+        'fwhm': float(np.median(catalog['fwhm'])) if found else 0.0,
+        # 只取最亮的星点，暗星在透明度差的帧中消失，会使全部星点的中值反而升高
+        'flux': float(np.median(catalog['flux'][:_QUALITY_STARS])) if found else 0.0,
+        'background': float(catalog['background']),
+        'noise': float(catalog['noise']),
+    }
+
+def quality_weights(metrics: Dict[int, Dict[str, float]]) -> Dict[int, float]:
+    """
+    由各帧的质量指标计算相对权重，指标等于所有帧中值的帧权重为1
+    
+    点源的信噪比与星点亮度成正比、与星像宽度和背景噪声成反比，权重取信噪比的平方，
+    再乘以星点数的比例（薄云、雾气和拖线都会让暗星消失）；没有星点的帧权重为0
+    """
+    if not metrics:
+        return {}
+    stars = {i: m['stars'] for i, m in metrics.items()}
+    # 下限避免无噪声的合成图像或极小星像使权重发散
+    flux = {i: max(m.get('flux', 1.0), 1e-3) for i, m in metrics.items()}
+    fwhm = {i: max(m['fwhm'], 1.0) for i, m in metrics.items()}
+    noise = {i: max(m['noise'], 0.5) for i, m in metrics.items()}
+    median = lambda values: float(np.median(list(values.values())))
+    median_stars = max(median(stars), 1.0)
+    median_flux, median_fwhm, median_noise = median(flux), median(fwhm), median(noise)
+    
+    weights = {}
+    for i in metrics:
+        snr = (flux[i] / median_flux) * (median_fwhm / fwhm[i]) * (median_noise / noise[i])
+        weights[i] = (stars[i] / median_stars) * snr ** 2 if stars[i] > 0 else 0.0
+    return weights
+
+def histogram_median_std(hist: np.ndarray) -> Tuple[float, float]:
+    """由整数亮度的直方图（第 v 个元素为亮度 v 的像素数）计算中值和标准差，与 np.median/np.std 一致"""
+    hist = np.asarray(hist, dtype=np.float64)
+    count = hist.sum()
+    if count == 0:
+        return 0.0, 0.0
+    values = np.arange(len(hist), dtype=np.float64)
+    cdf = np.cumsum(hist)
+    lower = np.searchsorted(cdf, (count - 1) // 2, side='right')
+    upper = np.searchsorted(cdf, count // 2, side='right')
+    mean = float(hist @ values) / count
+    variance = float(hist @ (values - mean) ** 2) / count
+    return float(lower + upper) / 2, float(np.sqrt(variance))
+
+def contour_boxes(contours: Sequence[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    由 cv2.findContours 的轮廓计算外接框 (N, 4) 的 (left, top, width, height)
+    和各轮廓的起点 (N, 2) 的 (x, y)（位于连通域上），所有轮廓的点拼接后分段归约，不逐个轮廓调用
+    """
+    if not contours:
+        return np.zeros((0, 4), dtype=np.int64), np.zeros((0, 2), dtype=np.int64)
+    lengths = np.fromiter(map(len, contours), dtype=np.int64, count=len(contours))
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    low = np.minimum.reduceat(points, starts)
+    high = np.maximum.reduceat(points, starts)
+    return np.column_stack([low, high - low + 1]), points[starts]
+
+def to_uint8(image: np.ndarray) -> np.ndarray:
+    """将uint16或0~1浮点图像转换为8位"""
+    if image.dtype == np.uint8:
+        return image
+    if np.issubdtype(image.dtype, np.floating):
+        return np.clip(image * 255 + 0.5, 0, 255).astype(np.uint8)
+    return np.clip(image / 257 + 0.5, 0, 255).astype(np.uint8)
+
+def to_uint16(image: np.ndarray) -> np.ndarray:
+    """将8位或0~1浮点图像转换为16位"""
+    if image.dtype == np.uint16:
+        return image
+    if image.dtype == np.uint8:
+        return image.astype(np.uint16) * 257
+    if np.issubdtype(image.dtype, np.floating):
+        return np.clip(image * 65535 + 0.5, 0, 65535).astype(np.uint16)
+    return np.clip(image, 0, 65535).astype(np.uint16)
+
+def decode_raw(path: str, bit_depth: int = 8, half_size: bool = False,
+               demosaic: str = 'ahd') -> np.ndarray:
+    """解码RAW文件为RGB数组（模块级函数，可在解码进程池中执行）"""
+    if not RAW_SUPPORT:
+        raise ValueError("未安装rawpy库，无法处理RAW格式")
+    
+    algorithm = rawpy.DemosaicAlgorithm.LINEAR if demosaic == 'linear' else rawpy.DemosaicAlgorithm.AHD
+    with rawpy.imread(path) as raw:
+        return raw.postprocess(
+            use_camera_wb=True,  # 使用相机白平衡
+            no_auto_bright=True,  # 不自动调整亮度
+            half_size=half_size,
+            demosaic_algorithm=algorithm,
+            output_bps=bit_depth
+        )
+
+def _decode_raw_worker(ring_spec, slot: int, path: str, options: Dict[str, Any]) -> Optional[np.ndarray]:
+    """在解码进程中解码RAW文件并写入帧槽，写入后返回None，尺寸不同的帧原样返回"""
+    return write_slot(ring_spec, slot, decode_raw(path, **options))
+
+def decode_cfa_plane(path: str, bit_depth: int = 8) -> np.ndarray:
+    """
+    从RAW文件的 raw_image_visible 提取拜耳阵列的绿色平面（两个绿色像素的平均），
+    按白电平归一化并套用与 postprocess 默认相同的BT.709伽马，亮度与去马赛克结果相近，
+    星点检测阈值可以通用；竖拍图像按 postprocess 的方向旋转
+    """
+    if not RAW_SUPPORT:
+        raise ValueError("未安装rawpy库，无法处理RAW格式")
+    
+    with rawpy.imread(path) as raw:
+        pattern = raw.raw_pattern
+        if pattern is None or pattern.shape != (2, 2):
+            raise ValueError(f"不是拜耳阵列的RAW文件: {Path(path).name}")
+        colors = raw.color_desc.decode()
+        greens = [(dy, dx) for dy in range(2) for dx in range(2) if colors[pattern[dy, dx]] == 'G']
+        data = raw.raw_image_visible
+        h, w = data.shape[0] // 2 * 2, data.shape[1] // 2 * 2
+        plane = sum(data[dy:h:2, dx:w:2].astype(np.float32) for dy, dx in greens) / len(greens)
+        black = np.mean([raw.black_level_per_channel[pattern[dy, dx]] for dy, dx in greens])
+        white = float(raw.white_level)
+        flip = raw.sizes.flip
+    
+    linear = np.clip((plane - black) / max(white - black, 1.0), 0, 1)
+    tone = np.where(linear < 0.018, 4.5 * linear, 1.099 * np.power(linear, 0.45) - 0.099)
+    if flip == 3:
+        tone = np.rot90(tone, 2)
+    elif flip == 5:
+        tone = np.rot90(tone, 1)
+    elif flip == 6:
+        tone = np.rot90(tone, -1)
+    
+    max_value = 65535 if bit_depth == 16 else 255
+    return np.ascontiguousarray(np.clip(tone * max_value + 0.5, 0, max_value).astype(
+        np.uint16 if bit_depth == 16 else np.uint8))
+
+def scale_transform(matrix: np.ndarray, scale: float) -> np.ndarray:
+    """
+    把绿色平面坐标系中的变换换算到放大 scale 倍的图像坐标系
+    
+    平面像素 u 覆盖图像像素 [scale·u, scale·u + scale)，中心对应 scale·u + (scale-1)/2
+    """
+    linear, offset = matrix[:, :2], (scale - 1) / 2
+    result = np.empty((2, 3), dtype=np.float64)
+    result[:, :2] = linear
+    result[:, 2] = scale * matrix[:, 2] + offset - linear @ np.array([offset, offset])
+    return result
+
+def read_image_size(path: str) -> Tuple[int, int]:
+    """读取图像尺寸 (宽, 高)，PIL无法识别的16位图像使用OpenCV读取，RAW文件只读取文件头"""
+    if Path(path).suffix.lower() in RAW_EXTENSIONS:
+        if not RAW_SUPPORT:
+            raise ValueError("未安装rawpy库，无法处理RAW格式")
+        with rawpy.imread(path) as raw:
+            width, height = raw.sizes.width, raw.sizes.height
+            # 竖拍的图像解码时会旋转
+            return (height, width) if raw.sizes.flip in (5, 6) else (width, height)
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise
+        return image.shape[1], image.shape[0]
+
 def validate_images_for_stacking(image_paths: List[str]) -> Tuple[bool, str]:
     """验证图像是否适合堆叠"""
     try:
@@ -482,18 +3279,13 @@ def validate_images_for_stacking(image_paths: List[str]) -> Tuple[bool, str]:
             return False, "至少需要2张图像进行堆叠"
         
         # 检查第一张图像获取基准尺寸
-        first_img = Image.open(image_paths[0])
-        base_size = first_img.size
-        first_img.close()
+        base_size = read_image_size(image_paths[0])
         
         # 检查所有图像尺寸是否一致
         for path in image_paths[1:]:
             try:
-                img = Image.open(path)
-                if img.size != base_size:
-                    img.close()
+                if read_image_size(path) != base_size:
                     return False, f"图像尺寸不一致: {Path(path).name}"
-                img.close()
             except Exception as e:
                 return False, f"无法打开图像: {Path(path).name}"
         
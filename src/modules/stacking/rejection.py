@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+像素拒绝堆叠
+迭代Kappa-Sigma裁剪、Winsorized Sigma裁剪和百分位裁剪。
+帧立方体按行带在线程池中归约（numpy运算期间释放GIL），每个工作线程复用预先分配的
+float32缓冲区，额外内存只与行带大小有关，而与整个帧立方体无关
+"""
+
+import math
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Tuple
+import logging
+
+import numpy as np
+
+from .selection import plan_bands, select_percentiles
+
+logger = logging.getLogger(__name__)
+
+# 按行带并行归约的拒绝方法
+REJECTION_METHODS = ('sigma_clip', 'winsorized_sigma', 'percentile_clip')
+# 每个像素值的工作内存：两个float32缓冲区和三个布尔掩码
+_BYTES_PER_VALUE = 11
+# Winsorized 方差相对正态分布的修正系数
+_WINSOR_CORRECTION = 1.134
+# Winsorize 时截断到中心值 ± 该倍数标准差
+_WINSOR_LIMIT = 1.5
+
+
+class _Scratch:
+    """一个工作线程的行带缓冲区，较小的行带使用其前若干行"""
+
+    def __init__(self, frames: int, rows: int, row_shape: Tuple[int, ...]):
+        shape = (frames, rows) + row_shape
+        self.data = np.empty(shape, dtype=np.float32)
+        self.work = np.empty(shape, dtype=np.float32)
+        self.valid = np.empty(shape, dtype=bool)
+        self.within = np.empty(shape, dtype=bool)
+        self.mask = np.empty(shape, dtype=bool)
+
+    def views(self, rows: int):
+        return tuple(buffer[:, :rows] for buffer in
+                     (self.data, self.work, self.valid, self.within, self.mask))
+
+
+def max_rejected(frames: int, rejection_ratio: float) -> int:
+    """每个像素最多可以拒绝的帧数，至少允许拒绝一帧"""
+    return max(1, int(math.ceil(rejection_ratio * frames)))
+
+
+def _bounded_mean(data, work, valid):
+    """有效样本的平均值及有效样本数"""
+    count = valid.sum(axis=0)
+    np.multiply(data, valid, out=work)
+    return work.sum(axis=0) / np.maximum(count, 1), count
+
+
+def kappa_sigma(data, work, valid, within, mask, params: Dict[str, Any]) -> np.ndarray:
+    """
+    迭代Kappa-Sigma裁剪
+
+    每次迭代用剩余样本的均值和标准差裁剪，已拒绝的样本不再恢复；
+    某个像素拒绝的样本数超过 rejection_ratio 时，该像素保持上一次迭代的结果
+    """
+    frames = len(data)
+    sigma_low, sigma_high = params.get('sigma_low', 2.0), params.get('sigma_high', 2.0)
+    cap = max_rejected(frames, params.get('rejection_ratio', 1.0))
+
+    valid.fill(True)
+    mean, count = _bounded_mean(data, work, valid)
+    for _ in range(max(1, params.get('clip_iterations', 1))):
+        np.subtract(data, mean, out=work)
+        np.multiply(work, valid, out=work)
+        np.square(work, out=work)
+        std = np.sqrt(work.sum(axis=0) / np.maximum(count, 1))
+
+        # 重新计算偏差（上面已被平方覆盖）
+        np.subtract(data, mean, out=work)
+        np.greater_equal(work, -sigma_low * std, out=within)
+        np.less_equal(work, sigma_high * std, out=mask)
+        np.logical_and(within, mask, out=within)
+        np.logical_and(within, valid, out=within)
+
+        new_count = within.sum(axis=0)
+        frozen = frames - new_count > cap
+        if frozen.any():
+            within[:, frozen] = valid[:, frozen]
+            new_count = within.sum(axis=0)
+
+        converged = np.array_equal(new_count, count)
+        valid, within = within, valid
+        mean, count = _bounded_mean(data, work, valid)
+        if converged:
+            break
+    return mean
+
+
+def winsorized_sigma(data, work, valid, within, mask, params: Dict[str, Any]) -> np.ndarray:
+    """
+    Winsorized Sigma裁剪
+
+    先把样本截断到中心值 ± 1.5σ 并迭代估计稳健的均值和标准差，
+    再用该估计裁剪原始样本；拒绝数超过 rejection_ratio 的像素不做裁剪
+    """
+    frames = len(data)
+    sigma_low, sigma_high = params.get('sigma_low', 2.0), params.get('sigma_high', 2.0)
+    cap = max_rejected(frames, params.get('rejection_ratio', 1.0))
+
+    mean = data.mean(axis=0)
+    np.subtract(data, mean, out=work)
+    np.square(work, out=work)
+    std = np.sqrt(work.mean(axis=0))
+    for _ in range(max(1, params.get('clip_iterations', 1))):
+        np.clip(data, mean - _WINSOR_LIMIT * std, mean + _WINSOR_LIMIT * std, out=work)
+        mean = work.mean(axis=0)
+        np.subtract(work, mean, out=work)
+        np.square(work, out=work)
+        std = _WINSOR_CORRECTION * np.sqrt(work.mean(axis=0))
+
+    np.subtract(data, mean, out=work)
+    np.greater_equal(work, -sigma_low * std, out=valid)
+    np.less_equal(work, sigma_high * std, out=mask)
+    np.logical_and(valid, mask, out=valid)
+
+    frozen = frames - valid.sum(axis=0) > cap
+    if frozen.any():
+        valid[:, frozen] = True
+    return _bounded_mean(data, work, valid)[0]
+
+
+def percentile_clip(data, work, valid, within, mask, params: Dict[str, Any]) -> np.ndarray:
+    """只保留百分位区间 [percentile_low, percentile_high] 内的样本后平均"""
+    # 在工作缓冲区上原地部分选择，不做完整排序
+    np.copyto(work, data)
+    lower, upper = select_percentiles(
+        work, [params.get('percentile_low', 10.0), params.get('percentile_high', 90.0)]
+    )
+
+    np.greater_equal(data, lower, out=valid)
+    np.less_equal(data, upper, out=mask)
+    np.logical_and(valid, mask, out=valid)
+    return _bounded_mean(data, work, valid)[0]
+
+
+_REDUCERS = {
+    'sigma_clip': kappa_sigma,
+    'winsorized_sigma': winsorized_sigma,
+    'percentile_clip': percentile_clip,
+}
+
+
+def reject_stack(cube: np.ndarray, method: str, params: Dict[str, Any],
+                 workers: int = 0, memory_budget_mb: float = 256) -> np.ndarray:
+    """
+    对 (N, H, ...) 帧立方体做像素拒绝堆叠，返回 (H, ...) 的float32结果
+
+    cube 可以是任意数据类型（如uint8数组或磁盘映射），每个行带复制到工作线程的
+    float32缓冲区后归约；workers 为0时使用CPU核数
+    """
+    reducer = _REDUCERS[method]
+    frames, height = cube.shape[:2]
+    row_shape = tuple(cube.shape[2:])
+    rows, bands, workers = plan_bands(frames, height, row_shape, _BYTES_PER_VALUE,
+                                      workers, memory_budget_mb)
+
+    scratch_pool = queue.Queue()
+    for _ in range(workers):
+        scratch_pool.put(_Scratch(frames, rows, row_shape))
+    result = np.empty((height,) + row_shape, dtype=np.float32)
+
+    def reduce_band(band):
+        y0, y1 = band
+        scratch = scratch_pool.get()
+        try:
+            data, work, valid, within, mask = scratch.views(y1 - y0)
+            np.copyto(data, cube[:, y0:y1], casting='unsafe')
+            result[y0:y1] = reducer(data, work, valid, within, mask, params)
+        finally:
+            scratch_pool.put(scratch)
+
+    if workers == 1:
+        for band in bands:
+            reduce_band(band)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(reduce_band, bands))
+    return result
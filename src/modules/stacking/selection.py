@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+中值和百分位归约
+按行带选择每个像素第k小的值，全部在帧的原数据类型上完成，不生成浮点副本：
+8/16位整数帧用按位计数选择（每一位一次比较计数），不受重复值和帧数分布影响；
+其他数据类型用 np.partition 部分选择，不做完整排序
+"""
+
+import math
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 使用按位计数选择的数据类型，选择次数只与位数有关
+COUNTING_TYPES = (np.dtype(np.uint8), np.dtype(np.uint16))
+# 按位计数要多次遍历行带，行带缓冲区保持在CPU缓存可以容纳的大小
+_MAX_BAND_MB = 8
+
+
+def plan_bands(frames: int, height: int, row_shape: Tuple[int, ...], bytes_per_value: float,
+               workers: int, memory_budget_mb: float,
+               max_band_mb: float = None) -> Tuple[int, List[Tuple[int, int]], int]:
+    """
+    按内存预算划分行带，返回 (每带行数, 行带列表, 实际线程数)
+
+    所有工作线程的缓冲区总和不超过内存预算，行带数至少与线程数相同；
+    max_band_mb 限制单个行带的缓冲区大小
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    values_per_row = frames * int(np.prod(row_shape, dtype=np.int64))
+    band_mb = memory_budget_mb / workers
+    if max_band_mb is not None:
+        band_mb = min(band_mb, max_band_mb)
+    rows = int(band_mb * 1024 ** 2 // (values_per_row * bytes_per_value))
+    rows = max(1, min(rows, math.ceil(height / workers)))
+    bands = [(y0, min(y0 + rows, height)) for y0 in range(0, height, rows)]
+    return rows, bands, min(workers, len(bands))
+
+
+def count_select(values: np.ndarray, rank: int, less: np.ndarray) -> np.ndarray:
+    """
+    按位计数选择：从最高位开始逐位确定第 rank 小（从0开始）的值
+
+    每一位只需统计小于候选值的样本数，less 为与 values 同形状的布尔缓冲区
+    """
+    count_type = np.uint16 if len(values) < 2 ** 16 else np.uint32
+    result = np.zeros(values.shape[1:], dtype=values.dtype)
+    count = np.empty(values.shape[1:], dtype=count_type)
+    for bit in range(values.dtype.itemsize * 8 - 1, -1, -1):
+        candidate = result | values.dtype.type(1 << bit)
+        np.less(values, candidate, out=less)
+        less.sum(axis=0, dtype=count_type, out=count)
+        np.copyto(result, candidate, where=count <= rank)
+    return result
+
+
+def order_statistics(values: np.ndarray, ranks: Sequence[int], less: np.ndarray = None) -> List[np.ndarray]:
+    """
+    返回沿第0轴第 ranks 小的值（原数据类型）
+
+    8/16位无符号整数使用按位计数选择，不修改 values；其他类型原地部分选择，values 的顺序会被打乱
+    """
+    if values.dtype in COUNTING_TYPES:
+        if less is None:
+            less = np.empty(values.shape, dtype=bool)
+        selected = {rank: count_select(values, rank, less) for rank in set(ranks)}
+        return [selected[rank] for rank in ranks]
+    values.partition(sorted(set(ranks)), axis=0)
+    return [values[rank] for rank in ranks]
+
+
+def select_percentiles(values: np.ndarray, percentiles: Sequence[float],
+                       less: np.ndarray = None) -> List[np.ndarray]:
+    """
+    沿第0轴计算百分位（线性插值，与 np.percentile 默认方法一致），返回float32数组
+
+    浮点输入会被原地部分排序
+    """
+    frames = len(values)
+    positions = [q / 100.0 * (frames - 1) for q in percentiles]
+    lower = [int(math.floor(position)) for position in positions]
+    # 落在整数名次上的百分位不需要插值
+    ranks = sorted(set(lower) | {rank + 1 for rank, position in zip(lower, positions)
+                                 if position > rank and rank + 1 < frames})
+    selected = dict(zip(ranks, order_statistics(values, ranks, less)))
+
+    results = []
+    for position, low in zip(positions, lower):
+        value = selected[low].astype(np.float32)
+        if low + 1 in selected and position > low:
+            value += np.float32(position - low) * (selected[low + 1].astype(np.float32) - value)
+        results.append(value)
+    return results
+
+
+def percentile_stack(cube: np.ndarray, percentile: float = 50.0, workers: int = 0,
+                     memory_budget_mb: float = 256) -> np.ndarray:
+    """
+    对 (N, H, ...) 帧立方体逐像素求百分位，返回 (H, ...) 的float32结果
+
+    cube 可以是任意数据类型（如uint16数组或磁盘映射），每个行带复制到工作线程的
+    同类型缓冲区后选择；workers 为0时使用CPU核数
+    """
+    frames, height = cube.shape[:2]
+    row_shape = tuple(cube.shape[2:])
+    # 每个像素值的工作内存：一份原类型副本，按位计数另需一个布尔比较缓冲区
+    counting = cube.dtype in COUNTING_TYPES
+    bytes_per_value = cube.dtype.itemsize + counting
+    rows, bands, workers = plan_bands(frames, height, row_shape, bytes_per_value,
+                                      workers, memory_budget_mb, _MAX_BAND_MB)
+
+    scratch_pool = queue.Queue()
+    for _ in range(workers):
+        shape = (frames, rows) + row_shape
+        scratch_pool.put((np.empty(shape, dtype=cube.dtype),
+                          np.empty(shape, dtype=bool) if counting else None))
+    result = np.empty((height,) + row_shape, dtype=np.float32)
+
+    def reduce_band(band):
+        y0, y1 = band
+        scratch = scratch_pool.get()
+        try:
+            values, less = (None if buffer is None else buffer[:, :y1 - y0] for buffer in scratch)
+            np.copyto(values, cube[:, y0:y1])
+            result[y0:y1] = select_percentiles(values, [percentile], less)[0]
+        finally:
+            scratch_pool.put(scratch)
+
+    if workers == 1:
+        for band in bands:
+            reduce_band(band)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(reduce_band, bands))
+    return result
+
+
+def median_stack(cube: np.ndarray, workers: int = 0, memory_budget_mb: float = 256) -> np.ndarray:
+    """逐像素中值，偶数帧时取中间两个值的平均，与 np.median 一致"""
+    return percentile_stack(cube, 50.0, workers, memory_budget_mb)
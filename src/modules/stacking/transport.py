@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享内存帧传输
+父进程预先分配一块共享内存，划分为固定尺寸的帧槽环。父进程取得空闲槽后把槽号随任务交给
+工作进程，工作进程按名称附加同一块共享内存，把解码或变换的结果直接写入槽中，只返回很小的
+元数据；父进程读取（如累加）后归还槽。几十MB的帧不再经过pickle序列化和进程间管道
+"""
+
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 工作进程中已附加的帧槽环 {共享内存名称: FrameRing}，每个进程只附加一次
+_attached: Dict[str, 'FrameRing'] = {}
+# 关闭时调用方仍持有帧槽视图的共享内存，视图释放后再解除映射
+_retired: List[shared_memory.SharedMemory] = []
+
+
+class FrameRing:
+    """
+    共享内存中的帧槽环
+
+    父进程用 acquire() 取得一个空闲槽的所有权（没有空闲槽时阻塞），随任务交给工作进程写入，
+    读取结束后用 release() 归还；工作进程用 spec 描述附加同一块内存
+    """
+
+    def __init__(self, slots: int, shape: Tuple[int, ...], dtype, name: Optional[str] = None):
+        self.slots = max(1, slots)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+        if self.owner:
+            _close_retired()
+            size = max(1, self.slots * frame_nbytes(self.shape, self.dtype))
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.memory = _open_shared_memory(name)
+        self.frames = np.ndarray((self.slots,) + self.shape, dtype=self.dtype, buffer=self.memory.buf)
+
+        self._free = queue.Queue()
+        if self.owner:
+            for slot in range(self.slots):
+                self._free.put(slot)
+
+    @property
+    def spec(self) -> Tuple[str, int, Tuple[int, ...], str]:
+        """可以pickle的描述，工作进程用 attach_ring(spec) 附加"""
+        return self.memory.name, self.slots, self.shape, self.dtype.str
+
+    def fits(self, frame: np.ndarray) -> bool:
+        """帧的尺寸和数据类型是否与帧槽一致"""
+        return tuple(frame.shape) == self.shape and frame.dtype == self.dtype
+
+    def acquire(self, timeout: Optional[float] = None) -> int:
+        """取得一个空闲槽的所有权"""
+        return self._free.get(timeout=timeout)
+
+    def release(self, slot: int):
+        """归还帧槽，之后该槽的内容可能被覆盖"""
+        self._free.put(slot)
+
+    def view(self, slot: int) -> np.ndarray:
+        """帧槽的数组视图（不复制）"""
+        return self.frames[slot]
+
+    def close(self):
+        """释放映射，创建者同时删除共享内存（删除名称后已有的映射仍然有效）"""
+        self.frames = None
+        if self.owner:
+            self.memory.unlink()
+        try:
+            self.memory.close()
+        except BufferError:
+            # 调用方仍持有最后产出的帧槽视图，等下次创建帧槽环时再解除映射
+            _retired.append(self.memory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def frame_nbytes(shape: Tuple[int, ...], dtype) -> int:
+    """一帧的字节数"""
+    return int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+
+
+def start_resource_tracker():
+    """
+    在创建工作进程池之前调用：先启动资源跟踪器，工作进程继承它的描述符，与当前进程共用同一个跟踪器；
+    否则每个工作进程附加共享内存时会启动自己的跟踪器，退出时把仍在使用的共享内存当作泄漏删除
+    """
+    if os.name == 'posix':
+        resource_tracker.ensure_running()
+
+
+def create_process_pool(max_workers: int, **kwargs) -> ProcessPoolExecutor:
+    """
+    创建工作进程池，工作进程用spawn启动
+
+    堆叠在界面线程之外运行，同时还有加载线程；fork只复制调用线程，其他线程持有的锁
+    （日志、OpenCV、内存分配器）在子进程中永远不会释放，工作进程可能死锁
+    """
+    start_resource_tracker()
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                               **kwargs)
+
+
+def can_allocate(nbytes: int) -> bool:
+    """共享内存是否有足够空间（Linux上 /dev/shm 是大小有限的tmpfs，写满时进程会收到SIGBUS）"""
+    try:
+        stat = os.statvfs('/dev/shm')
+    except (OSError, AttributeError):
+        return True
+    return stat.f_bavail * stat.f_frsize >= nbytes
+
+
+def _close_retired():
+    """解除已不再被视图引用的共享内存映射"""
+    for memory in list(_retired):
+        try:
+            memory.close()
+        except BufferError:
+            continue
+        _retired.remove(memory)
+
+
+def _open_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """附加已有的共享内存；Python 3.13起附加方不登记到资源跟踪器，避免退出时被误删"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def attach_ring(spec: Tuple[str, int, Tuple[int, ...], str]) -> FrameRing:
+    """在工作进程中附加父进程创建的帧槽环（按名称缓存）"""
+    name, slots, shape, dtype = spec
+    ring = _attached.get(name)
+    if ring is None:
+        ring = _attached[name] = FrameRing(slots, shape, dtype, name=name)
+    return ring
+
+
+def write_slot(spec: Tuple[str, int, Tuple[int, ...], str], slot: int,
+               frame: np.ndarray) -> Optional[np.ndarray]:
+    """
+    在工作进程中把帧写入帧槽，写入后返回None；
+    尺寸或数据类型与帧槽不一致时原样返回帧，由调用方按普通方式（pickle）传回
+    """
+    ring = attach_ring(spec)
+    if not ring.fits(frame):
+        return frame
+    np.copyto(ring.view(slot), frame)
+    return None
+
+
+def owned(frame: np.ndarray) -> np.ndarray:
+    """需要长期保留时使用：帧槽视图等不拥有数据的数组返回副本"""
+    return frame if frame.flags.owndata else frame.copy()
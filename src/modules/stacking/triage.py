@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+堆叠前预检
+用RAW内嵌的JPEG预览图（或按缩小比例解码的JPEG/TIFF）快速评估每帧的亮度、
+低分辨率星点数和锐度，在全分辨率解码之前排除明显异常的帧：
+车灯/天亮导致的过亮、镜头盖未取下导致的过暗、云层遮挡导致的星点过少以及跑焦/抖动导致的模糊
+"""
+
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+import logging
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .frames import RAW_EXTENSIONS
+
+try:
+    import rawpy
+    RAW_SUPPORT = True
+except ImportError:
+    RAW_SUPPORT = False
+
+logger = logging.getLogger(__name__)
+
+# 少于该帧数时无法可靠估计整体分布，不排除任何帧
+MIN_TRIAGE_FRAMES = 4
+# 星点检测阈值（高通图像噪声的倍数）
+_STAR_SIGMA = 5.0
+# 预览图上星点的最大面积，更大的连通区域是地景或云层边缘
+_MAX_STAR_AREA = 25
+# 亮度和锐度离散程度的下限（相对中值的比例），避免各帧几乎一致时微小差异被放大
+_MIN_RELATIVE_SPREAD = {'brightness': 0.05, 'sharpness': 0.1}
+
+# 排除原因
+REASONS = {
+    'bright': "过亮",
+    'dark': "过暗",
+    'stars': "星点过少",
+    'blur': "模糊",
+}
+
+
+def load_preview(path: str, max_size: int = 400) -> np.ndarray:
+    """读取长边不超过 max_size 的RGB预览图（uint8）
+
+    RAW文件优先读取内嵌缩略图，不做去马赛克；JPEG由解码器按1/2~1/8比例直接缩小解码
+    """
+    if Path(path).suffix.lower() in RAW_EXTENSIONS:
+        image = load_raw_preview(path)
+    else:
+        try:
+            with Image.open(path) as img:
+                img.draft('RGB', (max_size, max_size))
+                image = np.array(img.convert('RGB'))
+        except Exception:
+            # PIL无法读取的16位TIFF/PNG由OpenCV转换为8位
+            image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError(f"无法读取图像: {path}")
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return fit_preview(image, max_size)
+
+
+def load_raw_preview(path: str) -> np.ndarray:
+    """读取RAW文件内嵌的预览图，没有预览图时以半尺寸快速解码"""
+    if not RAW_SUPPORT:
+        raise ValueError("未安装rawpy库，无法处理RAW格式")
+
+    with rawpy.imread(path) as raw:
+        try:
+            thumb = raw.extract_thumb()
+            if thumb.format == rawpy.ThumbFormat.JPEG:
+                image = cv2.imdecode(np.frombuffer(thumb.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if image is not None:
+                    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            elif thumb.format == rawpy.ThumbFormat.BITMAP:
+                return np.asarray(thumb.data)
+        except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+            pass
+        return raw.postprocess(half_size=True, use_camera_wb=True, no_auto_bright=True,
+                               user_qual=0, output_bps=8)
+
+
+def fit_preview(image: np.ndarray, max_size: int) -> np.ndarray:
+    """缩小到长边不超过 max_size，保持宽高比"""
+    scale = max_size / max(image.shape[:2])
+    if scale >= 1:
+        return image
+    size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def score_preview(image: np.ndarray) -> Dict[str, float]:
+    """评估预览图：亮度（亮度中值）、星点数和锐度（拉普拉斯方差）"""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY).astype(np.float32)
+
+    # 减去大尺度背景后，高于噪声 _STAR_SIGMA 倍的小连通区域视为星点
+    highpass = gray - cv2.GaussianBlur(gray, (0, 0), 3)
+    noise = max(float(np.median(np.abs(highpass))) * 1.4826, 1.0)
+    mask = (highpass > _STAR_SIGMA * noise).astype(np.uint8)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    areas = stats[1:, cv2.CC_STAT_AREA]
+
+    return {
+        'brightness': float(np.median(gray)),
+        'stars': int(np.count_nonzero(areas <= _MAX_STAR_AREA)),
+        'sharpness': float(cv2.Laplacian(gray, cv2.CV_32F).var()),
+    }
+
+
+def robust_z(values: np.ndarray, key: str) -> np.ndarray:
+    """相对中值的稳健z分数（MAD估计离散程度）"""
+    median = np.median(values)
+    spread = np.median(np.abs(values - median)) * 1.4826
+    spread = max(spread, _MIN_RELATIVE_SPREAD.get(key, 0.0) * abs(median), 1e-6)
+    return (values - median) / spread
+
+
+def triage_decisions(scores: Sequence[Dict[str, float]], sigma: float = 4.0,
+                     min_star_ratio: float = 0.5) -> List[Dict[str, Any]]:
+    """
+    根据各帧的预览评分决定保留或排除，返回与 scores 顺序相同的决定
+
+    亮度偏离整体超过 sigma 倍时排除（两侧），星点数低于中值的 min_star_ratio 倍时排除，
+    锐度低于整体 sigma 倍时排除；帧数少于 MIN_TRIAGE_FRAMES 时全部保留
+    """
+    decisions = [dict(score, excluded=False, reason=None) for score in scores]
+    if len(scores) < MIN_TRIAGE_FRAMES:
+        return decisions
+
+    brightness = robust_z(np.array([s['brightness'] for s in scores], dtype=np.float64), 'brightness')
+    sharpness = robust_z(np.array([s['sharpness'] for s in scores], dtype=np.float64), 'sharpness')
+    stars = np.array([s['stars'] for s in scores], dtype=np.float64)
+    min_stars = min_star_ratio * np.median(stars)
+
+    for i, decision in enumerate(decisions):
+        if brightness[i] > sigma:
+            reason = 'bright'
+        elif brightness[i] < -sigma:
+            reason = 'dark'
+        elif stars[i] < min_stars:
+            reason = 'stars'
+        elif sharpness[i] < -sigma:
+            reason = 'blur'
+        else:
+            continue
+        decision.update(excluded=True, reason=reason)
+    return decisions
@@ -14,7 +14,9 @@ import time
 from typing import List, Optional
 import json
 
-from .processor import AstroStacker, validate_images_for_stacking, estimate_processing_time
+from .processor import (AstroStacker, validate_images_for_stacking, estimate_processing_time, to_uint8,
+                        read_image_size)
+from .triage import REASONS as TRIAGE_REASONS
 from ..camera_raw import CameraRawWindow
 
 class StackingWindow:
@@ -34,6 +36,8 @@ class StackingWindow:
         
         # 图像列表
         self.image_paths = []
+        # 校准帧 {类型: 文件列表}
+        self.calibration_paths = {'bias': [], 'dark': [], 'flat': [], 'flat_dark': []}
         
         # 设置UI
         self.setup_ui()
@@ -77,6 +81,7 @@ class StackingWindow:
         ttk.Button(button_frame, text="添加文件夹", command=self.add_folder).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(button_frame, text="清空列表", command=self.clear_images).pack(side=tk.LEFT, padx=(0, 20))
         ttk.Button(button_frame, text="移除选中", command=self.remove_selected).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(button_frame, text="预检", command=self.triage_images).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(button_frame, text="Camera Raw", command=self.open_camera_raw).pack(side=tk.LEFT, padx=(20, 5))
         
         # 图像列表
@@ -105,6 +110,33 @@ class StackingWindow:
         self.image_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         tree_scroll.pack(side=tk.RIGHT, fill=tk.Y)
         
+        # 校准帧
+        calibration_group = ttk.LabelFrame(image_frame, text="校准帧", padding=5)
+        calibration_group.pack(fill=tk.X, pady=(10, 0))
+        
+        self.calibration_labels = {}
+        for column, (kind, title) in enumerate((('bias', "偏置场"), ('dark', "暗场"), ('flat', "平场"),
+                                                ('flat_dark', "平场暗场"))):
+            cell = ttk.Frame(calibration_group)
+            cell.grid(row=0, column=column, sticky=tk.W, padx=(0, 20))
+            self.calibration_labels[kind] = ttk.Label(cell, text=f"{title}: 未使用", width=14)
+            self.calibration_labels[kind].pack(side=tk.LEFT)
+            ttk.Button(cell, text="选择", width=6,
+                       command=lambda k=kind, t=title: self.select_calibration_frames(k, t)).pack(side=tk.LEFT)
+            ttk.Button(cell, text="清除", width=6,
+                       command=lambda k=kind, t=title: self.set_calibration_frames(k, t, [])).pack(side=tk.LEFT)
+        
+        calibration_help_frame = ttk.Frame(calibration_group)
+        calibration_help_frame.grid(row=0, column=4, sticky=tk.W)
+        self.create_help_button(calibration_help_frame, "校准帧",
+            "加载每张图像时直接扣除暗场并除以平场，不需要先在其他软件中预处理。\n\n"
+            "• 偏置场：最短曝光、盖上镜头盖拍摄，没有暗场时扣除偏置\n"
+            "• 暗场：与亮场相同曝光时间和温度、盖上镜头盖拍摄，已包含偏置\n"
+            "• 平场：对均匀光源拍摄，用于校正暗角和灰尘阴影\n"
+            "• 平场暗场：与平场相同曝光时间、盖上镜头盖拍摄，从平场中扣除；没有时依次用偏置场或暗场代替\n\n"
+            "各组帧按中位数合成主校准帧，并缓存在所在文件夹中，文件不变时不再重新合成。\n\n"
+            "建议：暗场10-20张，平场20张左右")
+        
         # 信息标签
         info_frame = ttk.Frame(image_frame)
         info_frame.pack(fill=tk.X, pady=(10, 0))
@@ -237,6 +269,34 @@ class StackingWindow:
             "• 2.0-5.0：强模糊，有效抑制噪点但可能丢失小星点\n\n"
             "建议：使用1.5，在噪点抑制和星点保持之间取得平衡")
         
+        # 星点缓存
+        self.cache_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(star_group, text="缓存检测结果", variable=self.cache_var).grid(
+            row=4, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
+        cache_help_frame = ttk.Frame(star_group)
+        cache_help_frame.grid(row=4, column=3, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(cache_help_frame, "缓存检测结果",
+            "在图像所在文件夹保存星点检测结果和对齐变换（.sky_editor_cache.sqlite）。\n\n"
+            "• 再次堆叠同一组图像且检测参数不变时，直接读取缓存，跳过星点检测\n"
+            "• 对齐参数也不变时跳过星点匹配，只重新变换和堆叠\n"
+            "• 图像文件被修改或检测参数改变后会自动重新检测\n\n"
+            "建议：保持开启，尝试不同堆叠方法时可以节省大量时间")
+        
+        # 热像素校正
+        self.hot_pixels_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(star_group, text="热像素校正", variable=self.hot_pixels_var).grid(
+            row=5, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
+        hot_pixels_help_frame = ttk.Frame(star_group)
+        hot_pixels_help_frame.grid(row=5, column=3, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(hot_pixels_help_frame, "热像素校正",
+            "堆叠开始时检测一次传感器的热像素和冷像素，加载每张图像时用周围像素的中值替换。\n\n"
+            "• 选择了暗场时从主暗场中查找热像素\n"
+            "• 没有暗场时在抽样的8张图像中查找始终孤立异常的像素\n"
+            "• 热像素不再被误检为星点，匹配更快，结果中也不会留下彩色噪点\n\n"
+            "建议：长曝光或高温拍摄时开启")
+        
         star_group.columnconfigure(1, weight=1)
         
         # 2. 对齐参数
@@ -273,6 +333,86 @@ class StackingWindow:
             "• 8.0-20.0：宽松匹配，可能包含错误匹配\n\n"
             "建议：使用5.0像素，在精度和鲁棒性之间取得平衡")
         
+        # 匹配方式
+        ttk.Label(align_group, text="匹配方式:").grid(row=2, column=0, sticky=tk.W, pady=2)
+        self.matcher_var = tk.StringVar(value="auto")
+        matcher_combo = ttk.Combobox(align_group, textvariable=self.matcher_var,
+                                    values=["auto", "nearest", "asterism"],
+                                    state="readonly", width=15)
+        matcher_combo.grid(row=2, column=1, sticky=tk.W, padx=(10, 0), pady=2)
+        
+        matcher_help_frame = ttk.Frame(align_group)
+        matcher_help_frame.grid(row=2, column=2, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(matcher_help_frame, "匹配方式",
+            "星点匹配的方式。\n\n"
+            "• Nearest（最近邻）：按位置就近匹配，要求帧间位移较小\n"
+            "• Asterism（星组）：按星点三角形形状匹配，不受位移、旋转和缩放影响\n"
+            "• Auto（自动）：先用最近邻，失败时自动改用星组匹配\n\n"
+            "建议：使用Auto；地平式跟踪或三脚架被碰动时选择Asterism")
+        
+        # 并行对齐
+        ttk.Label(align_group, text="并行数:").grid(row=3, column=0, sticky=tk.W, pady=2)
+        self.workers_var = tk.IntVar(value=0)
+        workers_spinbox = ttk.Spinbox(align_group, from_=0, to=64, textvariable=self.workers_var, width=10)
+        workers_spinbox.grid(row=3, column=1, sticky=tk.W, padx=(10, 0), pady=2)
+        
+        workers_help_frame = ttk.Frame(align_group)
+        workers_help_frame.grid(row=3, column=2, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(workers_help_frame, "并行数",
+            "同时进行星点检测和对齐的图像数量。\n\n"
+            "• 0或1：逐张顺序处理\n"
+            "• 2-16：多张图像并行对齐，显著缩短对齐时间\n\n"
+            "建议：设置为CPU核心数，内存紧张时适当减小")
+        
+        # 配准方式
+        ttk.Label(align_group, text="配准方式:").grid(row=4, column=0, sticky=tk.W, pady=2)
+        self.registration_var = tk.StringVar(value="stars")
+        registration_combo = ttk.Combobox(align_group, textvariable=self.registration_var,
+                                          values=["stars", "pyramid", "phase"],
+                                          state="readonly", width=15)
+        registration_combo.grid(row=4, column=1, sticky=tk.W, padx=(10, 0), pady=2)
+        
+        registration_help_frame = ttk.Frame(align_group)
+        registration_help_frame.grid(row=4, column=2, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(registration_help_frame, "配准方式",
+            "计算每张图像对齐变换的方式。\n\n"
+            "• Stars（星点）：在全分辨率图像上检测全部星点后匹配\n"
+            "• Pyramid（金字塔）：先在缩小4倍的图像上匹配得到初始变换，"
+            "再只在最亮星点的预测位置附近精确测量，失败时自动改用全分辨率匹配\n"
+            "• Phase（相位相关）：用FFT直接估计整幅图像的平移，只适用于赤道仪跟踪、"
+            "帧间没有旋转的序列，相关性不足时自动改用星点匹配\n\n"
+            "星点太少的图像（薄云、月光）在任何方式下都会尝试相位相关，而不是直接跳过。\n\n"
+            "建议：赤道仪跟踪选择Phase；4000万像素以上的图像选择Pyramid")
+        
+        # 预测配准
+        self.predictive_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(align_group, text="预测配准", variable=self.predictive_var).grid(
+            row=5, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
+        predictive_help_frame = ttk.Frame(align_group)
+        predictive_help_frame.grid(row=5, column=2, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(predictive_help_frame, "预测配准",
+            "按前两帧的变换外推当前帧的位置（匀速漂移模型），在预测位置附近的小范围内匹配星点。\n\n"
+            "• 极轴未校准或无跟踪拍摄时，累计漂移超过100像素的后续帧也能正确对齐\n"
+            "• 预测足够准确时跳过RANSAC，对齐更快\n"
+            "• 预测失败时自动改用完整匹配\n\n"
+            "只在顺序对齐（并行数为0或1）时生效。建议：保持开启")
+        
+        # 拜耳阵列配准
+        self.cfa_registration_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(align_group, text="拜耳阵列配准", variable=self.cfa_registration_var).grid(
+            row=6, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
+        cfa_help_frame = ttk.Frame(align_group)
+        cfa_help_frame.grid(row=6, column=2, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(cfa_help_frame, "拜耳阵列配准",
+            "RAW文件直接在传感器拜耳阵列的绿色像素上检测星点和配准，不需要先去马赛克。\n\n"
+            "• 配准用的图像只有全分辨率的1/4像素，检测和匹配快数倍\n"
+            "• 每张图像只在最后变换堆叠时去马赛克一次\n"
+            "• 配准失败或按质量排除的图像完全不需要去马赛克\n"
+            "• 只在全部输入为RAW文件时生效\n\n"
+            "建议：高像素相机的RAW文件开启")
+        
         align_group.columnconfigure(1, weight=1)
         
         # 3. 堆叠参数
@@ -283,7 +423,8 @@ class StackingWindow:
         ttk.Label(stack_group, text="堆叠方法:").grid(row=0, column=0, sticky=tk.W, pady=2)
         self.method_var = tk.StringVar(value="average")
         method_combo = ttk.Combobox(stack_group, textvariable=self.method_var, 
-                                   values=["average", "median", "maximum", "sigma_clip"], 
+                                   values=["average", "median", "maximum", "sigma_clip", "winsorized_sigma",
+                                           "percentile_clip"], 
                                    state="readonly", width=15)
         method_combo.grid(row=0, column=1, sticky=tk.W, padx=(10, 0), pady=2)
         
@@ -294,7 +435,9 @@ class StackingWindow:
             "• Average（平均）：计算所有像素的平均值，适合大多数情况\n"
             "• Median（中位数）：使用中位数，能有效去除异常值和噪点\n"
             "• Maximum（最大值）：保留最亮的像素，适合星轨摄影\n"
-            "• Sigma Clip（西格玛裁剪）：去除异常值后平均，最佳降噪效果\n\n"
+            "• Sigma Clip（西格玛裁剪）：迭代去除异常值后平均，最佳降噪效果\n"
+            "• Winsorized Sigma：用截断后的稳健统计量裁剪，异常帧较多时比Sigma Clip更可靠\n"
+            "• Percentile Clip（百分位裁剪）：去除每个像素最亮和最暗的部分后平均\n\n"
             "建议：一般使用Average，噪点较多时选择Sigma Clip")
         
         # Sigma裁剪参数（仅在选择sigma_clip时显示）
@@ -329,10 +472,135 @@ class StackingWindow:
             "• 3.0-5.0：激进裁剪，去除飞机轨迹等\n\n"
             "建议：使用2.0，能去除飞机轨迹和卫星轨迹")
         
+        ttk.Label(self.sigma_frame, text="迭代次数:").grid(row=1, column=0, sticky=tk.W, pady=2)
+        self.clip_iterations_var = tk.IntVar(value=3)
+        ttk.Spinbox(self.sigma_frame, from_=1, to=10, textvariable=self.clip_iterations_var, width=8).grid(
+            row=1, column=1, padx=(5, 10), pady=2)
+        
+        clip_iterations_help_frame = ttk.Frame(self.sigma_frame)
+        clip_iterations_help_frame.grid(row=1, column=2, sticky=tk.W, padx=(0, 10), pady=2)
+        self.create_help_button(clip_iterations_help_frame, "迭代次数",
+            "每次裁剪后用剩余的像素重新计算均值和标准差，再次裁剪。\n\n"
+            "• 1：单次裁剪，与早期版本相同\n"
+            "• 3-5：多个异常帧（如多条飞机轨迹）叠加在同一位置时也能全部去除\n\n"
+            "流式引擎每次迭代需要多读取一遍全部图像，没有新的异常像素时提前结束。建议：使用3")
+        
+        ttk.Label(self.sigma_frame, text="拒绝比例:").grid(row=1, column=3, sticky=tk.W, pady=2)
+        self.rejection_ratio_var = tk.DoubleVar(value=1.0)
+        ttk.Spinbox(self.sigma_frame, from_=0.0, to=1.0, increment=0.05,
+                    textvariable=self.rejection_ratio_var, width=8).grid(row=1, column=4, padx=(5, 0), pady=2)
+        
+        rejection_ratio_help_frame = ttk.Frame(self.sigma_frame)
+        rejection_ratio_help_frame.grid(row=1, column=5, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(rejection_ratio_help_frame, "拒绝比例",
+            "每个像素最多可以被裁剪掉的图像比例（至少一张）。\n\n"
+            "超过该比例时保留上一次迭代的结果，避免在星点边缘等亮度变化大的位置裁剪过多。\n\n"
+            "• 1.0：不限制（默认）\n"
+            "• 0.1-0.3：限制裁剪；帧数较少时只能拒绝一张，同一位置有多个异常帧时无法全部去除\n\n"
+            "建议：使用1.0；星点边缘出现噪点时再适当降低")
+        
         # 绑定方法选择事件
         method_combo.bind('<<ComboboxSelected>>', self.on_method_change)
         self.on_method_change()  # 初始化显示
         
+        # 堆叠引擎
+        ttk.Label(stack_group, text="堆叠引擎:").grid(row=2, column=0, sticky=tk.W, pady=2)
+        self.engine_var = tk.StringVar(value="memory")
+        engine_combo = ttk.Combobox(stack_group, textvariable=self.engine_var,
+                                   values=["memory", "streaming", "out_of_core", "auto"],
+                                   state="readonly", width=15)
+        engine_combo.grid(row=2, column=1, sticky=tk.W, padx=(10, 0), pady=2)
+        
+        engine_help_frame = ttk.Frame(stack_group)
+        engine_help_frame.grid(row=2, column=2, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(engine_help_frame, "堆叠引擎",
+            "选择堆叠时图像数据的处理方式。\n\n"
+            "• Memory（内存）：所有对齐后的图像保存在内存中再统一计算\n"
+            "• Streaming（流式）：每张图像对齐后立即累加，内存占用与图像数量无关，"
+            "支持 Average、Maximum、Sigma Clip（Sigma Clip每次迭代都要重新读取和变换全部图像）\n"
+            "• Out of Core（磁盘映射）：对齐后的图像写入临时文件并分块计算，"
+            "适合大量图像的中位数堆叠\n"
+            "• Auto（自动）：Average、Maximum使用流式处理，其余方法（包括Sigma Clip）使用磁盘映射\n\n"
+            "建议：图像数量较多或分辨率较高时选择Auto")
+        
+        # 流水线处理
+        self.pipeline_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(stack_group, text="流水线处理", variable=self.pipeline_var).grid(
+            row=3, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
+        pipeline_help_frame = ttk.Frame(stack_group)
+        pipeline_help_frame.grid(row=3, column=2, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(pipeline_help_frame, "流水线处理",
+            "边加载边对齐边堆叠。\n\n"
+            "• 读取下一张图像的同时处理当前图像，磁盘读取和计算互相重叠\n"
+            "• 同时在内存中的图像只有几张，适合大量高分辨率图像\n\n"
+            "建议：图像较多时开启")
+        
+        # 按质量排除帧
+        ttk.Label(stack_group, text="排除最差帧:").grid(row=4, column=0, sticky=tk.W, pady=2)
+        self.quality_reject_var = tk.DoubleVar(value=0.0)
+        ttk.Spinbox(stack_group, from_=0.0, to=0.5, increment=0.05,
+                    textvariable=self.quality_reject_var, width=8).grid(row=4, column=1, sticky=tk.W, padx=(10, 0), pady=2)
+        
+        quality_reject_help_frame = ttk.Frame(stack_group)
+        quality_reject_help_frame.grid(row=4, column=2, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(quality_reject_help_frame, "排除最差帧",
+            "配准之前按帧质量排除最差的图像比例。\n\n"
+            "• 质量由星点数、星点半峰全宽(FWHM)、星点亮度和背景噪声综合评估\n"
+            "• 薄云、跟踪拖线、失焦的图像得分较低\n"
+            "• 被排除的图像不再配准和变换，节省处理时间\n"
+            "• 参考图像（第一张）始终保留\n\n"
+            "建议：图像较多且质量参差不齐时使用0.1~0.2")
+        
+        # 质量加权
+        self.quality_weighting_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(stack_group, text="质量加权", variable=self.quality_weighting_var).grid(
+            row=5, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
+        quality_weighting_help_frame = ttk.Frame(stack_group)
+        quality_weighting_help_frame.grid(row=5, column=2, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(quality_weighting_help_frame, "质量加权",
+            "平均堆叠时按帧质量加权。\n\n"
+            "• 星点锐利、背景噪声低的图像权重较高\n"
+            "• 只对Average方法生效\n\n"
+            "建议：图像质量差异较大时开启")
+        
+        # 堆叠前预检
+        self.triage_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(stack_group, text="堆叠前预检", variable=self.triage_var).grid(
+            row=6, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
+        triage_help_frame = ttk.Frame(stack_group)
+        triage_help_frame.grid(row=6, column=2, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(triage_help_frame, "堆叠前预检",
+            "加载图像之前用预览图快速检查所有图像，排除明显异常的帧。\n\n"
+            "• RAW文件只读取内嵌的JPEG预览，不需要完整解码\n"
+            "• 过亮（车灯、天亮）、过暗（镜头盖）、星点过少（云层）、模糊（跑焦、抖动）的帧被排除\n"
+            "• 检查结果显示在图像列表的状态列中，也可以点击\"预检\"按钮单独检查\n"
+            "• 少于4张图像时不排除\n\n"
+            "建议：整夜拍摄的大量图像开启")
+        
+        # 检查点
+        self.checkpoint_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(stack_group, text="保存检查点", variable=self.checkpoint_var).grid(
+            row=7, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
+        checkpoint_help_frame = ttk.Frame(stack_group)
+        checkpoint_help_frame.grid(row=7, column=2, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(checkpoint_help_frame, "保存检查点",
+            "堆叠时每处理100张图像以及每一遍结束时把进度保存到检查点文件（实时堆叠除外）。\n\n"
+            "• 取消、出错或程序意外退出后，点击\"继续堆叠\"从中断处继续\n"
+            "• 流式累加（Streaming引擎或流水线处理下的Average、Maximum、Sigma裁剪）只处理尚未累加的图像\n"
+            "• 其他引擎和方法保存各帧的星点和变换矩阵，已配准的图像不再检测和匹配，只重新变换后归约\n"
+            "• 继续时使用中断前的堆叠参数\n"
+            "• 检查点保存在系统临时目录中，每组图像和参数各有一个文件，开始新的堆叠不会删除其他任务的检查点\n"
+            "• 堆叠完成后检查点自动删除\n\n"
+            "文件大小（2400万像素彩色图像）：\n"
+            "• 流式累加的Average、Maximum约0.3 GB，Sigma裁剪约2.7 GB，写入时临时文件再占用相同空间\n"
+            "• 其他引擎只保存星点和变换矩阵，通常只有几MB\n"
+            "• 写入大文件时堆叠会短暂停顿\n\n"
+            "建议：长时间堆叠时开启，并确认系统临时目录有足够空间")
+        
         stack_group.columnconfigure(1, weight=1)
         
         # 4. 输出设置
@@ -375,6 +643,45 @@ class StackingWindow:
             "• 90-100：低压缩，高质量，文件较大\n\n"
             "建议：使用95，在质量和文件大小间取得平衡")
         
+        # 输出位深
+        ttk.Label(output_group, text="输出位深:").grid(row=2, column=0, sticky=tk.W, pady=2)
+        self.bit_depth_var = tk.IntVar(value=8)
+        bit_depth_combo = ttk.Combobox(output_group, textvariable=self.bit_depth_var,
+                                       values=[8, 16, 32], state="readonly", width=15)
+        bit_depth_combo.grid(row=2, column=1, sticky=tk.W, padx=(10, 0), pady=2)
+        
+        bit_depth_help_frame = ttk.Frame(output_group)
+        bit_depth_help_frame.grid(row=2, column=3, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(bit_depth_help_frame, "输出位深",
+            "堆叠计算和输出结果的位深。\n\n"
+            "• 8：读取为8位，输出8位图像\n"
+            "• 16：16位TIFF/PNG和RAW按16位读取，输出16位TIFF/PNG\n"
+            "• 32：按16位读取，输出32位浮点TIFF（0~1）\n\n"
+            "高位深可以保留堆叠恢复的暗弱细节，便于后期拉伸。\n"
+            "JPEG只支持8位，高位深时请选择TIFF或PNG输出\n\n"
+            "建议：需要后期处理时选择16")
+        
+        # RAW解码
+        ttk.Label(output_group, text="RAW解码:").grid(row=3, column=0, sticky=tk.W, pady=2)
+        raw_frame = ttk.Frame(output_group)
+        raw_frame.grid(row=3, column=1, sticky=tk.W, padx=(10, 0), pady=2)
+        self.raw_demosaic_var = tk.StringVar(value="ahd")
+        ttk.Combobox(raw_frame, textvariable=self.raw_demosaic_var, values=["ahd", "linear"],
+                     state="readonly", width=8).pack(side=tk.LEFT)
+        self.raw_half_size_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(raw_frame, text="半尺寸", variable=self.raw_half_size_var).pack(side=tk.LEFT, padx=(10, 0))
+        
+        raw_help_frame = ttk.Frame(output_group)
+        raw_help_frame.grid(row=3, column=3, sticky=tk.W, padx=(5, 0), pady=2)
+        self.create_help_button(raw_help_frame, "RAW解码",
+            "直接堆叠相机RAW文件（CR2、NEF、ARW、DNG、RAF、ORF），不需要先转换为TIFF。\n\n"
+            "• 多个RAW文件在多个进程中同时解码\n"
+            "• AHD / Linear：配准时的去马赛克算法，Linear（双线性）速度更快\n"
+            "• 半尺寸：配准时每个2×2拜耳单元合成一个像素，解码最快\n"
+            "• 这两项只影响配准，变换和堆叠时始终以全分辨率AHD解码，结果不会降低分辨率\n"
+            "• 输出位深选择16或32时以16位解码，保留RAW的全部动态范围\n\n"
+            "建议：大批量RAW可以用半尺寸加快配准")
+        
         output_group.columnconfigure(1, weight=1)
         
         # 预设按钮
@@ -468,6 +775,20 @@ class StackingWindow:
         self.start_button = ttk.Button(button_frame, text="开始堆叠", command=self.start_stacking)
         self.start_button.pack(side=tk.LEFT, padx=(0, 5))
         
+        # 只修改了堆叠参数时复用已加载的图像和变换矩阵
+        self.restack_button = ttk.Button(button_frame, text="重新堆叠", command=self.restack_stacking,
+                                         state=tk.DISABLED)
+        self.restack_button.pack(side=tk.LEFT, padx=(0, 5))
+        
+        # 从检查点继续中断的堆叠，已累加或已配准的图像不再配准
+        self.resume_button = ttk.Button(button_frame, text="继续堆叠", command=self.resume_stacking,
+                                        state=tk.DISABLED)
+        self.resume_button.pack(side=tk.LEFT, padx=(0, 5))
+        
+        # 监视文件夹，边拍摄边堆叠
+        self.live_button = ttk.Button(button_frame, text="实时堆叠", command=self.start_live_stacking)
+        self.live_button.pack(side=tk.LEFT, padx=(0, 5))
+        
         self.cancel_button = ttk.Button(button_frame, text="取消", command=self.cancel_stacking, state=tk.DISABLED)
         self.cancel_button.pack(side=tk.LEFT, padx=(0, 5))
         
@@ -476,11 +797,11 @@ class StackingWindow:
     def add_images(self):
         """添加图像文件"""
         filetypes = [
-            ("图像文件", "*.jpg *.jpeg *.png *.tiff *.tif *.bmp *.arw *.cr2 *.nef *.dng"),
+            ("图像文件", "*.jpg *.jpeg *.png *.tiff *.tif *.bmp *.arw *.cr2 *.nef *.dng *.raf *.orf"),
             ("JPEG文件", "*.jpg *.jpeg"),
             ("PNG文件", "*.png"),
             ("TIFF文件", "*.tiff *.tif"),
-            ("RAW文件", "*.arw *.cr2 *.nef *.dng"),
+            ("RAW文件", "*.arw *.cr2 *.nef *.dng *.raf *.orf"),
             ("所有文件", "*.*")
         ]
         
@@ -498,7 +819,7 @@ class StackingWindow:
         
         if folder:
             # 支持的图像格式
-            extensions = {'.jpg', '.jpeg', '.png', '.tiff', '.tif', '.bmp', '.arw', '.cr2', '.nef', '.dng'}
+            extensions = {'.jpg', '.jpeg', '.png', '.tiff', '.tif', '.bmp', '.arw', '.cr2', '.nef', '.dng', '.raf', '.orf'}
             
             image_files = []
             for file_path in Path(folder).rglob('*'):
@@ -510,15 +831,30 @@ class StackingWindow:
             else:
                 messagebox.showinfo("提示", "所选文件夹中没有找到支持的图像文件")
     
+    def select_calibration_frames(self, kind, title):
+        """选择一组校准帧"""
+        files = filedialog.askopenfilenames(
+            title=f"选择{title}图像",
+            filetypes=[("图像文件", "*.jpg *.jpeg *.png *.tiff *.tif *.bmp *.arw *.cr2 *.nef *.dng *.raf *.orf"),
+                       ("所有文件", "*.*")]
+        )
+        if files:
+            self.set_calibration_frames(kind, title, list(files))
+    
+    def set_calibration_frames(self, kind, title, files):
+        """设置校准帧并更新显示"""
+        self.calibration_paths[kind] = files
+        text = f"{title}: {len(files)} 张" if files else f"{title}: 未使用"
+        self.calibration_labels[kind].configure(text=text)
+    
     def add_image_files(self, files):
         """添加图像文件到列表"""
         for file_path in files:
             if file_path not in self.image_paths:
                 try:
-                    # 获取图像信息
-                    img = Image.open(file_path)
-                    size_str = f"{img.width}x{img.height}"
-                    img.close()
+                    # 获取图像信息（RAW文件只读取文件头）
+                    width, height = read_image_size(file_path)
+                    size_str = f"{width}x{height}"
                     
                     # 获取文件大小
                     file_size = os.path.getsize(file_path)
@@ -575,9 +911,8 @@ class StackingWindow:
         
         for i, file_path in enumerate(self.image_paths):
             try:
-                img = Image.open(file_path)
-                size_str = f"{img.width}x{img.height}"
-                img.close()
+                width, height = read_image_size(file_path)
+                size_str = f"{width}x{height}"
                 
                 file_size = os.path.getsize(file_path)
                 size_mb = file_size / (1024 * 1024)
@@ -595,8 +930,47 @@ class StackingWindow:
         
         self.update_image_info()
     
+    def triage_images(self):
+        """只做预检并在状态列中显示结果，不开始堆叠"""
+        if not self.image_paths or (self.processing_thread and self.processing_thread.is_alive()):
+            return
+        
+        paths = list(self.image_paths)
+        self.stacker.progress_callback = self.update_progress
+        
+        def run():
+            try:
+                results = self.stacker.triage_frames(paths)
+                self.window.after(0, self.on_triage_complete, results)
+            except Exception as e:
+                self.window.after(0, self.on_stacking_error, str(e))
+        
+        self.processing_thread = threading.Thread(target=run)
+        self.processing_thread.daemon = True
+        self.processing_thread.start()
+    
+    def show_triage_results(self, results):
+        """在图像列表的状态列中显示预检决定"""
+        decisions = {decision['path']: decision for decision in results}
+        for item, path in zip(self.image_tree.get_children(), self.image_paths):
+            decision = decisions.get(path)
+            if decision is None:
+                status = "就绪"
+            elif decision['excluded']:
+                status = f"排除: {TRIAGE_REASONS.get(decision['reason'], decision['reason'])}"
+            else:
+                status = "通过"
+            self.image_tree.set(item, '状态', status)
+    
+    def on_triage_complete(self, results):
+        """单独预检完成的处理"""
+        self.show_triage_results(results)
+        excluded = sum(1 for decision in results if decision['excluded'])
+        self.progress_label.configure(text=f"预检完成，排除 {excluded} 张")
+    
     def update_image_info(self):
         """更新图像信息显示"""
+        self.update_resume_button()
         count = len(self.image_paths)
         if count == 0:
             self.image_info_label.configure(text="请选择要堆叠的星空图像")
@@ -607,9 +981,7 @@ class StackingWindow:
             # 估算处理时间
             if count >= 2:
                 try:
-                    img = Image.open(self.image_paths[0])
-                    estimated_time = estimate_processing_time(count, img.size)
-                    img.close()
+                    estimated_time = estimate_processing_time(count, read_image_size(self.image_paths[0]))
                     
                     if estimated_time < 60:
                         time_str = f"约 {estimated_time:.0f} 秒"
@@ -622,10 +994,15 @@ class StackingWindow:
             else:
                 self.estimate_label.configure(text="至少需要2张图像")
     
+    def update_resume_button(self):
+        """图像目录中有中断的堆叠任务时启用继续堆叠按钮"""
+        resumable = bool(self.image_paths) and self.stacker.has_checkpoint(self.image_paths)
+        self.resume_button.configure(state=tk.NORMAL if resumable else tk.DISABLED)
+    
     def on_method_change(self, event=None):
         """堆叠方法改变时的处理"""
         method = self.method_var.get()
-        if method == "sigma_clip":
+        if method in ("sigma_clip", "winsorized_sigma"):
             # 显示Sigma参数
             for widget in self.sigma_frame.winfo_children():
                 widget.grid()
@@ -638,7 +1015,7 @@ class StackingWindow:
         """浏览输出路径"""
         filename = filedialog.asksaveasfilename(
             title="保存堆叠结果",
-            defaultextension=".jpg",
+            defaultextension=self.default_output_extension(),
             filetypes=[
                 ("JPEG文件", "*.jpg"),
                 ("PNG文件", "*.png"),
@@ -650,6 +1027,10 @@ class StackingWindow:
         if filename:
             self.output_path_var.set(filename)
     
+    def default_output_extension(self):
+        """默认输出格式，高位深时使用TIFF"""
+        return ".jpg" if self.bit_depth_var.get() == 8 else ".tif"
+    
     def load_preset(self, preset_name):
         """加载预设参数"""
         presets = {
@@ -703,19 +1084,39 @@ class StackingWindow:
                 "threshold": self.threshold_var.get(),
                 "min_area": self.min_area_var.get(),
                 "max_area": self.max_area_var.get(),
-                "gaussian_blur": self.blur_var.get()
+                "gaussian_blur": self.blur_var.get(),
+                "cache": self.cache_var.get(),
+                "hot_pixels": self.hot_pixels_var.get()
             },
             "alignment": {
                 "max_features": self.max_features_var.get(),
-                "ransac_threshold": self.ransac_var.get()
+                "ransac_threshold": self.ransac_var.get(),
+                "matcher": self.matcher_var.get(),
+                "workers": self.workers_var.get(),
+                "registration": self.registration_var.get(),
+                "predictive": self.predictive_var.get(),
+                "cfa_registration": self.cfa_registration_var.get()
             },
             "stacking": {
                 "method": self.method_var.get(),
                 "sigma_low": self.sigma_low_var.get(),
-                "sigma_high": self.sigma_high_var.get()
+                "sigma_high": self.sigma_high_var.get(),
+                "clip_iterations": self.clip_iterations_var.get(),
+                "rejection_ratio": self.rejection_ratio_var.get(),
+                "engine": self.engine_var.get(),
+                "pipeline": self.pipeline_var.get(),
+                "quality_reject": self.quality_reject_var.get(),
+                "quality_weighting": self.quality_weighting_var.get(),
+                "triage": self.triage_var.get(),
+                "checkpoint": self.checkpoint_var.get()
             },
             "output": {
-                "quality": self.quality_var.get()
+                "quality": self.quality_var.get(),
+                "bit_depth": self.bit_depth_var.get()
+            },
+            "raw": {
+                "half_size": self.raw_half_size_var.get(),
+                "demosaic": self.raw_demosaic_var.get()
             }
         }
         
@@ -741,18 +1142,38 @@ class StackingWindow:
                 self.min_area_var.set(star.get("min_area", 3))
                 self.max_area_var.set(star.get("max_area", 100))
                 self.blur_var.set(star.get("gaussian_blur", 1.5))
+                self.cache_var.set(star.get("cache", True))
+                self.hot_pixels_var.set(star.get("hot_pixels", False))
                 
                 align = settings.get("alignment", {})
                 self.max_features_var.set(align.get("max_features", 500))
                 self.ransac_var.set(align.get("ransac_threshold", 5.0))
+                self.matcher_var.set(align.get("matcher", "auto"))
+                self.workers_var.set(align.get("workers", 0))
+                self.registration_var.set(align.get("registration", "stars"))
+                self.predictive_var.set(align.get("predictive", True))
+                self.cfa_registration_var.set(align.get("cfa_registration", False))
                 
                 stack = settings.get("stacking", {})
                 self.method_var.set(stack.get("method", "average"))
                 self.sigma_low_var.set(stack.get("sigma_low", 2.0))
                 self.sigma_high_var.set(stack.get("sigma_high", 2.0))
+                self.clip_iterations_var.set(stack.get("clip_iterations", 3))
+                self.rejection_ratio_var.set(stack.get("rejection_ratio", 1.0))
+                self.engine_var.set(stack.get("engine", "memory"))
+                self.pipeline_var.set(stack.get("pipeline", False))
+                self.quality_reject_var.set(stack.get("quality_reject", 0.0))
+                self.quality_weighting_var.set(stack.get("quality_weighting", False))
+                self.triage_var.set(stack.get("triage", False))
+                self.checkpoint_var.set(stack.get("checkpoint", False))
                 
                 output = settings.get("output", {})
                 self.quality_var.set(output.get("quality", 95))
+                self.bit_depth_var.set(output.get("bit_depth", 8))
+                
+                raw = settings.get("raw", {})
+                self.raw_half_size_var.set(raw.get("half_size", False))
+                self.raw_demosaic_var.set(raw.get("demosaic", "ahd"))
                 
                 # 更新显示
                 self.threshold_label.configure(text=str(self.threshold_var.get()))
@@ -776,17 +1197,91 @@ class StackingWindow:
             return
         
         # 检查输出路径
+        self.ensure_output_path()
+        
+        # 更新堆叠器参数
+        self.update_stacker_params()
+        self.run_in_background(self.process_stacking)
+    
+    def ensure_output_path(self):
+        """没有指定输出路径时自动生成"""
         if not self.output_path_var.get():
-            # 自动生成输出路径
             first_image_path = Path(self.image_paths[0])
-            output_path = first_image_path.parent / f"stacked_{int(time.time())}.jpg"
+            output_path = first_image_path.parent / f"stacked_{int(time.time())}{self.default_output_extension()}"
             self.output_path_var.set(str(output_path))
+    
+    def restack_stacking(self):
+        """用新的堆叠参数重新堆叠，跳过加载和对齐"""
+        if not self.output_path_var.get():
+            self.start_stacking()
+            return
         
-        # 更新堆叠器参数
         self.update_stacker_params()
+        self.run_in_background(lambda: self.process_stacking(restack=True))
+    
+    def resume_stacking(self):
+        """从检查点继续中断的堆叠任务，堆叠参数使用中断前的设置"""
+        if not self.image_paths or not self.stacker.has_checkpoint(self.image_paths):
+            messagebox.showinfo("提示", "没有可以继续的堆叠任务")
+            self.update_resume_button()
+            return
+        
+        self.ensure_output_path()
+        self.stacker.set_checkpoint_params(enabled=True)
+        self.run_in_background(lambda: self.process_stacking(resume=True))
+    
+    def start_live_stacking(self):
+        """选择相机输出文件夹并开始实时堆叠，点击取消后停止并保存结果"""
+        folder = filedialog.askdirectory(title="选择相机保存图像的文件夹")
+        if not folder:
+            return
         
+        if not self.output_path_var.get():
+            output_path = Path(folder) / f"stacked_live_{int(time.time())}{self.default_output_extension()}"
+            self.output_path_var.set(str(output_path))
+        
+        self.update_stacker_params()
+        self.run_in_background(lambda: self.process_live_stacking(folder))
+        self.cancel_button.configure(text="停止")
+    
+    def process_live_stacking(self, folder):
+        """实时堆叠（在后台线程中运行），停止后保存最终结果"""
+        try:
+            result = self.stacker.run_live_stack(
+                folder,
+                preview_callback=lambda preview: self.window.after(0, self.on_live_preview, preview),
+                progress_callback=self.update_progress
+            )
+            
+            if result is None:
+                self.window.after(0, self.on_stacking_error, "文件夹中没有可作为参考的图像")
+            elif self.stacker.save_result(result, self.output_path_var.get(), quality=self.quality_var.get()):
+                self.window.after(0, self.on_live_stacking_complete, result)
+            else:
+                self.window.after(0, self.on_stacking_error, "保存结果失败")
+                
+        except Exception as e:
+            self.window.after(0, self.on_stacking_error, str(e))
+    
+    def on_live_preview(self, preview):
+        """显示实时堆叠的中间结果"""
+        self.result_image = preview
+        self.display_result(preview)
+        self.show_stacking_info()
+    
+    def on_live_stacking_complete(self, result):
+        """实时堆叠结束的处理"""
+        self.on_stacking_complete(result)
+        # 实时堆叠的帧不在图像列表中，需要添加图像后才能重新堆叠
+        self.restack_button.configure(state=tk.DISABLED)
+    
+    def run_in_background(self, target):
+        """禁用开始按钮并在新线程中开始处理"""
         # 禁用开始按钮，启用取消按钮
         self.start_button.configure(state=tk.DISABLED)
+        self.restack_button.configure(state=tk.DISABLED)
+        self.resume_button.configure(state=tk.DISABLED)
+        self.live_button.configure(state=tk.DISABLED)
         self.cancel_button.configure(state=tk.NORMAL)
         
         # 重置进度
@@ -794,7 +1289,7 @@ class StackingWindow:
         self.progress_label.configure(text="准备开始...")
         
         # 在新线程中开始处理
-        self.processing_thread = threading.Thread(target=self.process_stacking)
+        self.processing_thread = threading.Thread(target=target)
         self.processing_thread.daemon = True
         self.processing_thread.start()
     
@@ -807,25 +1302,47 @@ class StackingWindow:
             'max_area': self.max_area_var.get(),
             'gaussian_blur': self.blur_var.get()
         })
+        self.stacker.set_cache_params(enabled=self.cache_var.get())
+        self.stacker.set_calibration_frames(**self.calibration_paths)
+        self.stacker.set_defect_params(enabled=self.hot_pixels_var.get())
         
         # 对齐参数
         self.stacker.alignment_params.update({
             'max_features': self.max_features_var.get(),
-            'ransac_threshold': self.ransac_var.get()
+            'ransac_threshold': self.ransac_var.get(),
+            'matcher': self.matcher_var.get(),
+            'workers': self.workers_var.get(),
+            'registration': self.registration_var.get(),
+            'predictive': self.predictive_var.get(),
+            'cfa_registration': self.cfa_registration_var.get()
         })
         
         # 堆叠参数
         self.stacker.stacking_params.update({
             'method': self.method_var.get(),
             'sigma_low': self.sigma_low_var.get(),
-            'sigma_high': self.sigma_high_var.get()
+            'sigma_high': self.sigma_high_var.get(),
+            'clip_iterations': self.clip_iterations_var.get(),
+            'rejection_ratio': self.rejection_ratio_var.get(),
+            'engine': self.engine_var.get(),
+            'pipeline': self.pipeline_var.get(),
+            'bit_depth': self.bit_depth_var.get(),
+            'quality_reject': self.quality_reject_var.get(),
+            'quality_weighting': self.quality_weighting_var.get()
         })
+        self.stacker.set_triage_params(enabled=self.triage_var.get())
+        self.stacker.set_checkpoint_params(enabled=self.checkpoint_var.get())
+        self.stacker.set_raw_params(half_size=self.raw_half_size_var.get(), demosaic=self.raw_demosaic_var.get())
     
-    def process_stacking(self):
+    def process_stacking(self, restack=False, resume=False):
         """处理堆叠（在后台线程中运行）"""
         try:
             # 处理堆叠
-            result = self.stacker.process_stack(
+            if resume:
+                stack = self.stacker.resume_stack
+            else:
+                stack = self.stacker.restack if restack else self.stacker.process_stack
+            result = stack(
                 self.image_paths,
                 progress_callback=self.update_progress
             )
@@ -873,11 +1390,16 @@ class StackingWindow:
         
         # 重置按钮状态
         self.start_button.configure(state=tk.NORMAL)
-        self.cancel_button.configure(state=tk.DISABLED)
+        self.restack_button.configure(state=tk.NORMAL)
+        self.live_button.configure(state=tk.NORMAL)
+        self.cancel_button.configure(state=tk.DISABLED, text="取消")
+        self.update_resume_button()
         
         # 更新进度
         self.progress_label.configure(text="堆叠完成")
         self.progress_bar['value'] = 100
+        if self.stacker.triage_results:
+            self.show_triage_results(self.stacker.triage_results)
         
         # 显示结果
         self.display_result(result)
@@ -895,10 +1417,14 @@ class StackingWindow:
         """堆叠出错的处理"""
         # 重置按钮状态
         self.start_button.configure(state=tk.NORMAL)
-        self.cancel_button.configure(state=tk.DISABLED)
+        self.live_button.configure(state=tk.NORMAL)
+        self.cancel_button.configure(state=tk.DISABLED, text="取消")
+        self.update_resume_button()
         
         # 更新进度
         self.progress_label.configure(text="处理失败")
+        if self.stacker.triage_results:
+            self.show_triage_results(self.stacker.triage_results)
         
         messagebox.showerror("错误", f"堆叠处理失败: {error_message}")
     
@@ -906,19 +1432,24 @@ class StackingWindow:
         """堆叠取消的处理"""
         # 重置按钮状态
         self.start_button.configure(state=tk.NORMAL)
-        self.cancel_button.configure(state=tk.DISABLED)
+        self.live_button.configure(state=tk.NORMAL)
+        self.cancel_button.configure(state=tk.DISABLED, text="取消")
+        self.update_resume_button()
         
         # 更新进度
         self.progress_label.configure(text="已取消")
         self.progress_bar['value'] = 0
         
-        messagebox.showinfo("提示", "堆叠处理已取消")
+        if self.resume_button.instate(['!disabled']):
+            messagebox.showinfo("提示", "堆叠处理已取消，进度已保存，可以点击\"继续堆叠\"继续")
+        else:
+            messagebox.showinfo("提示", "堆叠处理已取消")
     
     def display_result(self, result):
         """显示堆叠结果"""
         try:
-            # 转换为PIL图像
-            pil_image = Image.fromarray(result)
+            # 转换为PIL图像（高位深结果转换为8位显示）
+            pil_image = Image.fromarray(to_uint8(result))
             
             # 计算适合的显示尺寸
             canvas_width = self.result_canvas.winfo_width()
@@ -979,6 +1510,15 @@ class StackingWindow:
 • 输出文件: {Path(self.output_path_var.get()).name}
 • 处理时间: {time.strftime('%Y-%m-%d %H:%M:%S')}
 """
+            quality = info.get('frame_quality') or []
+            if quality:
+                fwhm = [entry['fwhm'] for entry in quality]
+                info_text += f"• 星点FWHM: {min(fwhm):.1f} ~ {max(fwhm):.1f} 像素\n"
+            if info.get('rejected_frames'):
+                info_text += f"• 按质量排除: {len(info['rejected_frames'])} 张\n"
+            triage_excluded = [d for d in info.get('triage') or [] if d['excluded']]
+            if triage_excluded:
+                info_text += f"• 预检排除: {len(triage_excluded)} 张\n"
             
             self.result_info_text.configure(state=tk.NORMAL)
             self.result_info_text.delete(1.0, tk.END)
@@ -1006,7 +1546,7 @@ class StackingWindow:
             canvas_width = self.result_canvas.winfo_width()
             canvas_height = self.result_canvas.winfo_height()
             
-            pil_image = Image.fromarray(self.result_image)
+            pil_image = Image.fromarray(to_uint8(self.result_image))
             img_width, img_height = pil_image.size
             
             scale_x = canvas_width / img_width
@@ -1089,7 +1629,7 @@ class StackingWindow:
         
         filename = filedialog.asksaveasfilename(
             title="保存堆叠结果",
-            defaultextension=".jpg",
+            defaultextension=self.default_output_extension(),
             filetypes=[
                 ("JPEG文件", "*.jpg"),
                 ("PNG文件", "*.png"),
@@ -87,6 +87,1759 @@ def test_astro_stacker():
         print(f"✗ AstroStacker 测试失败: {e}")
         return False
 
+def make_star_frames(count=5, size=(240, 320), num_stars=80, seed=0):
+    """生成带平移的合成星空图像序列"""
+    import numpy as np
+    import cv2
+    
+    rng = np.random.default_rng(seed)
+    h, w = size
+    xs = rng.uniform(20, w - 20, num_stars)
+    ys = rng.uniform(20, h - 20, num_stars)
+    brightness = rng.uniform(120, 255, num_stars)
+    
+    frames = []
+    for k in range(count):
+        dx, dy = (k * 1.5, -k * 1.0) if k else (0.0, 0.0)
+        canvas = np.zeros((h, w), dtype=np.float32)
+        for x, y, b in zip(xs + dx, ys + dy, brightness):
+            xi, yi = int(round(x)), int(round(y))
+            if 0 <= xi < w and 0 <= yi < h:
+                canvas[yi, xi] = b * 12
+        canvas = cv2.GaussianBlur(canvas, (0, 0), 1.2)
+        canvas += rng.normal(10, 3, size=(h, w)).astype(np.float32)
+        gray = np.clip(canvas, 0, 255).astype(np.uint8)
+        frames.append(np.dstack([gray, gray, gray]))
+    return frames
+
+def load_frames_into(stacker, frames):
+    """将内存中的图像直接装入堆叠器（跳过文件读取）"""
+    from src.modules.stacking.frames import FrameHandle
+    
+    stacker.images = [FrameHandle(f"frame_{i}.png", image=frame) for i, frame in enumerate(frames)]
+    stacker.reference_image = frames[0]
+
+def test_streaming_engine():
+    """测试流式堆叠与内存堆叠结果一致"""
+    print("\n测试流式堆叠引擎...")
+    
+    try:
+        import numpy as np
+        from src.modules.stacking.processor import AstroStacker
+        
+        # 帧数过少时离群值恰好落在sigma边界上，使用8帧避免比较边界舍入
+        frames = make_star_frames(count=8)
+        for method in ('average', 'maximum', 'sigma_clip'):
+            memory_stacker = AstroStacker()
+            memory_stacker.set_stacking_params(method=method)
+            load_frames_into(memory_stacker, frames)
+            if not memory_stacker.align_images():
+                print(f"✗ {method} 内存模式对齐失败")
+                return False
+            expected = memory_stacker.stack_images()
+            
+            streaming_stacker = AstroStacker()
+            streaming_stacker.set_stacking_params(method=method, engine='streaming')
+            load_frames_into(streaming_stacker, frames)
+            result = streaming_stacker.stack_images_streaming()
+            
+            if result is None or result.shape != expected.shape:
+                print(f"✗ {method} 流式堆叠失败")
+                return False
+            
+            diff = np.abs(result.astype(np.int16) - expected.astype(np.int16))
+            if diff.max() > 1 or streaming_stacker.aligned_images:
+                print(f"✗ {method} 流式结果与内存结果不一致 (最大差异 {diff.max()})")
+                return False
+            print(f"✓ {method} 流式堆叠结果一致 (最大差异 {diff.max()})")
+        
+        # 自动模式下多遍的Sigma裁剪写入磁盘映射存储，不在每次迭代时重新变换所有帧
+        stacker = AstroStacker()
+        stacker.set_stacking_params(engine='auto')
+        engines = {method: stacker.resolve_engine(method) for method in ('average', 'maximum', 'sigma_clip')}
+        if engines != {'average': 'streaming', 'maximum': 'streaming', 'sigma_clip': 'out_of_core'}:
+            print(f"✗ 自动模式选择的引擎不正确: {engines}")
+            return False
+        print("✓ 自动模式下Sigma裁剪使用磁盘映射，单遍方法使用流式累加")
+
+        # 同一位置有两条卫星轨迹时需要迭代裁剪，默认参数下两种引擎的结果一致且都去除了轨迹
+        trailed = [frame.copy() for frame in frames]
+        # 轨迹较宽，对齐后两帧的轨迹仍有重叠
+        trailed[3][110:130] = 255
+        trailed[5][110:130] = 200
+        results = {}
+        for engine in ('memory', 'streaming'):
+            stacker = AstroStacker()
+            stacker.set_stacking_params(method='sigma_clip', engine=engine)
+            load_frames_into(stacker, trailed)
+            if engine == 'memory':
+                stacker.align_images()
+                results[engine] = stacker.stack_images()
+            else:
+                results[engine] = stacker.stack_images_streaming()
+        diff = np.abs(results['streaming'].astype(np.int16) - results['memory'].astype(np.int16))
+        trail = float(results['streaming'][124, 40:280].mean())
+        if diff.max() > 1 or trail > 20:
+            print(f"✗ 两帧异常时流式裁剪与内存裁剪不一致 (最大差异 {diff.max()}，轨迹处亮度 {trail:.1f})")
+            return False
+        print(f"✓ 默认参数下迭代裁剪去除两条轨迹，流式与内存结果一致 (最大差异 {diff.max()}，轨迹处亮度 {trail:.1f})")
+
+        return True
+        
+    except Exception as e:
+        print(f"✗ 流式堆叠测试失败: {e}")
+        return False
+
+def test_out_of_core_engine():
+    """测试磁盘映射分块堆叠与内存堆叠结果一致"""
+    print("\n测试磁盘映射堆叠引擎...")
+    
+    try:
+        import numpy as np
+        from src.modules.stacking.processor import AstroStacker
+        from src.modules.stacking.frame_store import MemmapFrameStore
+        
+        frames = make_star_frames(count=6)
+        
+        # 行带读取应与原始帧一致
+        with MemmapFrameStore(len(frames), frames[0].shape) as store:
+            for frame in frames:
+                store.append(frame)
+            if not np.array_equal(store.band(10, 20), np.array(frames)[:, 10:20]):
+                print("✗ 帧存储行带读取错误")
+                return False
+        print("✓ 帧存储行带读取正确")
+        
+        for method in ('median', 'sigma_clip', 'percentile_clip'):
+            memory_stacker = AstroStacker()
+            memory_stacker.set_stacking_params(method=method)
+            load_frames_into(memory_stacker, frames)
+            memory_stacker.align_images()
+            expected = memory_stacker.stack_images()
+            
+            # 极小的内存预算强制分成多个行带
+            stacker = AstroStacker()
+            stacker.set_stacking_params(method=method, engine='out_of_core', memory_budget_mb=0.5)
+            load_frames_into(stacker, frames)
+            result = stacker.stack_images_out_of_core()
+            
+            if result is None or not np.array_equal(result, expected):
+                print(f"✗ {method} 分块堆叠结果与内存结果不一致")
+                return False
+            print(f"✓ {method} 分块堆叠结果一致")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 磁盘映射堆叠测试失败: {e}")
+        return False
+
+def test_rejection_stacking():
+    """测试迭代Sigma裁剪、rejection_ratio和按行带并行裁剪的内存上限"""
+    print("\n测试像素拒绝堆叠...")
+    
+    try:
+        import tracemalloc
+        import numpy as np
+        from src.modules.stacking.rejection import reject_stack
+        from src.modules.stacking.accumulator import create_accumulator
+        
+        rng = np.random.default_rng(0)
+        cube = np.clip(rng.normal(100, 1, size=(12, 120, 160, 3)), 0, 255).astype(np.uint8)
+        # 两帧异常（如飞机和卫星），单次裁剪只能去掉最亮的一帧
+        cube[0], cube[1] = 200, 150
+        params = {'sigma_low': 2.0, 'sigma_high': 2.0, 'rejection_ratio': 0.1, 'clip_iterations': 3}
+        
+        # 一次迭代、不限制拒绝数时与原来的单次裁剪一致
+        data = cube.astype(np.float32)
+        mean, std = data.mean(axis=0), data.std(axis=0)
+        valid = (data >= mean - 2 * std) & (data <= mean + 2 * std)
+        single = np.where(valid, data, 0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+        result = reject_stack(cube, 'sigma_clip', dict(params, clip_iterations=1, rejection_ratio=1.0))
+        if np.abs(result - single).max() > 1e-3:
+            print("✗ 单次Sigma裁剪结果与原算法不一致")
+            return False
+        
+        results = {
+            'iterative': reject_stack(cube, 'sigma_clip', params),
+            'capped': reject_stack(cube, 'sigma_clip', dict(params, rejection_ratio=0.05)),
+            'winsorized': reject_stack(cube, 'winsorized_sigma', params),
+        }
+        errors = {name: float(np.abs(value - 100).mean()) for name, value in results.items()}
+        if errors['iterative'] > 1 or errors['winsorized'] > 1 or errors['capped'] < 3:
+            print(f"✗ 裁剪结果与背景的平均误差不符合预期: {errors}")
+            return False
+        print(f"✓ 迭代裁剪去除两帧异常 (误差 {errors['iterative']:.2f})，"
+              f"拒绝比例限制为一帧时保留第二帧 (误差 {errors['capped']:.2f})")
+
+        # 流式累加器多遍迭代裁剪，与行带裁剪一致（只在恰好落在边界上的样本处因舍入不同）
+        for name, ratio in (('iterative', 0.1), ('capped', 0.05)):
+            accumulator = create_accumulator('sigma_clip', dict(params, rejection_ratio=ratio))
+            while True:
+                for frame in cube:
+                    accumulator.add(frame)
+                if not accumulator.needs_another_pass():
+                    break
+                accumulator.next_pass()
+            streamed = accumulator.result()
+            if np.abs(streamed - results[name]).max() > 1 or np.abs(streamed - results[name]).mean() > 0.05:
+                print(f"✗ 流式累加器的 {name} 裁剪结果与行带裁剪不一致")
+                return False
+            sizes = {name: value.nbytes for name, value in accumulator.state().items()
+                     if isinstance(value, np.ndarray)}
+            if sizes['center'] != sizes['spread'] or sizes['center'] * 2 != sizes['sum']:
+                print(f"✗ 流式累加器保留了每次迭代的统计量: {sizes}")
+                return False
+        print("✓ 流式累加器的迭代裁剪和拒绝比例限制与行带裁剪一致，状态大小与迭代次数无关")
+
+        # 多线程多行带与单线程结果一致，额外内存受预算限制
+        sequential = reject_stack(cube, 'sigma_clip', params, workers=1)
+        tracemalloc.start()
+        parallel = reject_stack(cube, 'sigma_clip', params, workers=3, memory_budget_mb=0.5)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        budget = peak - parallel.nbytes
+        if not np.array_equal(sequential, parallel) or budget > 3 * 0.5 * 1024 ** 2:
+            print(f"✗ 并行行带裁剪结果不一致或额外内存过大 ({budget / 1024 ** 2:.2f}MB)")
+            return False
+        print(f"✓ 并行行带裁剪结果一致，额外内存 {budget / 1024 ** 2:.2f}MB "
+              f"(帧立方体 {cube.size * 4 / 1024 ** 2:.1f}MB float32)")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 像素拒绝堆叠测试失败: {e}")
+        return False
+
+def test_median_selection():
+    """测试整数帧的部分选择中值和百分位与numpy结果一致"""
+    print("\n测试中值选择...")
+    
+    try:
+        import numpy as np
+        from src.modules.stacking.selection import median_stack, percentile_stack
+        
+        rng = np.random.default_rng(1)
+        for frames, dtype, high in ((20, np.uint8, 256), (21, np.uint8, 256), (50, np.uint16, 65536)):
+            cube = rng.integers(0, high, size=(frames, 60, 80, 3)).astype(dtype)
+            original = cube.copy()
+            expected = np.median(cube, axis=0)
+            result = median_stack(cube, workers=2, memory_budget_mb=0.2)
+            if not np.array_equal(cube, original):
+                print("✗ 中值选择修改了输入帧")
+                return False
+            if result.dtype != np.float32 or not np.array_equal(result, expected):
+                print(f"✗ {frames}帧 {np.dtype(dtype).name} 中值与np.median不一致")
+                return False
+            
+            percentile = percentile_stack(cube, 12.5, memory_budget_mb=0.2)
+            if np.abs(percentile - np.percentile(cube, 12.5, axis=0)).max() > 1e-2:
+                print(f"✗ {frames}帧 {np.dtype(dtype).name} 百分位与np.percentile不一致")
+                return False
+        print("✓ uint8/uint16 中值和百分位与numpy一致，输入未被修改")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 中值选择测试失败: {e}")
+        return False
+
+def test_star_detection():
+    """测试连通域星点检测的亚像素质心和亮度排序"""
+    print("\n测试星点检测...")
+    
+    try:
+        import time
+        import numpy as np
+        import cv2
+        from src.modules.stacking.processor import AstroStacker
+        
+        rng = np.random.default_rng(3)
+        h, w = 400, 600
+        xs = rng.uniform(20, w - 20, 60)
+        ys = rng.uniform(20, h - 20, 60)
+        brightness = np.linspace(1400, 4800, 60)
+        
+        # 亚像素位置的高斯星点
+        grid_y, grid_x = np.mgrid[0:h, 0:w].astype(np.float32)
+        canvas = np.full((h, w), 10.0, dtype=np.float32)
+        for x, y, b in zip(xs, ys, brightness):
+            y0, y1, x0, x1 = int(y) - 8, int(y) + 9, int(x) - 8, int(x) + 9
+            canvas[y0:y1, x0:x1] += b / 20 * np.exp(
+                -((grid_x[y0:y1, x0:x1] - x) ** 2 + (grid_y[y0:y1, x0:x1] - y) ** 2) / (2 * 1.5 ** 2))
+        gray = np.clip(canvas, 0, 255).astype(np.uint8)
+        image = np.dstack([gray, gray, gray])
+        
+        stacker = AstroStacker()
+        stacker.alignment_params['max_features'] = 40
+        start = time.perf_counter()
+        catalog = stacker.detect_star_catalog(image)
+        elapsed = (time.perf_counter() - start) * 1000
+        
+        if len(catalog['x']) != 40 or np.any(np.diff(catalog['peak']) > 0):
+            print("✗ 未按亮度选出最亮的星点")
+            return False
+        
+        truth = np.column_stack([xs, ys])
+        found = np.column_stack([catalog['x'], catalog['y']])
+        error = np.linalg.norm(found[:, None] - truth[None], axis=2).min(axis=1)
+        # 个别相邻星点会合并为一个连通域
+        accurate = int(np.sum(error < 0.1))
+        if accurate < len(found) - 2:
+            print(f"✗ 质心误差过大 (误差小于0.1px的只有 {accurate}/{len(found)} 个)")
+            return False
+        print(f"✓ 检测到最亮的 {len(found)} 个星点，{accurate} 个质心误差小于0.1px，耗时 {elapsed:.1f}ms")
+        
+        # 只在外接框内标记的结果与整幅图像的连通域标记一致（包括外接框互相重叠的相邻星点）
+        # L形连通域的外接框内有另一个星点
+        gray[96:111, 500] = 255
+        gray[110, 500:515] = 255
+        gray[97:100, 510:513] = 255
+        image = np.dstack([gray, gray, gray])
+        stacker.alignment_params['max_features'] = 1000
+        catalog = stacker.detect_star_catalog(image)
+        params = stacker.star_detection_params
+        sigma = params['gaussian_blur']
+        ksize = 2 * int(3 * sigma) + 1
+        blurred = cv2.GaussianBlur(gray, (ksize, ksize), sigma)
+        _, thresh = cv2.threshold(blurred, params['threshold'], 255, cv2.THRESH_BINARY)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(thresh, connectivity=8)
+        weights = np.where(labels > 0, blurred.astype(np.float64) - params['threshold'], 0).ravel()
+        total = np.bincount(labels.ravel(), weights, count)
+        ref_x = np.bincount(labels.ravel(), weights * np.tile(np.arange(w), h), count) / np.maximum(total, 1e-9)
+        ref_y = np.bincount(labels.ravel(), weights * np.repeat(np.arange(h), w), count) / np.maximum(total, 1e-9)
+        areas = stats[:, cv2.CC_STAT_AREA]
+        ref = np.flatnonzero((areas >= params['min_area']) & (areas <= params['max_area']) & (total > 0))
+        ref = ref[ref > 0]
+        expected = sorted(zip(areas[ref].tolist(), np.round(ref_x[ref], 6).tolist(), np.round(ref_y[ref], 6).tolist()))
+        measured = sorted(zip(catalog['area'].tolist(), np.round(catalog['x'], 6).tolist(),
+                              np.round(catalog['y'], 6).tolist()))
+        if catalog['count'] != len(ref) or measured != expected:
+            print(f"✗ 外接框内的测量与整幅图像的连通域标记不一致 ({catalog['count']} / {len(ref)})")
+            return False
+        print(f"✓ {len(ref)} 个连通域的面积和质心与整幅图像的连通域标记一致")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 星点检测测试失败: {e}")
+        return False
+
+def test_star_matching():
+    """测试向量化星点匹配与暴力匹配一致"""
+    print("\n测试星点匹配...")
+    
+    try:
+        import time
+        import numpy as np
+        from src.modules.stacking import matching
+        
+        rng = np.random.default_rng(1)
+        ref = rng.uniform(0, 4000, size=(1000, 2))
+        cur = ref + np.array([12.5, -7.25]) + rng.normal(0, 0.3, size=ref.shape)
+        
+        # 不做比值和互为最近邻检验时应与参考实现完全一致
+        expected = matching.match_stars_bruteforce(ref[:200], cur[:200], max_distance=100)
+        result = matching.match_nearest_neighbors(ref[:200], cur[:200], max_distance=100,
+                                                  ratio=1.0, mutual=False)
+        if [tuple(m) for m in result.tolist()] != expected:
+            print("✗ 向量化匹配结果与暴力匹配不一致")
+            return False
+        print("✓ 向量化匹配结果与暴力匹配一致")
+        
+        start = time.perf_counter()
+        result = matching.match_nearest_neighbors(ref, cur, max_distance=100, ratio=0.7)
+        elapsed = (time.perf_counter() - start) * 1000
+        correct = int(np.sum(result[:, 0] == result[:, 1]))
+        if correct < 850:
+            print(f"✗ 1000星点匹配错误 (正确 {correct}/{len(result)} 对)")
+            return False
+        print(f"✓ 1000星点匹配正确 {correct}/{len(result)} 对，耗时 {elapsed:.1f}ms")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 星点匹配测试失败: {e}")
+        return False
+
+def test_asterism_matching():
+    """测试星组匹配在旋转和大位移下的对齐"""
+    print("\n测试星组匹配...")
+    
+    try:
+        import numpy as np
+        from src.modules.stacking.processor import AstroStacker
+        
+        rng = np.random.default_rng(3)
+        ref = rng.uniform(0, 3000, size=(500, 2))
+        angle = np.deg2rad(35)
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        cur = (ref - 1500) @ rotation.T + 1500 + np.array([220, -140])
+        
+        # 丢失部分星点并混入干扰点
+        keep = rng.random(len(cur)) > 0.15
+        cur = np.vstack([cur[keep], rng.uniform(0, 3000, size=(60, 2))])
+        
+        stacker = AstroStacker()
+        matrix = stacker.match_stars([tuple(p) for p in ref], [tuple(p) for p in cur])
+        if matrix is None:
+            print("✗ 星组匹配未找到变换")
+            return False
+        
+        # 变换矩阵把当前帧映射回参考帧
+        mapped = cur[:10] @ matrix[:, :2].T + matrix[:, 2]
+        error = np.abs(mapped - ref[keep][:10]).max()
+        if error > 0.5:
+            print(f"✗ 星组匹配变换误差过大: {error:.3f}px")
+            return False
+        print(f"✓ 旋转35°并位移260px的帧对齐成功 (误差 {error:.3f}px)")
+        
+        stacker.set_alignment_params(matcher='nearest')
+        matrix = stacker.match_stars([tuple(p) for p in ref], [tuple(p) for p in cur])
+        if matrix is not None and np.abs(cur[:10] @ matrix[:, :2].T + matrix[:, 2] - ref[keep][:10]).max() < 0.5:
+            print("✗ 最近邻匹配不应在该位移下成功")
+            return False
+        print("✓ 最近邻匹配在大位移下失败，符合预期")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 星组匹配测试失败: {e}")
+        return False
+
+def make_warped_frames(count=4, size=(600, 800), seed=5):
+    """由同一星空生成带亚像素平移和小角度旋转的图像，返回 (图像列表, 真实变换列表)"""
+    import numpy as np
+    import cv2
+    
+    h, w = size
+    base = make_star_frames(count=1, size=size, num_stars=h * w // 3000)[0]
+    rng = np.random.default_rng(seed)
+    frames, truths = [base], [np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float64)]
+    for _ in range(count - 1):
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-0.5, 0.5), 1.0)
+        matrix[:, 2] += rng.uniform(-30, 30, 2)
+        frames.append(cv2.warpAffine(base, matrix, (w, h), flags=cv2.INTER_CUBIC))
+        truths.append(cv2.invertAffineTransform(matrix))
+    return frames, truths
+
+def transform_error(matrix, truth, size):
+    """两个变换在图像四角和中心处的最大位置差"""
+    import numpy as np
+    
+    h, w = size
+    points = np.array([[0, 0], [w, 0], [0, h], [w, h], [w / 2, h / 2]], dtype=np.float64)
+    return np.abs(points @ matrix[:, :2].T + matrix[:, 2] - (points @ truth[:, :2].T + truth[:, 2])).max()
+
+def test_pyramid_registration():
+    """测试金字塔配准只在降采样图像上检测星点且精度与全分辨率一致"""
+    print("\n测试金字塔配准...")
+    
+    try:
+        from src.modules.stacking.processor import AstroStacker
+        
+        size = (600, 800)
+        frames, truths = make_warped_frames(count=4, size=size)
+        
+        stacker = AstroStacker()
+        stacker.set_alignment_params(registration='pyramid')
+        load_frames_into(stacker, frames)
+        
+        full_detections = []
+        original = stacker.detect_frame
+        stacker.detect_frame = lambda image: full_detections.append(1) or original(image)
+        if not stacker.align_images() or len(stacker.transforms) != len(frames):
+            print("✗ 金字塔配准失败")
+            return False
+        if len(full_detections) != 1:
+            print(f"✗ 全分辨率星点检测了 {len(full_detections)} 次，应只检测参考图像")
+            return False
+        
+        error = max(transform_error(stacker.transforms[i], truths[i], size) for i in range(len(frames)))
+        if error > 0.1:
+            print(f"✗ 金字塔配准误差过大: {error:.3f}px")
+            return False
+        print(f"✓ 金字塔配准只检测了参考图像的全分辨率星点 (最大误差 {error:.3f}px)")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 金字塔配准测试失败: {e}")
+        return False
+
+def test_phase_registration():
+    """测试相位相关配准平移序列，旋转帧改用星点匹配，星点太少的帧不再被丢弃"""
+    print("\n测试相位相关配准...")
+    
+    try:
+        import numpy as np
+        import cv2
+        from src.modules.stacking.processor import AstroStacker
+        
+        h, w = size = (600, 800)
+        base = make_star_frames(count=1, size=size, num_stars=160)[0]
+        rng = np.random.default_rng(2)
+        frames, truths = [base], [np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float64)]
+        for _ in range(3):
+            matrix = np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float64)
+            matrix[:, 2] = rng.uniform(-40, 40, 2)
+            frames.append(cv2.warpAffine(base, matrix, (w, h), flags=cv2.INTER_CUBIC))
+            truths.append(cv2.invertAffineTransform(matrix))
+        rotation = cv2.getRotationMatrix2D((w / 2, h / 2), 3, 1.0)
+        frames.append(cv2.warpAffine(base, rotation, (w, h), flags=cv2.INTER_CUBIC))
+        truths.append(cv2.invertAffineTransform(rotation))
+        
+        stacker = AstroStacker()
+        stacker.set_alignment_params(registration='phase')
+        load_frames_into(stacker, frames)
+        matches = []
+        original = stacker.match_stars
+        stacker.match_stars = lambda *args, **kwargs: matches.append(1) or original(*args, **kwargs)
+        if not stacker.align_images() or len(stacker.transforms) != len(frames):
+            print("✗ 相位相关配准失败")
+            return False
+        error = max(transform_error(stacker.transforms[i], truths[i], size) for i in range(len(frames)))
+        if len(matches) != 1 or error > 0.2:
+            print(f"✗ 星点匹配 {len(matches)} 次 (应只有旋转帧)，最大误差 {error:.3f}px")
+            return False
+        print(f"✓ 平移帧由相位相关配准，旋转帧改用星点匹配 (最大误差 {error:.3f}px)")
+        
+        # 星点太少的暗帧在星点匹配模式下由相位相关配准
+        dim = (frames[1].astype(np.float32) * 0.25).astype(np.uint8)
+        stacker = AstroStacker()
+        load_frames_into(stacker, [frames[0], dim])
+        if len(stacker.detect_stars(dim)) >= 10 or not stacker.align_images():
+            print("✗ 星点太少的帧未能对齐")
+            return False
+        error = transform_error(stacker.transforms[1], truths[1], size)
+        if error > 1.0:
+            print(f"✗ 暗帧相位相关误差过大: {error:.3f}px")
+            return False
+        print(f"✓ 星点太少的帧由相位相关对齐 (误差 {error:.3f}px)")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 相位相关配准测试失败: {e}")
+        return False
+
+def test_predictive_registration():
+    """测试累计漂移超过匹配半径的序列可由前几帧的变换预测对齐，且跳过RANSAC"""
+    print("\n测试预测配准...")
+    
+    try:
+        import numpy as np
+        import cv2
+        from src.modules.stacking.processor import AstroStacker
+        
+        h, w = size = (600, 800)
+        base = make_star_frames(count=1, size=size, num_stars=160)[0]
+        frames, truths = [], []
+        for k in range(10):
+            # 匀速漂移，最后一帧累计约 (126, -72) 像素
+            matrix = np.array([[1, 0, 14.0 * k], [0, 1, -8.0 * k]], dtype=np.float64)
+            frames.append(cv2.warpAffine(base, matrix, (w, h), flags=cv2.INTER_CUBIC))
+            truths.append(cv2.invertAffineTransform(matrix))
+        
+        stacker = AstroStacker()
+        stacker.set_alignment_params(matcher='nearest', predictive=False)
+        load_frames_into(stacker, frames)
+        stacker.align_images()
+        failed = [i for i in range(len(frames))
+                  if i not in stacker.transforms or transform_error(stacker.transforms[i], truths[i], size) > 1.0]
+        if not failed:
+            print("✗ 未启用预测时漂移超过匹配半径的帧不应对齐")
+            return False
+        print(f"✓ 未启用预测: 第 {failed} 帧对齐失败或错误")
+        
+        stacker = AstroStacker()
+        stacker.set_alignment_params(matcher='nearest')
+        load_frames_into(stacker, frames)
+        ransac = []
+        original = stacker.estimate_transform
+        stacker.estimate_transform = lambda *args: ransac.append(1) or original(*args)
+        if not stacker.align_images() or len(stacker.transforms) != len(frames):
+            print(f"✗ 预测配准只对齐了 {len(stacker.transforms)}/{len(frames)} 帧")
+            return False
+        error = max(transform_error(stacker.transforms[i], truths[i], size) for i in range(len(frames)))
+        # 只有第二帧没有可靠的漂移模型（小半径匹配和完整匹配各一次RANSAC）
+        if len(ransac) > 2 or error > 0.2:
+            print(f"✗ RANSAC调用 {len(ransac)} 次，最大误差 {error:.3f}px")
+            return False
+        print(f"✓ 预测配准对齐全部 {len(frames)} 帧，RANSAC调用 {len(ransac)} 次 (最大误差 {error:.3f}px)")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 预测配准测试失败: {e}")
+        return False
+
+def test_parallel_alignment():
+    """测试并行对齐与顺序对齐结果一致"""
+    print("\n测试并行对齐...")
+    
+    try:
+        import numpy as np
+        from src.modules.stacking.processor import AstroStacker
+        
+        frames = make_star_frames(count=8)
+        
+        # 并行对齐不使用预测配准，与不预测的顺序对齐比较
+        sequential = AstroStacker()
+        sequential.set_alignment_params(predictive=False)
+        load_frames_into(sequential, frames)
+        if not sequential.align_images():
+            print("✗ 顺序对齐失败")
+            return False
+        
+        for executor in ('thread', 'process'):
+            progress = []
+            stacker = AstroStacker()
+            stacker.set_alignment_params(workers=3, executor=executor)
+            stacker.progress_callback = lambda message, value: progress.append(value)
+            load_frames_into(stacker, frames)
+            if not stacker.align_images():
+                print(f"✗ {executor} 并行对齐失败")
+                return False
+            
+            if list(stacker.transforms) != list(sequential.transforms):
+                print(f"✗ {executor} 并行对齐的帧顺序不一致")
+                return False
+            for i, matrix in sequential.transforms.items():
+                if not np.allclose(stacker.transforms[i], matrix):
+                    print(f"✗ {executor} 并行对齐的变换矩阵不一致")
+                    return False
+            if progress != sorted(progress):
+                print(f"✗ {executor} 并行对齐进度不是单调递增")
+                return False
+            print(f"✓ {executor} 并行对齐结果与顺序对齐一致，进度单调")
+
+        # 并行对齐不使用预测，变换缓存的参数与预测开关无关
+        if stacker.alignment_cache_params() != sequential.alignment_cache_params():
+            print("✗ 并行对齐的变换缓存参数不应包含预测参数")
+            return False
+        print("✓ 并行对齐的变换缓存参数不包含预测参数")
+
+        # 处理过程中取消
+        stacker = AstroStacker()
+        stacker.set_alignment_params(workers=2)
+        load_frames_into(stacker, frames)
+        def cancel_after_two(message, value):
+            if len(stacker.transforms) >= 2:
+                stacker.cancel_processing()
+        stacker.progress_callback = cancel_after_two
+        if stacker.align_images() or len(stacker.transforms) >= len(frames):
+            print("✗ 并行对齐未能取消")
+            return False
+        print("✓ 并行对齐可以取消")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 并行对齐测试失败: {e}")
+        return False
+
+def save_frames(frames, directory):
+    """将图像保存为PNG文件，返回路径列表"""
+    from PIL import Image
+    
+    paths = []
+    for i, frame in enumerate(frames):
+        path = os.path.join(directory, f"frame_{i:03d}.png")
+        Image.fromarray(frame).save(path)
+        paths.append(path)
+    return paths
+
+def test_pipelined_stacking():
+    """测试流水线堆叠与逐阶段堆叠结果一致，且在途帧数有界"""
+    print("\n测试流水线堆叠...")
+    
+    try:
+        import tempfile
+        import threading
+        import time
+        import numpy as np
+        from src.modules.stacking.processor import AstroStacker
+        from src.modules.stacking.pipeline import FramePipeline
+        
+        # 在途帧数不应超过流水线深度
+        state = {'loaded': 0, 'consumed': 0, 'peak': 0}
+        lock = threading.Lock()
+        def load(i, item):
+            with lock:
+                state['loaded'] += 1
+                state['peak'] = max(state['peak'], state['loaded'] - state['consumed'])
+            return item
+        def slow(i, item):
+            time.sleep(0.002)
+            return None if item % 7 == 3 else item * 2
+        
+        pipeline = FramePipeline([('load', load, 1), ('slow', slow, 3)], max_in_flight=4)
+        results = []
+        for index, value in pipeline.run(range(40)):
+            results.append((index, value))
+            with lock:
+                # 被丢弃的帧在其后的帧产出前已经释放
+                state['consumed'] = index + 1
+        expected = [(i, i * 2) for i in range(40) if i % 7 != 3]
+        if results != expected or state['peak'] > 4 + 1:
+            print(f"✗ 流水线结果或在途帧数错误 (峰值 {state['peak']})")
+            return False
+        print(f"✓ 流水线按顺序输出，在途帧数峰值 {state['peak']}")
+        
+        frames = make_star_frames(count=8)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = save_frames(frames, directory)
+            
+            for method in ('average', 'sigma_clip', 'median'):
+                # 流水线中各帧独立配准，与不预测的顺序对齐比较
+                memory_stacker = AstroStacker()
+                memory_stacker.set_stacking_params(method=method)
+                memory_stacker.set_alignment_params(predictive=False)
+                memory_stacker.load_images(paths)
+                memory_stacker.align_images()
+                expected = memory_stacker.stack_images()
+                
+                stacker = AstroStacker()
+                stacker.set_stacking_params(method=method, pipeline=True, pipeline_depth=3)
+                stacker.set_alignment_params(workers=2)
+                result = stacker.stack_images_pipelined(paths)
+                
+                if result is None or stacker.images:
+                    print(f"✗ {method} 流水线堆叠失败")
+                    return False
+                diff = np.abs(result.astype(np.int16) - expected.astype(np.int16)).max()
+                if diff > 1 or len(stacker.transforms) != len(memory_stacker.transforms):
+                    print(f"✗ {method} 流水线堆叠结果不一致 (最大差异 {diff})")
+                    return False
+                print(f"✓ {method} 流水线堆叠结果一致 (最大差异 {diff})")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 流水线堆叠测试失败: {e}")
+        return False
+
+def test_frame_quality():
+    """测试帧质量指标、配准前按质量排除帧以及质量加权平均"""
+    print("\n测试帧质量评估...")
+    
+    try:
+        import numpy as np
+        import cv2
+        from src.modules.stacking.processor import AstroStacker
+        
+        rng = np.random.default_rng(4)
+        frames = make_star_frames(count=8, num_stars=120)
+        # 第2帧有薄云（星点变暗、背景变亮且噪声不减），第5帧跟踪失误产生拖线
+        hazed = frames[2].astype(np.float32) * 0.45 + 25 + rng.normal(0, 3, size=frames[2].shape[:2])[..., None]
+        frames[2] = np.clip(hazed, 0, 255).astype(np.uint8)
+        trail = np.zeros((1, 9), dtype=np.float32)
+        trail[0] = 1 / 9
+        frames[5] = cv2.filter2D(frames[5], -1, trail)
+        
+        stacker = AstroStacker()
+        stacker.set_stacking_params(quality_reject=0.25)
+        load_frames_into(stacker, frames)
+        warped, detections = [], []
+        original = stacker.warp_frame
+        stacker.warp_frame = lambda image, *args: warped.append(1) or original(image, *args)
+        original_detect = stacker.detect_frame
+        stacker.detect_frame = lambda image: detections.append(1) or original_detect(image)
+        if not stacker.align_images():
+            print("✗ 按质量排除帧后对齐失败")
+            return False
+        if len(detections) != len(frames) or stacker.assessed_stars:
+            print(f"✗ 评估质量时检测的星点应在配准时复用，实际检测 {len(detections)} 次")
+            return False
+        
+        info = stacker.get_stacking_info()
+        report = {entry['index']: entry for entry in info['frame_quality']}
+        clean = [report[i] for i in (1, 3, 4, 6, 7)]
+        if (info['rejected_frames'] != [2, 5] or 2 in stacker.transforms or 5 in stacker.transforms or
+                len(warped) != len(frames) - 3):
+            print(f"✗ 应在变换前排除第2、5帧，实际排除 {info['rejected_frames']}，变换 {len(warped)} 次")
+            return False
+        if (report[5]['fwhm'] <= max(q['fwhm'] for q in clean) or
+                report[2]['flux'] >= min(q['flux'] for q in clean) or
+                report[2]['background'] <= max(q['background'] for q in clean)):
+            print(f"✗ 质量指标未反映薄云和拖线: {report[2]}, {report[5]}")
+            return False
+        print(f"✓ 配准前排除薄云和拖线帧 {info['rejected_frames']}，每帧只检测一次星点 "
+              f"(FWHM {report[5]['fwhm']:.1f} / {clean[0]['fwhm']:.1f}，"
+              f"星点亮度 {report[2]['flux']:.0f} / {clean[0]['flux']:.0f})")
+        
+        # 质量加权：内存模式与流式累加结果一致，且等于按权重的加权平均
+        results = {}
+        for engine in ('memory', 'streaming'):
+            weighted = AstroStacker()
+            weighted.set_stacking_params(engine=engine, quality_weighting=True)
+            load_frames_into(weighted, frames)
+            if engine == 'memory':
+                if not weighted.align_images():
+                    print("✗ 质量加权对齐失败")
+                    return False
+                results[engine] = weighted.stack_images()
+                weights = weighted.stack_weights()
+                aligned = np.array(weighted.aligned_images, dtype=np.float32)
+                expected = (aligned * weights[:, None, None, None]).sum(axis=0) / weights.sum()
+            else:
+                results[engine] = weighted.stack_images_streaming()
+        
+        if weights[2] > 0.5 or weights[5] > 0.5 or min(weights[i] for i in (0, 1, 3, 4, 6, 7)) < 0.5:
+            print(f"✗ 质量较差的帧权重不低: {np.round(weights, 2)}")
+            return False
+        differences = [np.abs(result.astype(np.float32) - expected).max() for result in results.values()]
+        if max(differences) > 1:
+            print(f"✗ 质量加权结果不一致 (最大差异 {max(differences):.2f})")
+            return False
+        print(f"✓ 质量加权平均在内存和流式模式下一致，权重 {', '.join(f'{w:.2f}' for w in weights)}")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 帧质量评估测试失败: {e}")
+        return False
+
+def test_preview_triage():
+    """测试按预览图预检，在全分辨率解码前排除过亮、模糊和无星点的帧"""
+    print("\n测试堆叠前预检...")
+    
+    try:
+        import tempfile
+        import numpy as np
+        import cv2
+        from src.modules.stacking.processor import AstroStacker
+        
+        rng = np.random.default_rng(5)
+        frames = make_star_frames(count=8, num_stars=120)
+        # 第2帧被车灯照亮，第4帧跑焦，第6帧被云层完全遮挡
+        frames[2] = np.clip(frames[2].astype(np.float32) + 150, 0, 255).astype(np.uint8)
+        frames[4] = cv2.GaussianBlur(frames[4], (0, 0), 1.5)
+        clouds = np.clip(rng.normal(12, 3, size=frames[6].shape[:2]), 0, 255).astype(np.uint8)
+        frames[6] = np.dstack([clouds, clouds, clouds])
+        
+        with tempfile.TemporaryDirectory() as directory:
+            paths = save_frames(frames, directory)
+            stacker = AstroStacker()
+            stacker.set_cache_params(enabled=False)
+            stacker.set_triage_params(enabled=True)
+            decoded = []
+            original = stacker.decode_frame
+            stacker.decode_frame = lambda path: decoded.append(path) or original(path)
+            
+            progress = []
+            result = stacker.process_stack(paths, progress_callback=lambda message, value: progress.append(
+                (message, value)))
+            excluded = [i for i, d in enumerate(stacker.triage_results) if d['excluded']]
+            if result is None or excluded != [2, 4, 6]:
+                print(f"✗ 预检应排除第2、4、6帧，实际排除 {excluded}")
+                return False
+            if stacker.triage_results[2]['reason'] != 'bright':
+                print(f"✗ 过亮帧的排除原因错误: {stacker.triage_results[2]['reason']}")
+                return False
+            if any(paths[i] in decoded for i in excluded) or stacker.image_paths != [
+                    path for i, path in enumerate(paths) if i not in excluded]:
+                print("✗ 被排除的帧仍被完整解码或参与堆叠")
+                return False
+            print(f"✓ 预检排除 {excluded}，原因 {[stacker.triage_results[i]['reason'] for i in excluded]}，"
+                  f"被排除的帧未完整解码")
+            
+            triage_progress = [value for message, value in progress if message.startswith("预检图像")]
+            if triage_progress != sorted(triage_progress) or triage_progress[-1] != 100:
+                print(f"✗ 预检进度应递增到100: {triage_progress}")
+                return False
+            print("✓ 预检进度按已评估的帧数递增")
+            
+            # 重新堆叠使用缓存的预检评分，决定不变时复用已加载的图像
+            decoded.clear()
+            if stacker.restack(paths) is None or decoded:
+                print("✗ 预检后重新堆叠未复用已加载的图像")
+                return False
+            print("✓ 预检后重新堆叠复用已加载的图像")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 堆叠前预检测试失败: {e}")
+        return False
+
+def test_raw_ingestion():
+    """测试RAW解码进程池的规划以及解码参数对缓存键和重新堆叠的影响"""
+    print("\n测试RAW解码...")
+    
+    try:
+        import tempfile
+        from src.modules.stacking.processor import AstroStacker, RAW_SUPPORT, validate_images_for_stacking
+        
+        stacker = AstroStacker()
+        stacker.set_raw_params(workers=4)
+        raw_paths = [f"IMG_{i:04d}.CR2" for i in range(6)]
+        if (stacker.decode_workers(raw_paths) != 4 or stacker.decode_workers(raw_paths[:1]) != 0 or
+                stacker.decode_workers(["a.png", "b.tif"]) != 0):
+            print("✗ RAW解码进程数规划错误")
+            return False
+        stacker.set_raw_params(workers=1)
+        if stacker.decode_workers(raw_paths) != 0:
+            print("✗ 单进程解码时不应创建进程池")
+            return False
+        print("✓ 只有多个RAW文件时才使用解码进程池")
+        
+        # 默认解码参数不改变缓存键；半尺寸或线性去马赛克只用于配准，
+        # 在缩小解码的配准帧上配准时星点和变换缓存失效，主校准帧和堆叠仍全分辨率解码
+        default_keys = (stacker.detection_cache_params(), stacker.master_params())
+        if any('raw' in keys for keys in default_keys):
+            print("✗ 默认RAW解码参数改变了缓存键")
+            return False
+        full_options = stacker.raw_decode_options()
+        stacker.set_raw_params(half_size=True, demosaic='linear')
+        if (stacker.master_params() != default_keys[1] or stacker.raw_decode_options() != full_options or
+                stacker.detection_cache_params() != default_keys[0]):
+            print("✗ 配准解码参数影响了主校准帧或堆叠的解码")
+            return False
+        stacker.proxy_frames = 'raw'
+        if (stacker.detection_cache_params() == default_keys[0] or
+                not stacker.raw_decode_options(registration=True)['half_size']):
+            print("✗ 配准解码参数变化后星点缓存键未变化")
+            return False
+        print("✓ 配准解码参数只参与配准帧的星点缓存键，主校准帧和堆叠仍全分辨率解码")
+        
+        # 在半尺寸配准帧上配准，结果仍为全分辨率且与全分辨率配准一致
+        import numpy as np
+        import cv2
+        frames = make_star_frames(count=4, size=(480, 640), num_stars=150)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = save_frames(frames, directory)
+            full = AstroStacker()
+            full.set_cache_params(enabled=False)
+            expected = full.process_stack(paths)
+            
+            proxy = AstroStacker()
+            proxy.set_cache_params(enabled=False)
+            proxy.set_raw_params(half_size=True)
+            proxy.load_raw_proxy = lambda path: cv2.resize(proxy.decode_frame(path), (320, 240),
+                                                           interpolation=cv2.INTER_AREA)
+            result = proxy.stack_images_proxy(paths, 'raw')
+            if result is None or proxy.finish_result(result).shape != expected.shape:
+                print("✗ 半尺寸配准后的堆叠结果不是全分辨率")
+                return False
+            errors = [np.abs(proxy.transforms[i] - full.transforms[i]).max() for i in full.transforms]
+            if max(errors) > 0.2:
+                print(f"✗ 半尺寸配准换算后的变换与全分辨率配准不一致 (最大差异 {max(errors):.3f})")
+                return False
+            print(f"✓ 半尺寸配准后以全分辨率堆叠 (变换最大差异 {max(errors):.3f} 像素)")
+        
+        if not RAW_SUPPORT:
+            # 没有rawpy时RAW文件应给出明确的错误而不是异常
+            with tempfile.TemporaryDirectory() as directory:
+                paths = []
+                for name in raw_paths[:2]:
+                    paths.append(os.path.join(directory, name))
+                    open(paths[-1], 'wb').close()
+                valid, message = validate_images_for_stacking(paths)
+                if valid or AstroStacker().process_stack(paths) is not None:
+                    print("✗ 未安装rawpy时RAW文件应验证失败")
+                    return False
+            print("✓ 未安装rawpy时RAW文件验证失败 (rawpy 未安装，跳过RAW解码)")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ RAW解码测试失败: {e}")
+        return False
+
+def test_cfa_registration():
+    """测试在拜耳阵列绿色平面上配准，换算后的变换与全分辨率配准一致，且每帧只去马赛克一次"""
+    print("\n测试拜耳阵列配准...")
+    
+    try:
+        import tempfile
+        import numpy as np
+        import cv2
+        from src.modules.stacking.processor import AstroStacker, scale_transform
+        
+        # 带旋转的序列，检验平面坐标到全分辨率坐标的偏移换算
+        base = make_star_frames(count=1, size=(480, 640), num_stars=150)[0]
+        frames = [base]
+        for k in range(1, 4):
+            matrix = cv2.getRotationMatrix2D((320, 240), 0.3 * k, 1.0)
+            matrix[:, 2] += (2.3 * k, -1.7 * k)
+            frames.append(cv2.warpAffine(base, matrix, (640, 480)))
+        
+        def green_plane(image):
+            # RGGB阵列中两个绿色像素的平均
+            green = image[..., 1].astype(np.float32)
+            return ((green[0::2, 1::2] + green[1::2, 0::2]) / 2 + 0.5).astype(np.uint8)
+        
+        with tempfile.TemporaryDirectory() as directory:
+            paths = save_frames(frames, directory)
+            
+            full = AstroStacker()
+            full.set_cache_params(enabled=False)
+            expected = full.process_stack(paths)
+            
+            stacker = AstroStacker()
+            stacker.set_cache_params(enabled=False)
+            stacker.load_cfa_plane = lambda path: green_plane(stacker.decode_frame(path))
+            decoded = []
+            original = stacker.load_frame
+            stacker.load_frame = lambda path: decoded.append(path) or original(path)
+            result = stacker.stack_images_proxy(paths, 'cfa')
+            if result is None:
+                print("✗ 绿色平面配准堆叠失败")
+                return False
+            
+            errors = [np.abs(stacker.transforms[i] - full.transforms[i]).max() for i in full.transforms]
+            if max(errors) > 0.1:
+                print(f"✗ 换算后的变换与全分辨率配准不一致 (最大差异 {max(errors):.3f})")
+                return False
+            unscaled = np.abs(scale_transform(np.array([[1, 0, 1.0], [0, 1, 1.0]]), 2) -
+                              np.array([[1, 0, 2.0], [0, 1, 2.0]])).max()
+            if unscaled > 1e-9:
+                print("✗ 纯平移的换算错误")
+                return False
+            if sorted(decoded) != sorted(paths):
+                print(f"✗ 每帧应只去马赛克一次，实际 {len(decoded)} 次")
+                return False
+            difference = np.abs(stacker.finish_result(result).astype(np.int16) - expected.astype(np.int16))
+            if np.percentile(difference, 99.9) > 8:
+                print(f"✗ 绿色平面配准的堆叠结果与全分辨率配准差异过大")
+                return False
+            print(f"✓ 绿色平面配准换算后与全分辨率一致 (最大差异 {max(errors):.3f} 像素)，每帧只去马赛克一次")
+            
+            # 流式Sigma裁剪需要多遍，变换后的帧在第一遍写入磁盘映射存储，之后各遍不再去马赛克
+            for stacker_ in (full, stacker):
+                stacker_.set_stacking_params(method='sigma_clip', engine='streaming')
+            expected = full.restack(paths)
+            decoded.clear()
+            result = stacker.stack_transformed()
+            if result is None or sorted(decoded) != sorted(paths[1:]):
+                print(f"✗ 多遍Sigma裁剪时每帧应只去马赛克一次，实际 {len(decoded)} 次")
+                return False
+            difference = np.abs(stacker.finish_result(result).astype(np.int16) - expected.astype(np.int16))
+            if np.percentile(difference, 99.9) > 8:
+                print("✗ 多遍Sigma裁剪的结果与全分辨率配准差异过大")
+                return False
+            print("✓ 多遍Sigma裁剪时每帧仍只去马赛克一次")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 拜耳阵列配准测试失败: {e}")
+        return False
+
+def test_frame_handles():
+    """测试帧句柄按需解码、帧缓存按字节预算淘汰，且缓存大小不影响堆叠结果"""
+    print("\n测试帧句柄...")
+    
+    try:
+        import tempfile
+        import numpy as np
+        from src.modules.stacking.frames import FrameCache, FrameHandle
+        from src.modules.stacking.processor import AstroStacker
+        
+        # LRU淘汰：预算只能容纳两帧
+        frame = np.zeros((100, 100, 3), dtype=np.uint8)
+        cache = FrameCache(budget_mb=2.5 * frame.nbytes / 1024 ** 2)
+        decodes = []
+        handles = [FrameHandle(f"f{i}", lambda path: decodes.append(path) or frame.copy(), cache)
+                   for i in range(3)]
+        for handle in handles + handles[2:] + handles[:1]:
+            handle.image
+        if decodes != ['f0', 'f1', 'f2', 'f0'] or len(cache) != 2 or cache.nbytes > cache.budget:
+            print(f"✗ 帧缓存淘汰顺序错误: {decodes}")
+            return False
+        if handles[1].shape != frame.shape or hasattr(handles[1], '__dict__'):
+            print("✗ 帧句柄应记录尺寸且不带实例字典")
+            return False
+        print("✓ 帧缓存按字节预算淘汰最久未使用的帧")
+        
+        frames = make_star_frames(count=6)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = save_frames(frames, directory)
+            results = {}
+            for budget in (1024, 0.5):
+                stacker = AstroStacker()
+                stacker.set_cache_params(enabled=False)
+                stacker.set_stacking_params(engine='streaming', method='sigma_clip', frame_cache_mb=budget)
+                loads = []
+                original = stacker.load_frame
+                stacker.load_frame = lambda path: loads.append(path) or original(path)
+                results[budget] = stacker.process_stack(paths)
+                if results[budget] is None:
+                    print(f"✗ 帧缓存 {budget}MB 时堆叠失败")
+                    return False
+                if not all(isinstance(handle, FrameHandle) for handle in stacker.images):
+                    print("✗ self.images 应只保存帧句柄")
+                    return False
+                if stacker.frame_cache.nbytes > budget * 1024 ** 2:
+                    print("✗ 帧缓存超出预算")
+                    return False
+                if budget == 1024 and len(loads) != len(paths):
+                    print(f"✗ 缓存足够时每帧应只解码一次，实际 {len(loads)} 次")
+                    return False
+            
+            if not np.array_equal(results[1024], results[0.5]):
+                print("✗ 帧缓存大小影响了堆叠结果")
+                return False
+            print(f"✓ 小缓存时按需重新解码（{len(loads)} 次），结果与大缓存一致")
+            
+            # 加载时只解码参考图像，其余帧只读取文件头；文件头可读但数据损坏的帧在配准时按失败跳过
+            stacker = AstroStacker()
+            loads = []
+            original = stacker.load_frame
+            stacker.load_frame = lambda path: loads.append(path) or original(path)
+            if not stacker.load_images(paths) or loads != paths[:1]:
+                print(f"✗ 加载时应只解码参考图像，实际解码 {len(loads)} 张")
+                return False
+            if any(handle.shape != frames[0].shape or handle.dtype != np.uint8 for handle in stacker.images):
+                print("✗ 未解码的帧句柄应按文件头记录尺寸")
+                return False
+            
+            with open(paths[3], 'rb') as f:
+                data = f.read()
+            with open(paths[3], 'wb') as f:
+                f.write(data[:len(data) // 2])
+            for workers, executor in ((1, 'thread'), (2, 'thread'), (2, 'process')):
+                stacker = AstroStacker()
+                stacker.set_cache_params(enabled=False)
+                stacker.set_alignment_params(workers=workers, executor=executor)
+                if stacker.process_stack(paths) is None or 3 in stacker.transforms or len(stacker.transforms) != 5:
+                    print(f"✗ {workers} 个{executor}工作时对齐应跳过无法解码的帧")
+                    return False
+            print("✓ 加载时只解码参考图像，无法解码的帧在配准时跳过")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 帧句柄测试失败: {e}")
+        return False
+
+def test_shared_frame_transport():
+    """测试共享内存帧槽环的所有权交接，以及进程池经帧槽传输与pickle传输结果一致"""
+    print("\n测试共享内存帧传输...")
+    
+    try:
+        import os
+        from concurrent.futures import ProcessPoolExecutor
+        import numpy as np
+        from src.modules.stacking.processor import AstroStacker
+        from src.modules.stacking.transport import FrameRing, write_slot
+        
+        # spawn启动的进程池的信号量（sem.*）在工作进程退出后才删除，只检查帧槽的共享内存
+        segments = lambda: {name for name in os.listdir('/dev/shm') if not name.startswith('sem.')
+                            } if os.path.isdir('/dev/shm') else set()
+        before = segments()
+        
+        # 工作进程写入父进程取得的槽，尺寸不符的帧原样返回
+        frames = [np.full((60, 80, 3), k, dtype=np.uint16) for k in range(3)]
+        with FrameRing(2, frames[0].shape, frames[0].dtype) as ring, ProcessPoolExecutor(max_workers=2) as pool:
+            slots = [ring.acquire(), ring.acquire()]
+            results = list(pool.map(write_slot, [ring.spec] * 2, slots, frames[1:]))
+            if results != [None, None] or not all(np.array_equal(ring.view(slot), frame)
+                                                  for slot, frame in zip(slots, frames[1:])):
+                print("✗ 工作进程写入帧槽的内容不正确")
+                return False
+            if pool.submit(write_slot, ring.spec, slots[0], frames[0][:30]).result().shape != (30, 80, 3):
+                print("✗ 尺寸不符的帧应原样返回")
+                return False
+            ring.release(slots[0])
+            if ring.acquire(timeout=1) != slots[0]:
+                print("✗ 归还的帧槽未能再次取得")
+                return False
+        print("✓ 帧槽所有权在父进程和工作进程之间交接")
+        
+        frames = make_star_frames(count=8)
+        results = {}
+        for shared in (False, True):
+            stacker = AstroStacker()
+            stacker.set_cache_params(enabled=False)
+            stacker.set_alignment_params(workers=2, executor='process')
+            stacker.set_stacking_params(shared_memory=shared)
+            load_frames_into(stacker, frames)
+            if not stacker.align_images():
+                print(f"✗ {'共享内存' if shared else 'pickle'}传输时进程池对齐失败")
+                return False
+            if not all(aligned.flags.owndata for aligned in stacker.aligned_images):
+                print("✗ 保留的对齐图像不应引用帧槽")
+                return False
+            results[shared] = (stacker.aligned_images, stacker.stack_images_streaming())
+        
+        if len(results[True][0]) != len(results[False][0]) or not all(
+                np.array_equal(a, b) for a, b in zip(results[True][0], results[False][0])):
+            print("✗ 共享内存传输的对齐图像与pickle传输不一致")
+            return False
+        if results[True][1] is None or not np.array_equal(results[True][1], results[False][1]):
+            print("✗ 共享内存传输的流式堆叠结果与pickle传输不一致")
+            return False
+        if segments() != before:
+            print("✗ 共享内存未删除")
+            return False
+        print("✓ 共享内存传输的对齐和流式堆叠结果与pickle传输一致，共享内存已删除")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 共享内存帧传输测试失败: {e}")
+        return False
+
+def test_star_cache():
+    """测试重复对齐时读取星点缓存而不重新检测"""
+    print("\n测试星点缓存...")
+    
+    try:
+        import tempfile
+        from src.modules.stacking.processor import AstroStacker
+        
+        frames = make_star_frames(count=4)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = save_frames(frames, directory)
+            
+            def count_detections(stacker):
+                calls = []
+                original = stacker.detect_frame
+                stacker.detect_frame = lambda image: calls.append(1) or original(image)
+                stacker.load_images(paths)
+                stacker.align_images()
+                return len(calls), dict(stacker.transforms)
+            
+            first_calls, first_transforms = count_detections(AstroStacker())
+            second_calls, second_transforms = count_detections(AstroStacker())
+            if first_calls != len(paths) or second_calls != 0:
+                print(f"✗ 星点缓存未命中 (首次检测 {first_calls} 次，再次检测 {second_calls} 次)")
+                return False
+            if list(first_transforms) != list(second_transforms):
+                print("✗ 使用缓存后对齐结果不一致")
+                return False
+            print("✓ 再次对齐时跳过了全部星点检测")
+            
+            # 检测参数变化后需要重新检测
+            stacker = AstroStacker()
+            stacker.set_star_detection_params(threshold=45)
+            changed_calls, _ = count_detections(stacker)
+            if changed_calls != len(paths):
+                print("✗ 检测参数变化后未重新检测")
+                return False
+            print("✓ 检测参数变化后重新检测")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 星点缓存测试失败: {e}")
+        return False
+
+def test_checkpoint_resume():
+    """测试中断的堆叠可以从检查点继续：流式累加只处理未累加的帧，其他引擎已配准的帧不再配准，结果与不中断时一致"""
+    print("\n测试检查点续堆...")
+    
+    try:
+        import tempfile
+        import numpy as np
+        from src.modules.stacking.checkpoint import StackingCheckpoint, INTEGRATED, ALIGNED, PENDING
+        from src.modules.stacking.processor import AstroStacker
+        
+        frames = make_star_frames(count=8)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = save_frames(frames, directory)
+            checkpoints = os.path.join(directory, 'checkpoints')
+            
+            # (堆叠方法, 引擎, 流水线, 在第几次变换时取消)：sigma_clip在第二遍中取消，
+            # median 不能逐帧累加，检查点只记录配准结果
+            for method, engine, pipeline, cancel_at in (
+                    ('average', 'streaming', False, 4), ('sigma_clip', 'streaming', False, 10),
+                    ('average', 'streaming', True, 4), ('median', 'memory', False, 4),
+                    ('median', 'out_of_core', False, 4), ('median', 'streaming', True, 4)):
+                label = f"{method}/{engine}{'（流水线）' if pipeline else ''}"
+                accumulating = method != 'median'
+                
+                def make_stacker():
+                    stacker = AstroStacker()
+                    stacker.set_cache_params(enabled=False)
+                    stacker.set_checkpoint_params(enabled=True, directory=checkpoints, frame_interval=1)
+                    stacker.set_stacking_params(method=method, engine=engine, pipeline=pipeline)
+                    return stacker
+                
+                expected = make_stacker().process_stack(paths)
+                if expected is None or make_stacker().has_checkpoint(paths):
+                    print(f"✗ {label} 完成后应删除检查点")
+                    return False
+                
+                # 第 cancel_at 次变换时取消
+                stacker = make_stacker()
+                warps = []
+                original = stacker.warp_frame
+                def warp_then_cancel(*args, **kwargs):
+                    warps.append(1)
+                    if len(warps) >= cancel_at:
+                        stacker.cancel_processing()
+                    return original(*args, **kwargs)
+                stacker.warp_frame = warp_then_cancel
+                if stacker.process_stack(paths) is not None:
+                    print(f"✗ {label} 堆叠未能取消")
+                    return False
+                checkpoint = StackingCheckpoint.load(stacker.checkpoint_location(paths))
+                if checkpoint is None or (accumulating and checkpoint.state is None):
+                    print(f"✗ {label} 取消后没有保存检查点")
+                    return False
+                counts = checkpoint.counts()
+                registered = [path for path in paths[1:] if checkpoint.status.get(path) == ALIGNED]
+                if not accumulating and not (registered and all(path in checkpoint.transforms
+                                                                for path in registered)):
+                    print(f"✗ {label} 检查点中没有已配准帧的变换矩阵")
+                    return False
+                if not pipeline and not all(checkpoint.frame_stars.get(path) for path in registered):
+                    print(f"✗ {label} 检查点中没有已配准帧的星点")
+                    return False
+                
+                # 新的堆叠器（参数不同，继续时从检查点恢复）
+                resumed = AstroStacker()
+                resumed.set_checkpoint_params(directory=checkpoints)
+                resumed.set_stacking_params(method='average', engine='memory')
+                loads, detections = [], []
+                original_load = resumed.load_frame
+                resumed.load_frame = lambda path: loads.append(path) or original_load(path)
+                original_detect = resumed.detect_frame
+                resumed.detect_frame = lambda image: detections.append(1) or original_detect(image)
+                result = resumed.resume_stack(paths)
+                if result is None or not np.array_equal(result, expected):
+                    print(f"✗ {label} 从检查点继续的结果与不中断时不一致")
+                    return False
+                if resumed.has_checkpoint(paths):
+                    print(f"✗ {label} 继续完成后应删除检查点")
+                    return False
+                if method == 'average' and not pipeline and len(loads) != 1 + counts[PENDING]:
+                    print(f"✗ 应只解码参考图像和 {counts[PENDING]} 张未累加的图像，实际解码 {len(loads)} 张")
+                    return False
+                if not accumulating and not pipeline and len(detections) != counts[PENDING]:
+                    print(f"✗ {label} 应只检测 {counts[PENDING]} 张未配准图像的星点，实际检测 {len(detections)} 次")
+                    return False
+                print(f"✓ {label} 在第 {checkpoint.current_pass + 1} 遍中断（已累加 {counts[INTEGRATED]} 张，"
+                      f"已配准 {counts[ALIGNED]} 张）后继续，结果一致")
+            
+            stacker = AstroStacker()
+            stacker.set_checkpoint_params(directory=checkpoints)
+            if stacker.resume_stack(paths) is not None:
+                print("✗ 没有检查点时不应继续")
+                return False
+            print("✓ 没有检查点时不继续")
+            
+            # 每个任务有各自的检查点文件：参数不同的任务不覆盖、不删除其他任务的检查点，未开启时不读写
+            def interrupted_job(method, enabled=True):
+                stacker = AstroStacker()
+                stacker.set_cache_params(enabled=False)
+                stacker.set_checkpoint_params(enabled=enabled, directory=checkpoints, frame_interval=1)
+                stacker.set_stacking_params(method=method, engine='streaming')
+                original = stacker.warp_frame
+                def warp_then_cancel(*args, **kwargs):
+                    stacker.cancel_processing()
+                    return original(*args, **kwargs)
+                stacker.warp_frame = warp_then_cancel
+                stacker.process_stack(paths)
+                return stacker
+            
+            def checkpoint_files():
+                return {name: os.stat(os.path.join(checkpoints, name)).st_mtime_ns
+                        for name in os.listdir(checkpoints) if name.endswith('.npz')}
+            
+            average = interrupted_job('average').checkpoint_location(paths)
+            before = checkpoint_files()
+            for method in ('average', 'maximum'):
+                interrupted_job(method, enabled=False)
+            if checkpoint_files() != before:
+                print("✗ 未开启检查点的任务不应读写检查点")
+                return False
+            maximum = interrupted_job('maximum').checkpoint_location(paths)
+            if maximum == average or set(checkpoint_files()) != {os.path.basename(average),
+                                                                 os.path.basename(maximum)}:
+                print("✗ 参数不同的任务应各有一个检查点，且不删除其他任务的检查点")
+                return False
+            stacker = AstroStacker()
+            stacker.set_checkpoint_params(directory=checkpoints)
+            if stacker.find_checkpoint(paths) != maximum:
+                print("✗ 应从最近写入的检查点继续")
+                return False
+            if stacker.resume_stack(paths) is None or set(checkpoint_files()) != {os.path.basename(average)}:
+                print("✗ 继续完成后应只删除本任务的检查点")
+                return False
+            print("✓ 每个任务各有一个检查点，未开启时不读写，完成时只删除本任务的检查点")
+            
+            # 进程池对齐时工作进程检测的星点传回主进程写入检查点
+            stacker = AstroStacker()
+            stacker.set_cache_params(enabled=False)
+            stacker.set_alignment_params(workers=2, executor='process')
+            stacker.set_checkpoint_params(enabled=True, directory=checkpoints)
+            stacker.checkpoint_file = stacker.checkpoint_location(paths)
+            stacker.load_images(paths)
+            stacker.start_checkpoint(None, stacker.frame_records)
+            try:
+                if not stacker.align_images() or set(stacker.checkpoint.frame_stars) != set(paths):
+                    print("✗ 进程池对齐时检查点中缺少星点")
+                    return False
+            finally:
+                stacker.close_checkpoint(True)
+            print("✓ 进程池对齐的星点写入检查点")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 检查点续堆测试失败: {e}")
+        return False
+
+def test_restack():
+    """测试只修改堆叠参数时复用图像和变换矩阵重新堆叠"""
+    print("\n测试重新堆叠...")
+    
+    try:
+        import tempfile
+        import numpy as np
+        from src.modules.stacking.processor import AstroStacker
+        
+        frames = make_star_frames(count=6)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = save_frames(frames, directory)
+            
+            stacker = AstroStacker()
+            if stacker.process_stack(paths) is None:
+                print("✗ 首次堆叠失败")
+                return False
+            
+            calls = []
+            stacker.load_images = lambda image_paths: calls.append('load')
+            stacker.match_stars = lambda ref, cur: calls.append('match')
+            stacker.set_stacking_params(method='median')
+            restacked = stacker.restack(paths)
+            if restacked is None or calls:
+                print(f"✗ 重新堆叠时重复了加载或匹配: {calls}")
+                return False
+            
+            fresh = AstroStacker()
+            fresh.set_cache_params(enabled=False)
+            fresh.set_stacking_params(method='median')
+            expected = fresh.process_stack(paths)
+            if not np.array_equal(restacked, expected):
+                print("✗ 重新堆叠结果与完整堆叠不一致")
+                return False
+            print("✓ 重新堆叠跳过了加载和对齐，结果一致")
+            
+            # 新的堆叠器从磁盘缓存读取变换矩阵，不再匹配星点
+            cached = AstroStacker()
+            matches = []
+            original = cached.match_stars
+            cached.match_stars = lambda ref, cur: matches.append(1) or original(ref, cur)
+            cached.set_stacking_params(method='sigma_clip', engine='streaming')
+            if cached.process_stack(paths) is None or matches:
+                print(f"✗ 变换缓存未命中 (匹配 {len(matches)} 次)")
+                return False
+            if set(cached.transforms) != set(stacker.transforms):
+                print("✗ 缓存的变换与首次对齐不一致")
+                return False
+            print("✓ 变换矩阵从缓存读取，跳过了星点匹配")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 重新堆叠测试失败: {e}")
+        return False
+
+def test_calibration():
+    """测试主暗场/平场合成、磁盘缓存和加载时校准"""
+    print("\n测试校准帧...")
+    
+    try:
+        import tempfile
+        import time
+        import numpy as np
+        from src.modules.stacking.processor import AstroStacker
+        
+        h, w = size = (240, 320)
+        rng = np.random.default_rng(7)
+        yy, xx = np.mgrid[0:h, 0:w]
+        # 暗角和固定图案的暗电流
+        vignette = 1.0 - 0.4 * (((xx - w / 2) / w) ** 2 + ((yy - h / 2) / h) ** 2)[..., None]
+        pattern = rng.integers(0, 12, size=(h, w, 1)).astype(np.float32)
+        
+        def frame(value, dark=True):
+            noisy = value + (pattern + rng.normal(0, 0.5, size=(h, w, 1)) if dark else 0)
+            return np.repeat(np.clip(np.rint(noisy), 0, 255), 3, axis=2).astype(np.uint8)
+        
+        clean = make_star_frames(count=4, size=size)
+        lights = [frame(f[..., :1].astype(np.float32) * vignette) for f in clean]
+        darks = [frame(np.zeros((h, w, 1), dtype=np.float32)) for _ in range(5)]
+        flats = [frame(200 * vignette, dark=False) for _ in range(3)]
+        
+        with tempfile.TemporaryDirectory() as directory:
+            groups = {}
+            for name, frames in (('lights', lights), ('darks', darks), ('flats', flats)):
+                os.mkdir(os.path.join(directory, name))
+                groups[name] = save_frames(frames, os.path.join(directory, name))
+            
+            stacker = AstroStacker()
+            stacker.set_calibration_frames(dark=groups['darks'], flat=groups['flats'])
+            if not stacker.prepare_calibration():
+                print("✗ 主校准帧生成失败")
+                return False
+            
+            # 校准后应恢复为去除暗场、暗角均匀的图像
+            expected = clean[0].astype(np.float32) * vignette.mean()
+            start = time.perf_counter()
+            calibrated = stacker.load_frame(groups['lights'][0])
+            elapsed = (time.perf_counter() - start) * 1000
+            # 饱和的星点核心无法校准
+            unsaturated = (lights[0] < 250) & (clean[0] < 250)
+            raw_error = np.abs(stacker.decode_frame(groups['lights'][0]) - expected)[unsaturated].mean()
+            error = np.abs(calibrated.astype(np.float32) - expected)[unsaturated].mean()
+            if error > 1 or raw_error < 5:
+                print(f"✗ 校准平均误差 {error:.2f} (未校准 {raw_error:.2f})")
+                return False
+            print(f"✓ 暗场和平场校准平均误差 {error:.2f} (未校准 {raw_error:.2f})，加载并校准耗时 {elapsed:.1f}ms")
+            
+            # 输入不变时主校准帧从磁盘缓存读取
+            cached = AstroStacker()
+            cached.set_calibration_frames(dark=groups['darks'], flat=groups['flats'])
+            combined = []
+            cached.combine_frames = lambda paths, method: combined.append(method)
+            if not cached.prepare_calibration() or combined:
+                print("✗ 主校准帧缓存未命中")
+                return False
+            if not np.array_equal(cached.load_frame(groups['lights'][0]), calibrated):
+                print("✗ 缓存的主校准帧与新生成的不一致")
+                return False
+            print("✓ 主校准帧从缓存读取")
+
+            # 平场也带有暗电流：只有暗场时从平场中扣除暗场，有平场暗场时扣除平场暗场
+            pedestal = rng.integers(20, 40, size=(h, w, 1)).astype(np.float32)
+            dark_flats = [frame(200 * vignette) for _ in range(3)]
+            offset_flats = [np.repeat(np.rint(200 * vignette + pedestal), 3, axis=2).astype(np.uint8)
+                            for _ in range(3)]
+            flat_darks = [np.repeat(pedestal, 3, axis=2).astype(np.uint8) for _ in range(3)]
+            for name, frames in (('dark_flats', dark_flats), ('offset_flats', offset_flats),
+                                 ('flat_darks', flat_darks)):
+                os.mkdir(os.path.join(directory, name))
+                groups[name] = save_frames(frames, os.path.join(directory, name))
+
+            for label, settings in (("只有暗场", dict(dark=groups['darks'], flat=groups['dark_flats'])),
+                                    ("平场暗场", dict(dark=groups['darks'], flat=groups['offset_flats'],
+                                                     flat_dark=groups['flat_darks']))):
+                subtracted = AstroStacker()
+                subtracted.set_calibration_frames(**settings)
+                if not subtracted.prepare_calibration():
+                    print(f"✗ {label}时主校准帧生成失败")
+                    return False
+                gain = subtracted.calibration.gain[..., 0]
+                flat_error = np.abs(gain - (vignette.mean() / vignette[..., 0])).max()
+                if flat_error > 0.02:
+                    print(f"✗ {label}时平场增益未扣除暗信号 (最大误差 {flat_error:.3f})")
+                    return False
+                print(f"✓ {label}时平场先扣除暗信号再归一化 (增益最大误差 {flat_error:.3f})")
+
+            # 完整堆叠流程中加载时校准
+            result = stacker.process_stack(groups['lights'])
+            if result is None or len(stacker.transforms) != len(lights):
+                print("✗ 带校准的堆叠失败")
+                return False
+            print(f"✓ 带校准堆叠 {len(stacker.transforms)} 张图像")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 校准帧测试失败: {e}")
+        return False
+
+def test_defect_map():
+    """测试由亮场时间统计和暗场检测热像素，加载时替换后不再被检测为星点"""
+    print("\n测试热像素校正...")
+    
+    try:
+        import tempfile
+        import numpy as np
+        from src.modules.stacking.processor import AstroStacker
+        from src.modules.stacking.defects import find_defects_in_dark
+        
+        clean = make_star_frames(count=8)
+        h, w = clean[0].shape[:2]
+        rng = np.random.default_rng(3)
+        # 去马赛克后的热像素通常是2×2的亮块，会被检测为星点
+        ys, xs = rng.integers(5, h - 6, 20), rng.integers(5, w - 6, 20)
+        hot = {(y + dy) * w + x + dx for y, x in zip(ys, xs) for dy in (0, 1) for dx in (0, 1)}
+        frames = [frame.copy() for frame in clean]
+        for frame in frames:
+            for y, x in zip(ys, xs):
+                frame[y:y + 2, x:x + 2] = 255
+        
+        with tempfile.TemporaryDirectory() as directory:
+            paths = save_frames(frames, directory)
+            stacker = AstroStacker()
+            stacker.set_defect_params(enabled=True)
+            stacker.prepare_defect_map(paths)
+            if stacker.defect_map is None:
+                print("✗ 未生成坏像素表")
+                return False
+            found = set(stacker.defect_map.indices.tolist())
+            if len(found & hot) < 0.9 * len(hot) or len(found - hot) > 2:
+                print(f"✗ 找到 {len(found & hot)}/{len(hot)} 个热像素，误检 {len(found - hot)} 个")
+                return False
+            print(f"✓ 时间统计找到 {len(found & hot)}/{len(hot)} 个热像素，误检 {len(found - hot)} 个")
+            
+            raw = len(stacker.detect_stars(stacker.decode_frame(paths[3])))
+            repaired = len(stacker.detect_stars(stacker.load_frame(paths[3])))
+            expected = len(stacker.detect_stars(clean[3]))
+            if repaired > expected + 2:
+                print(f"✗ 校正后仍检测到 {repaired} 个星点 (无热像素时 {expected})")
+                return False
+            print(f"✓ 校正后星点数 {raw} -> {repaired} (无热像素时 {expected})")
+        
+        # 主暗场中的热像素
+        dark = rng.normal(20, 1, size=(h, w, 3)).astype(np.float32)
+        dark.reshape(-1, 3)[list(hot)] = 200
+        if set(find_defects_in_dark(dark).tolist()) != hot:
+            print("✗ 暗场热像素检测不正确")
+            return False
+        print("✓ 暗场热像素检测正确")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 热像素校正测试失败: {e}")
+        return False
+
+def test_live_stacking():
+    """测试实时堆叠逐帧加入新文件，每帧只加载一次，结果与完整堆叠一致"""
+    print("\n测试实时堆叠...")
+    
+    try:
+        import shutil
+        import tempfile
+        import threading
+        import time
+        import numpy as np
+        from src.modules.stacking.processor import AstroStacker
+        
+        frames = make_star_frames(count=6)
+        with tempfile.TemporaryDirectory() as staging, tempfile.TemporaryDirectory() as watched:
+            paths = save_frames(frames, staging)
+            
+            stacker = AstroStacker()
+            stacker.set_cache_params(enabled=False)
+            stacker.set_live_params(poll_interval=0.05, preview_interval=0)
+            loads = []
+            original = stacker.load_frame
+            stacker.load_frame = lambda path: loads.append(path) or original(path)
+            previews = []
+            progress = []
+            outcome = {}
+            thread = threading.Thread(target=lambda: outcome.update(
+                result=stacker.run_live_stack(watched, preview_callback=previews.append,
+                                              progress_callback=lambda message, value: progress.append(value))))
+            thread.start()
+            
+            def wait_for(count):
+                deadline = time.time() + 20
+                while len(stacker.transforms) < count and time.time() < deadline:
+                    time.sleep(0.05)
+                return len(stacker.transforms) >= count
+            
+            # 相机分两批写入文件
+            for batch in (paths[:3], paths[3:]):
+                for path in batch:
+                    shutil.copy(path, watched)
+                ready = wait_for(paths.index(batch[-1]) + 1)
+                if not ready:
+                    break
+            stacker.cancel_processing()
+            thread.join(timeout=10)
+            
+            result = outcome.get('result')
+            if not ready or result is None:
+                print(f"✗ 实时堆叠只对齐了 {len(stacker.transforms)}/{len(paths)} 张")
+                return False
+            if len(loads) != len(paths) or len(previews) < 2:
+                print(f"✗ 加载 {len(loads)} 次 (应为 {len(paths)})，预览 {len(previews)} 次")
+                return False
+            print(f"✓ 实时堆叠对齐 {len(paths)} 张，每帧只加载一次，预览刷新 {len(previews)} 次")
+            
+            # 对齐阶段的进度不超过70%，停止后生成结果时才继续
+            if max(progress[:-2]) > 70 or progress[-2:] != [75, 95]:
+                print(f"✗ 实时堆叠进度阶段错误: {progress}")
+                return False
+            print("✓ 实时堆叠进度与其他引擎的阶段范围一致")
+            
+            fresh = AstroStacker()
+            fresh.set_cache_params(enabled=False)
+            expected = fresh.process_stack(paths)
+            difference = np.abs(result.astype(np.int16) - expected.astype(np.int16)).max()
+            if difference > 1:
+                print(f"✗ 实时堆叠结果与完整堆叠不一致 (最大差异 {difference})")
+                return False
+            print(f"✓ 实时堆叠结果与完整堆叠一致 (最大差异 {difference})")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 实时堆叠测试失败: {e}")
+        return False
+
+def test_high_bit_depth():
+    """测试16位读取、float32计算和16位/浮点输出"""
+    print("\n测试高位深堆叠...")
+    
+    try:
+        import tempfile
+        import numpy as np
+        import cv2
+        from src.modules.stacking.processor import AstroStacker
+        
+        frames = make_star_frames(count=4)
+        with tempfile.TemporaryDirectory() as directory:
+            # 16位PNG，低8位带有8位图像无法表示的暗弱信号
+            paths = []
+            for i, frame in enumerate(frames):
+                path = os.path.join(directory, f"frame_{i:03d}.png")
+                data = frame.astype(np.uint16) * 256 + 100
+                cv2.imwrite(path, cv2.cvtColor(data, cv2.COLOR_RGB2BGR))
+                paths.append(path)
+            
+            stacker = AstroStacker()
+            stacker.set_stacking_params(bit_depth=16)
+            if not stacker.load_images(paths) or stacker.reference_image.dtype != np.uint16:
+                print("✗ 未按16位读取图像")
+                return False
+            
+            for engine in ('memory', 'streaming'):
+                stacker.set_stacking_params(engine=engine)
+                result = stacker.process_stack(paths)
+                if result is None or result.dtype != np.uint16:
+                    print(f"✗ {engine} 引擎未输出16位结果")
+                    return False
+            print(f"✓ 16位图像读取和堆叠 (结果最大值 {result.max()})")
+            
+            output_path = os.path.join(directory, "stacked.tif")
+            if not stacker.save_result(result, output_path):
+                print("✗ 保存16位TIFF失败")
+                return False
+            saved = cv2.cvtColor(cv2.imread(output_path, cv2.IMREAD_UNCHANGED), cv2.COLOR_BGR2RGB)
+            if saved.dtype != np.uint16 or not np.array_equal(saved, result):
+                print("✗ 保存的16位TIFF与结果不一致")
+                return False
+            print("✓ 16位结果保存为TIFF")
+            
+            stacker.set_stacking_params(bit_depth=32)
+            result = stacker.process_stack(paths)
+            output_path = os.path.join(directory, "stacked_float.tif")
+            if (result is None or result.dtype != np.float32 or result.max() > 1.0 or
+                    not stacker.save_result(result, output_path)):
+                print("✗ 浮点结果输出失败")
+                return False
+            if cv2.imread(output_path, cv2.IMREAD_UNCHANGED).dtype != np.float32:
+                print("✗ 保存的TIFF不是浮点格式")
+                return False
+            print("✓ 32位浮点结果保存为TIFF")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ 高位深堆叠测试失败: {e}")
+        return False
+
 def main():
     """主测试函数"""
     print("=" * 50)
@@ -103,6 +1856,131 @@ def main():
         print("\n❌ AstroStacker 测试失败")
         return False
     
+    # 测试星点检测
+    if not test_star_detection():
+        print("\n❌ 星点检测测试失败")
+        return False
+    
+    # 测试星点匹配
+    if not test_star_matching():
+        print("\n❌ 星点匹配测试失败")
+        return False
+    
+    # 测试星组匹配
+    if not test_asterism_matching():
+        print("\n❌ 星组匹配测试失败")
+        return False
+    
+    # 测试金字塔配准
+    if not test_pyramid_registration():
+        print("\n❌ 金字塔配准测试失败")
+        return False
+    
+    # 测试相位相关配准
+    if not test_phase_registration():
+        print("\n❌ 相位相关配准测试失败")
+        return False
+    
+    # 测试预测配准
+    if not test_predictive_registration():
+        print("\n❌ 预测配准测试失败")
+        return False
+    
+    # 测试并行对齐
+    if not test_parallel_alignment():
+        print("\n❌ 并行对齐测试失败")
+        return False
+    
+    # 测试帧质量评估
+    if not test_frame_quality():
+        print("\n❌ 帧质量评估测试失败")
+        return False
+    
+    # 测试堆叠前预检
+    if not test_preview_triage():
+        print("\n❌ 堆叠前预检测试失败")
+        return False
+    
+    # 测试RAW解码
+    if not test_raw_ingestion():
+        print("\n❌ RAW解码测试失败")
+        return False
+    
+    # 测试拜耳阵列配准
+    if not test_cfa_registration():
+        print("\n❌ 拜耳阵列配准测试失败")
+        return False
+    
+    # 测试帧句柄
+    if not test_frame_handles():
+        print("\n❌ 帧句柄测试失败")
+        return False
+    
+    # 测试共享内存帧传输
+    if not test_shared_frame_transport():
+        print("\n❌ 共享内存帧传输测试失败")
+        return False
+    
+    # 测试星点缓存
+    if not test_star_cache():
+        print("\n❌ 星点缓存测试失败")
+        return False
+    
+    # 测试流式堆叠
+    if not test_streaming_engine():
+        print("\n❌ 流式堆叠测试失败")
+        return False
+    
+    # 测试磁盘映射堆叠
+    if not test_out_of_core_engine():
+        print("\n❌ 磁盘映射堆叠测试失败")
+        return False
+    
+    # 测试像素拒绝堆叠
+    if not test_rejection_stacking():
+        print("\n❌ 像素拒绝堆叠测试失败")
+        return False
+    
+    # 测试中值选择
+    if not test_median_selection():
+        print("\n❌ 中值选择测试失败")
+        return False
+    
+    # 测试流水线堆叠
+    if not test_pipelined_stacking():
+        print("\n❌ 流水线堆叠测试失败")
+        return False
+    
+    # 测试检查点续堆
+    if not test_checkpoint_resume():
+        print("\n❌ 检查点续堆测试失败")
+        return False
+    
+    # 测试重新堆叠
+    if not test_restack():
+        print("\n❌ 重新堆叠测试失败")
+        return False
+    
+    # 测试高位深堆叠
+    if not test_high_bit_depth():
+        print("\n❌ 高位深堆叠测试失败")
+        return False
+    
+    # 测试校准帧
+    if not test_calibration():
+        print("\n❌ 校准帧测试失败")
+        return False
+    
+    # 测试热像素校正
+    if not test_defect_map():
+        print("\n❌ 热像素校正测试失败")
+        return False
+    
+    # 测试实时堆叠
+    if not test_live_stacking():
+        print("\n❌ 实时堆叠测试失败")
+        return False
+    
     print("\n" + "=" * 50)
     print("🎉 所有测试通过！星空堆叠功能已准备就绪")
     print("=" * 50)